@@ -23,7 +23,11 @@ import bpy
 from bpy.props import StringProperty, BoolProperty, FloatProperty, IntProperty, EnumProperty, PointerProperty
 from bpy.types import Operator, Panel, Scene, Menu, AddonPreferences, PropertyGroup
 
-from .generator_operators import MakeTreeOperator, BatchTreeOperator, MakeTwigOperator, UpdateTreeOperator, UpdateTwigOperator, SetupNodeTreeOperator
+from .generator_operators import MakeTreeOperator, BatchTreeOperator, MakeTwigOperator, UpdateTreeOperator, UpdateTwigOperator, SetupNodeTreeOperator, \
+    PreviewTreeOperator, StreamTreeOperator
+from .tree_creator import update_live_preview
+from .telemetry import GenerationLogPanel
+from .cost_estimate import draw_cost_estimate
 from .presets import TreePresetLoadMenu, TreePresetRemoveMenu, SaveTreePresetOperator, InstallTreePresetOperator, RemoveTreePresetOperator, LoadTreePresetOperator
 from .logo import display_logo
 from .wind_setup_utils import WindOperator, MakeControllerOperator, MakeTerrainOperator
@@ -72,11 +76,67 @@ class TreeAddonPrefs(AddonPreferences):
         description="Always save texts before executing " +
                     "time-consuming operations")
 
+    save_timing = EnumProperty(
+        name="Save Timing",
+        items=[('BEFORE', "Before", "Save before the operation, the saved file is safe if it fails"),
+               ('AFTER', "After", "Save once the operation is finished, so that it starts right away")],
+        default='BEFORE',
+        description="When to save the file, images and texts for time-consuming operations. "
+                    "Nothing is saved if it has not changed since it was last saved")
+
+    background_generation = BoolProperty(
+        name="Grow Trees in the Background",
+        default=False,
+        description="Make Tree and Update Selected Tree grow the tree in a separate thread so that Blender stays "
+                    "responsive, only the meshing freezes it. Not used with the node workflow, force fields or "
+                    "obstacles. Starting another generation cancels the one still growing")
+
     preset_file = StringProperty(
         name="Preset File",
         description="Preset File",
         subtype='FILE_PATH')
 
+    profile_file = StringProperty(
+        name="Profile File",
+        description="If set, the time of each generation stage is written to this JSON file after "
+                    "Make Tree and Batch Tree Generation, with min/mean/p95 over the trees of a batch",
+        subtype='FILE_PATH')
+
+    memory_profiling = EnumProperty(
+        name="Memory Profiling",
+        items=[('NONE', "None", "Don't measure memory"),
+               ('RSS', "Process", "Measure the memory of the whole Blender process at each stage, cheap but "
+                                  "doesn't say where the memory goes"),
+               ('TRACEMALLOC', "Python", "Trace Python allocations at each stage and name the lines allocating "
+                                         "the most, much slower and blind to Blender's own memory")],
+        default='NONE',
+        description="Measure memory at each generation stage of Make Tree, Batch Tree Generation and Create Twig, "
+                    "the results are printed to the console and written to the profile file")
+
+    memory_top_lines = IntProperty(
+        name="Top Lines",
+        min=0,
+        soft_max=20,
+        default=3,
+        description="The number of biggest allocating code lines reported per stage by Python memory profiling")
+
+    telemetry = BoolProperty(
+        name="Generation Log",
+        default=False,
+        description="Append a line with the settings hash, seed, size, stage timings and peak memory of each "
+                    "generated tree to a local log, the last one is shown in the Generation Log panel")
+
+    telemetry_file = StringProperty(
+        name="Log File",
+        description="Where to write the generation log, in the Blender config directory if empty",
+        subtype='FILE_PATH')
+
+    telemetry_max_size = IntProperty(
+        name="Max Log Size (MB)",
+        min=0,
+        default=5,
+        description="The log is rotated when it gets bigger than this, the last 3 logs are kept. 0 to never rotate")
+
     # third party add-on updater
     auto_check_update = bpy.props.BoolProperty(
         name="Auto-check for Update",
@@ -118,6 +178,8 @@ class TreeAddonPrefs(AddonPreferences):
         col.prop(self, 'always_save_prior')
         col.prop(self, 'save_all_images')
         col.prop(self, 'save_all_texts')
+        col.prop(self, 'save_timing')
+        col.prop(self, 'background_generation')
 
         row = layout.row()
         # website url
@@ -131,6 +193,17 @@ class TreeAddonPrefs(AddonPreferences):
         box.prop(self, 'preset_file')
         box.operator("mod_tree.install_preset")
 
+        box = layout.box()
+        box.label("Profiling")
+        box.prop(self, 'profile_file')
+        box.prop(self, 'memory_profiling')
+        if self.memory_profiling == 'TRACEMALLOC':
+            box.prop(self, 'memory_top_lines')
+        box.prop(self, 'telemetry')
+        if self.telemetry:
+            box.prop(self, 'telemetry_file')
+            box.prop(self, 'telemetry_max_size')
+
         addon_updater_ops.update_settings_ui(self, context)
 
 
@@ -150,10 +223,22 @@ class MakeTreePanel(Panel):
         row.scale_y = 1.5
         row.operator("mod_tree.add_tree", icon="WORLD")
 
+        row = layout.row()
+        row.operator("mod_tree.stream_tree", icon="TIME")
+
         row = layout.row()
         row.scale_y = 1.5
         row.operator("mod_tree.update_tree", icon="FILE_REFRESH")
 
+        row = layout.row()
+        row.operator("mod_tree.update_tree", text="Re-mesh Selected Tree", icon="MOD_REMESH").remesh = True
+
+        row = layout.row(align=True)
+        row.operator("mod_tree.preview_tree", icon="OUTLINER_OB_ARMATURE")
+        row.prop(mtree_props, "live_preview", toggle=True, icon="RESTRICT_VIEW_OFF")
+
+        draw_cost_estimate(layout.box(), mtree_props)
+
         box = layout.box()
         box.label("Basic")
         box.prop(mtree_props, 'use_node_workflow')
@@ -198,9 +283,18 @@ class BatchTreePanel(Panel):
 
         if not mtree_props.use_grease_pencil:
             row.operator("mod_tree.batch_tree", icon_value=get_icon("BATCH_TREE"))
+            box = layout.box()
+            box.prop(mtree_props, 'batch_mode', expand=True)
             box.prop(mtree_props, 'tree_number')
-     
-            
+            if mtree_props.batch_mode == 'INSTANCES':
+                box.prop(mtree_props, 'batch_variants')
+                box.prop(mtree_props, 'batch_instance_type')
+                box.prop(mtree_props, 'batch_scale_randomness')
+            box.prop(mtree_props, 'batch_space')
+            box.prop_search(mtree_props, "batch_group_name", bpy.data, "groups")
+            box.prop(mtree_props, 'batch_memory_budget')
+
+
 
 class RootsAndTrunksPanel(Panel):
     bl_label = "Roots and Trunk"
@@ -340,12 +434,29 @@ class AdvancedSettingsPanel(Panel):
                 box.prop(mtree_props, 'create_armature')
                 if mtree_props.create_armature:
                     box.prop(mtree_props, 'bones_iterations')
+                    box.prop(mtree_props, 'bones_target')
+                    box.prop(mtree_props, 'bones_merge_angle')
+                    box.prop(mtree_props, 'bones_min_length')
+                    box.prop(mtree_props, 'bones_min_radius')
+                box.prop(mtree_props, 'lod_levels')
+                if mtree_props.lod_levels > 0:
+                    box.prop(mtree_props, 'lod_min_radius')
+                box.prop(mtree_props, 'adaptive_rings')
+                if mtree_props.adaptive_rings:
+                    box.prop(mtree_props, 'adaptive_ring_radius')
                 box.prop(mtree_props, 'leafs_iteration_length')
                 box.prop(mtree_props, 'particle')
                 if mtree_props.particle:
-                    box.prop(mtree_props, 'create_particle_emitter')
+                    box.prop(mtree_props, 'leaf_instancing', expand=True)
+                    if mtree_props.leaf_instancing == 'PARTICLES':
+                        box.prop(mtree_props, 'create_particle_emitter')
                     box.prop(mtree_props, 'number')
-                    box.prop(mtree_props, 'display')
+                    if mtree_props.leaf_instancing == 'PARTICLES':
+                        box.prop(mtree_props, 'display')
+                    else:
+                        box.prop(mtree_props, 'leaf_clump_size')
+                        if mtree_props.leaf_clump_size > 0:
+                            box.prop(mtree_props, 'leaf_clump_variants')
                     box.prop_search(mtree_props, "twig_particle", scene, "objects")
                     box.prop(mtree_props, 'particle_size')
                 box = layout.box()
@@ -366,6 +477,13 @@ class AdvancedSettingsPanel(Panel):
                 if mtree_props.pruning:
                     box.prop(mtree_props, 'pruning_intensity')
 
+            box = layout.box()
+            box.label("Budgets")
+            col = box.column(align=True)
+            col.prop(mtree_props, 'max_vertices')
+            col.prop(mtree_props, 'max_extremities')
+            col.prop(mtree_props, 'max_growth_time')
+
 
 class WindAnimationPanel(Panel):
     bl_label = "Wind Animation"
@@ -604,11 +722,69 @@ class ModularTreePropertyGroup(PropertyGroup):
         name='Bones Iterations',
         default=8)
 
+    bones_target = IntProperty(
+        name="Bone Budget",
+        min=0,
+        default=0,
+        description="Maximum number of bones of the armature, the thinnest branch ends are dropped first. "
+                    "0 for no limit")
+
+    bones_merge_angle = FloatProperty(
+        name="Bones Merge Angle",
+        min=0,
+        max=90,
+        default=0,
+        description="A bone is merged into its parent when it is its only child and the angle between them is "
+                    "smaller than this, in degrees")
+
+    bones_min_length = FloatProperty(
+        name="Bones Min Length",
+        min=0,
+        default=0,
+        description="Bones shorter than this are dropped, their vertices follow the parent bone")
+
+    bones_min_radius = FloatProperty(
+        name="Bones Min Radius",
+        min=0,
+        default=0,
+        description="Bones of branches thinner than this are dropped, their vertices follow the parent bone")
+
     leafs_iteration_length = IntProperty(
         name='Leafs Group Length',
         default=4,
         description="The number of branches iterations where leafs will appear")
 
+    live_preview = BoolProperty(
+        name="Live",
+        default=False,
+        description="Rebuild the skeleton preview each time a setting of the tree changes")
+
+    lod_levels = IntProperty(
+        name="LOD Levels",
+        min=0,
+        max=3,
+        default=0,
+        description="Number of lower detail meshes (LOD1 to LOD3) built from the same growth as the tree")
+
+    lod_min_radius = FloatProperty(
+        name="LOD Min Radius",
+        min=0,
+        default=.05,
+        description="Branches thinner than this fraction of the trunk radius are dropped from LOD1. "
+                    "The threshold doubles for each following LOD")
+
+    adaptive_rings = BoolProperty(
+        name="Adaptive Rings",
+        default=False,
+        description="Thin branches are made of rings of 6, 4 and then 3 vertices instead of 8")
+
+    adaptive_ring_radius = FloatProperty(
+        name="Adaptive Rings Radius",
+        min=0,
+        default=.25,
+        description="Branches thinner than this fraction of the trunk radius lose ring vertices, "
+                    "one more step each time the radius halves")
+
     uv = BoolProperty(
         name="Unwrap",
         default=False,
@@ -666,6 +842,28 @@ class ModularTreePropertyGroup(PropertyGroup):
         min=0,
         description="radius at which a branch breaks for being to small")
 
+    max_vertices = IntProperty(
+        name="Max Vertices",
+        min=0,
+        default=3000000,
+        description="The growth caps its thinnest branches before the tree mesh gets over this many vertices. "
+                    "0 for no limit")
+
+    max_extremities = IntProperty(
+        name="Max Branch Ends",
+        min=0,
+        default=10000,
+        description="The most branch ends that can grow in one iteration, the thinnest ones are capped beyond. "
+                    "0 for no limit")
+
+    max_growth_time = FloatProperty(
+        name="Max Growth Time",
+        min=0,
+        default=120,
+        subtype='TIME',
+        unit='TIME',
+        description="Every branch is capped once the growth took longer than this. 0 for no limit")
+
     particle = BoolProperty(
         name="Configure Particle System",
         default=False)
@@ -674,6 +872,28 @@ class ModularTreePropertyGroup(PropertyGroup):
         name='create particle emitter',
         default=True)
 
+    leaf_instancing = EnumProperty(
+        name="Leaves",
+        items=[
+            ('PARTICLES', 'Particles', "Leaves are distributed by a particle system, evaluated on every update", 0),
+            ('FACES', 'Precomputed', "Leaf transforms are computed once at generation and the leaf object is "
+                                     "instanced on one face per leaf, without any particle evaluation", 1)],
+        default='PARTICLES')
+
+    leaf_clump_size = FloatProperty(
+        name="Clump Size",
+        min=0,
+        default=0,
+        description="Leaves lying in the same cell of a grid of this size are grouped into clumps, which are "
+                    "instanced instead of single leaves. 0 disables clumping")
+
+    leaf_clump_variants = IntProperty(
+        name="Clump Variants",
+        min=1,
+        max=16,
+        default=4,
+        description="Number of different clump meshes built from the leaves of the tree")
+
     number = IntProperty(
         name="Number of Leaves",
         default=10000)
@@ -756,6 +976,37 @@ class ModularTreePropertyGroup(PropertyGroup):
         default=15,
         description="The distance between the trees")
 
+    batch_mode = EnumProperty(
+        name="Batch Mode",
+        items=(
+            ('UNIQUE', 'Unique Trees', "Every tree has its own mesh", 0),
+            ('INSTANCES', 'Variants + Instances', "A few unique trees instanced many times", 1)))
+
+    batch_variants = IntProperty(
+        name="Variants",
+        min=1,
+        default=10,
+        description="The number of unique trees the instances are picked from")
+
+    batch_instance_type = EnumProperty(
+        name="Instance Type",
+        items=(
+            ('LINKED', 'Linked Duplicates', "Object copies sharing mesh, material and particle settings", 0),
+            ('GROUP', 'Group Instances', "Empties instancing one group per variant, everything is shared", 1)))
+
+    batch_scale_randomness = FloatProperty(
+        name="Scale Randomness",
+        min=0,
+        max=1,
+        default=.2,
+        description="How much the scale of the instances varies")
+
+    batch_memory_budget = IntProperty(
+        name="Memory Budget (MB)",
+        min=0,
+        default=0,
+        description="Stop the batch when Blender uses more memory than this. 0 means no limit")
+
     wind_controller = StringProperty(
         name="Control Object")
 
@@ -856,12 +1107,12 @@ class ModularTreePropertyGroup(PropertyGroup):
 
 
 # classes to register (panels will be in the UI in the order they are listed here)
-classes = [MakeTreeOperator, BatchTreeOperator, MakeTwigOperator, UpdateTreeOperator, UpdateTwigOperator,
+classes = [MakeTreeOperator, StreamTreeOperator, PreviewTreeOperator, BatchTreeOperator, MakeTwigOperator, UpdateTreeOperator, UpdateTwigOperator,
            SaveTreePresetOperator, RemoveTreePresetOperator, LoadTreePresetOperator, WindOperator,
            MakeControllerOperator, MakeTerrainOperator, SetupNodeTreeOperator,
            MakeTreePanel, BatchTreePanel, RootsAndTrunksPanel, TreeBranchesPanel, AdvancedSettingsPanel,
            MakeTwigPanel, TreePresetLoadMenu, TreePresetRemoveMenu, WindAnimationPanel, MakeTreePresetsPanel,
-           InstallTreePresetOperator, TreeAddonPrefs, ModularTreePropertyGroup]
+           InstallTreePresetOperator, TreeAddonPrefs, ModularTreePropertyGroup, GenerationLogPanel]
 classes += nodes_to_register
 
 prefix = "https://github.com/MaximeHerpin/modular_tree/wiki/"
@@ -869,6 +1120,8 @@ documentation_mapping = (
     # make tree panel
     ("bpy.ops.mod_tree.add_tree", "Make-Tree-Panel#make-tree"),
     ("bpy.ops.mod_tree.update_tree", "Make-Tree-Panel#update-tree"),
+    ("bpy.ops.mod_tree.preview_tree", "Make-Tree-Panel#preview-skeleton"),
+    ("bpy.types.ModularTreePropertyGroup.live_preview", "Make-Tree-Panel#live-preview"),
     ("bpy.types.ModularTreePropertyGroup.SeedProp", "Make-Tree-Panel#seed"),
     ("bpy.types.ModularTreePropertyGroup.iteration", "Make-Tree-Panel#branch-iterations"),
     ("bpy.types.ModularTreePropertyGroup.radius", "Make-Tree-Panel#radius"),
@@ -899,19 +1152,34 @@ documentation_mapping = (
     ("bpy.types.ModularTreePropertyGroup.obstacle_strength", "Branches#obstacle-strength"),
     # advanced settings
     ("bpy.types.ModularTreePropertyGroup.mat", "Advanced-Settings#create-new-material"),
+    ("bpy.types.ModularTreePropertyGroup.max_vertices", "Advanced-Settings#budgets"),
+    ("bpy.types.ModularTreePropertyGroup.max_extremities", "Advanced-Settings#budgets"),
+    ("bpy.types.ModularTreePropertyGroup.max_growth_time", "Advanced-Settings#budgets"),
     ("bpy.types.ModularTreePropertyGroup.bark_material", "Advanced-Settings#bark-material"),
+    ("bpy.types.ModularTreePropertyGroup.adaptive_rings", "Advanced-Settings#adaptive-rings"),
+    ("bpy.types.ModularTreePropertyGroup.adaptive_ring_radius", "Advanced-Settings#adaptive-rings"),
     ("bpy.types.ModularTreePropertyGroup.create_armature", "Advanced-Settings#create-armature"),
     ("bpy.types.ModularTreePropertyGroup.bones_iterations", "Advanced-Settings#bones-iterations"),
+    ("bpy.types.ModularTreePropertyGroup.bones_target", "Advanced-Settings#bone-budget"),
+    ("bpy.types.ModularTreePropertyGroup.bones_merge_angle", "Advanced-Settings#bone-budget"),
+    ("bpy.types.ModularTreePropertyGroup.bones_min_length", "Advanced-Settings#bone-budget"),
+    ("bpy.types.ModularTreePropertyGroup.bones_min_radius", "Advanced-Settings#bone-budget"),
     ("bpy.types.ModularTreePropertyGroup.leafs_iteration_length", "Advanced-Settings#leafs-group-length"),
     ("bpy.types.ModularTreePropertyGroup.particle", "Advanced-Settings#configure-particle-system"),
     ("bpy.types.ModularTreePropertyGroup.number", "Advanced-Settings#number-of-leaves"),
     ("bpy.types.ModularTreePropertyGroup.display", "Advanced-Settings#particles-in-viewport"),
+    ("bpy.types.ModularTreePropertyGroup.leaf_instancing", "Advanced-Settings#leaf-instancing"),
+    ("bpy.types.ModularTreePropertyGroup.leaf_clump_size", "Advanced-Settings#leaf-clumps"),
+    ("bpy.types.ModularTreePropertyGroup.leaf_clump_variants", "Advanced-Settings#leaf-clumps"),
     # batch tree generation
     ("bpy.ops.mod_tree.batch_tree", "Batch-Tree-Generation#batch-tree-generation"),
     ("bpy.types.ModularTreePropertyGroup.tree_number", "Batch-Tree-Generation#tree-number"),
     ("bpy.types.ModularTreePropertyGroup.batch_radius_randomness", "Batch-Tree-Generation#radius-randomness"),
     ("bpy.types.ModularTreePropertyGroup.batch_group_name", "Batch-Tree-Generation#group"),
     ("bpy.types.ModularTreePropertyGroup.batch_space", "Batch-Tree-Generation#grid-size"),
+    ("bpy.types.ModularTreePropertyGroup.batch_memory_budget", "Batch-Tree-Generation#memory-budget"),
+    ("bpy.types.ModularTreePropertyGroup.batch_mode", "Batch-Tree-Generation#batch-mode"),
+    ("bpy.types.ModularTreePropertyGroup.batch_variants", "Batch-Tree-Generation#variants"),
     # make twig
     ("bpy.ops.mod_tree.add_twig", "Make-Twig#create-twig"),
     ("bpy.ops.mod_tree.update_twig", "Make-Twig#update-selected-twig"),
@@ -937,6 +1205,14 @@ documentation_mapping = (
     ("bpy.types.TreeAddonPrefs.save_all_images", "Addon-Preferences#check-for-updates"),
     ("bpy.types.TreeAddonPrefs.save_all_texts", "Addon-Preferences#preset-file"),
     ("bpy.types.TreeAddonPrefs.preset_file", "Addon-Preferences#install-preset"),
+    ("bpy.types.TreeAddonPrefs.save_timing", "Addon-Preferences#save-timing"),
+    ("bpy.types.TreeAddonPrefs.background_generation", "Addon-Preferences#background-generation"),
+    ("bpy.types.TreeAddonPrefs.profile_file", "Addon-Preferences#profile-file"),
+    ("bpy.types.TreeAddonPrefs.memory_profiling", "Addon-Preferences#memory-profiling"),
+    ("bpy.types.TreeAddonPrefs.memory_top_lines", "Addon-Preferences#memory-profiling"),
+    ("bpy.types.TreeAddonPrefs.telemetry", "Addon-Preferences#generation-log"),
+    ("bpy.types.TreeAddonPrefs.telemetry_file", "Addon-Preferences#generation-log"),
+    ("bpy.types.TreeAddonPrefs.telemetry_max_size", "Addon-Preferences#generation-log"),
     # presets - TODO
 )
 
@@ -964,6 +1240,8 @@ def register():
     # register props
     Scene.mtree_props = PointerProperty(type=ModularTreePropertyGroup)
 
+    bpy.app.handlers.scene_update_post.append(update_live_preview)
+
 
 def unregister():
 
@@ -980,6 +1258,9 @@ def unregister():
     # unregister custom manual for add-on documentation
     bpy.utils.unregister_manual_map(doc_map)
 
+    if update_live_preview in bpy.app.handlers.scene_update_post:
+        bpy.app.handlers.scene_update_post.remove(update_live_preview)
+
     # unregister props
     del Scene.mtree_props
 
@@ -0,0 +1,115 @@
+# Copyright 2016 Maxime Herpin, Jake Dube
+#
+# ##### BEGIN GPL LICENSE BLOCK ######
+# This file is part of Modular Tree.
+#
+# Modular Tree is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Modular Tree is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Modular Tree.  If not, see <http://www.gnu.org/licenses/>.
+# ##### END GPL LICENSE BLOCK #####
+
+from threading import Thread, Event
+from traceback import format_exc
+from random import seed
+
+import bpy
+
+from .tree_creator import Tree, PropertySnapshot, roots, trunk_layers, branches_layers, late_roots_layers
+
+# the growth running in the background, starting a new one cancels it
+current_growth = [None]
+
+
+def background_unsupported(mtree_props):
+    """Returns why the growth can't run outside of the main thread with these settings, None if it can.
+
+    The growth reads Blender data for the node curves, force fields and obstacles, which is only safe from the
+    main thread.
+    """
+    if mtree_props.use_node_workflow:
+        return "the node workflow evaluates its curves through Blender"
+    if mtree_props.use_force_field:
+        return "force fields are read from the scene"
+    if bpy.data.objects.get(mtree_props.obstacle) is not None:
+        return "obstacles are ray cast in the scene"
+    return None
+
+
+class GrowthWorker(Thread):
+    """Grows the trunk, branches and late roots of a tree outside of the main thread.
+
+    The tree only reads its PropertySnapshot, and nothing else may touch it until the worker is done. The worker
+    checks whether it was cancelled after every layer.
+    """
+    def __init__(self, tree):
+        super().__init__(daemon=True)
+        self.tree = tree
+        self.cancelled = Event()
+        self.error = None
+
+    def run(self):
+        tree = self.tree
+        try:
+            layers = [("trunk", trunk_layers(None, tree)), ("branches", branches_layers(None, tree))]
+            if tree.roots_to_create:
+                layers.append(("late roots", late_roots_layers(None, tree)))
+            for stage, generator in layers:
+                with tree.profiler.stage(stage):
+                    for _ in generator:
+                        if self.cancelled.is_set():
+                            return
+            tree.grown_bones = list(tree.bones)
+            tree.growth_log.display()
+        except Exception:
+            self.error = format_exc()
+
+    def cancel(self):
+        self.cancelled.set()
+
+
+def cancel_growth():
+    """Cancels the growth running in the background, if any, and waits for the end of its current layer.
+
+    The growth draws from the global random generator, so no other tree may grow until it is stopped.
+    """
+    worker = current_growth[0]
+    current_growth[0] = None
+    if worker is not None:
+        worker.cancel()
+        worker.join()
+
+
+def start_growth(position, profiler, random_seed):
+    """Grows a tree with the current settings in the background, cancelling the growth already running.
+
+    The tree is made and its roots grown on the calling thread, as they read the scene.
+
+    Args:
+        position - (Vector) The location of the tree
+        profiler - (Profiler) Receives the time of each stage
+        random_seed - (int) The seed of the global random generator, set once the previous growth is stopped
+
+    Returns:
+        (GrowthWorker) The started worker, its tree is grown once it isn't alive anymore
+    """
+    cancel_growth()
+    seed(random_seed)
+    mtree_props = bpy.context.scene.mtree_props
+    tree = Tree(position)
+    tree.profiler = profiler
+    with profiler.stage("roots"):
+        roots(None, tree)
+    tree.props = PropertySnapshot(mtree_props)
+    worker = GrowthWorker(tree)
+    current_growth[0] = worker
+    worker.start()
+    return worker
@@ -0,0 +1,178 @@
+# Copyright 2016 Maxime Herpin, Jake Dube
+#
+# ##### BEGIN GPL LICENSE BLOCK ######
+# This file is part of Modular Tree.
+#
+# Modular Tree is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Modular Tree is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Modular Tree.  If not, see <http://www.gnu.org/licenses/>.
+# ##### END GPL LICENSE BLOCK #####
+
+from math import sqrt, ceil
+
+from mathutils import Vector
+import bpy
+
+# odd multiplier, so that index -> seed is a bijection modulo 2**32 (Knuth's multiplicative hash)
+SEED_MULTIPLIER = 2654435761
+SEED_MODULO = 2 ** 32
+
+
+def batch_seed(base_seed, index):
+    """Returns the seed of the index-th tree of a batch.
+
+    The sequence is a permutation of [0, 2**32), so two trees of the same batch never share
+    a seed, and nothing has to be remembered to guarantee it.
+
+    Args:
+        base_seed - (int) The seed of the batch, the same base seed always gives the same batch
+        index - (int) The index of the tree in the batch
+    """
+    return (base_seed + index * SEED_MULTIPLIER) % SEED_MODULO
+
+
+def grid_position(index, count, space):
+    """Returns the location of the index-th tree of a batch laid out on a square grid centered on the origin.
+
+    Args:
+        index - (int) The index of the tree in the batch
+        count - (int) The number of trees in the batch
+        space - (float) The distance between two trees
+    """
+    side = max(1, int(ceil(sqrt(count))))
+    pos_x = index % side
+    pos_y = index // side
+    return Vector((-space * side / 2, -space * side / 2, 0)) + Vector((pos_x, pos_y, 0)) * space
+
+
+def get_batch_group(name):
+    """Returns the group the batch objects are linked to, creating it if needed. None if name is empty."""
+    if name == "":
+        return None
+    group = bpy.data.groups.get(name)
+    if group is None:
+        group = bpy.data.groups.new(name)
+    return group
+
+
+def link_to_group(group, objects):
+    """Links objects to a group directly through the data API instead of calling bpy.ops.object.group_link per object.
+
+    Args:
+        group - (bpy.types.Group) The group, nothing is done if None
+        objects - (list of bpy.types.Object) The objects to link
+    """
+    if group is None:
+        return
+    group_objects = group.objects
+    for obj in objects:
+        if obj.name not in group_objects:
+            group_objects.link(obj)
+
+
+def purge_orphan_data():
+    """Removes meshes and particle settings that are no longer used by anything.
+
+    Returns:
+        (int) The number of removed datablocks
+    """
+    removed = 0
+    for collection in (bpy.data.meshes, bpy.data.particles):
+        for block in [b for b in collection if b.users == 0]:
+            collection.remove(block)
+            removed += 1
+    return removed
+
+
+def get_hierarchy(obj):
+    """Returns the top parent of obj followed by all its descendants, parents always before their children."""
+    root = obj
+    while root.parent is not None:
+        root = root.parent
+    objects = [root]
+    i = 0
+    while i < len(objects):
+        objects += objects[i].children
+        i += 1
+    return objects
+
+
+def make_variant_group(name, objects):
+    """Puts a variant hierarchy in its own group so that it can be instanced by empties.
+
+    Args:
+        name - (string) The name of the group
+        objects - (list of bpy.types.Object) The variant hierarchy, the top parent first
+    """
+    group = bpy.data.groups.new(name)
+    for obj in objects:
+        group.objects.link(obj)
+    group.dupli_offset = objects[0].location
+    return group
+
+
+def add_group_instance(scene, group, location, rotation, scale):
+    """Adds an empty instancing group. Meshes, materials and particle systems are entirely shared.
+
+    Returns:
+        (list of bpy.types.Object) The created empty
+    """
+    empty = bpy.data.objects.new(group.name + "_instance", None)
+    empty.dupli_type = 'GROUP'
+    empty.dupli_group = group
+    scene.objects.link(empty)
+    empty.location = location
+    empty.rotation_euler = (0, 0, rotation)
+    empty.scale = (scale, scale, scale)
+    return [empty]
+
+
+def add_linked_instance(scene, objects, location, rotation, scale):
+    """Copies a variant hierarchy as linked duplicates, sharing mesh, material, armature and particle settings datablocks.
+
+    Args:
+        scene - (bpy.types.Scene) The scene to link the copies to
+        objects - (list of bpy.types.Object) The variant hierarchy, the top parent first
+        location - (Vector) The location of the copied top parent
+        rotation - (float) The rotation of the copied top parent around Z
+        scale - (float) The scale of the copied top parent
+
+    Returns:
+        (list of bpy.types.Object) The copies
+    """
+    copies = {}
+    for obj in objects:
+        new_obj = obj.copy()
+        scene.objects.link(new_obj)
+        copies[obj.name] = new_obj
+
+    for obj in objects:
+        new_obj = copies[obj.name]
+        if obj.parent is not None and obj.parent.name in copies:
+            new_obj.parent = copies[obj.parent.name]
+        for modifier in new_obj.modifiers:
+            if modifier.type == 'ARMATURE' and modifier.object is not None and modifier.object.name in copies:
+                modifier.object = copies[modifier.object.name]
+
+    root = copies[objects[0].name]
+    root.location = location
+    root.rotation_euler = (0, 0, rotation)
+    root.scale = (scale, scale, scale)
+    return [copies[obj.name] for obj in objects]
+
+
+def mesh_footprint(objects):
+    """Returns the number of vertices and faces of the distinct meshes used by objects."""
+    meshes = {obj.data.name: obj.data for obj in objects if obj.type == 'MESH'}
+    verts = sum(len(mesh.vertices) for mesh in meshes.values())
+    faces = sum(len(mesh.polygons) for mesh in meshes.values())
+    return verts, faces
@@ -0,0 +1,260 @@
+# Copyright 2016 Maxime Herpin, Jake Dube
+#
+# ##### BEGIN GPL LICENSE BLOCK ######
+# This file is part of Modular Tree.
+#
+# Modular Tree is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Modular Tree is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Modular Tree.  If not, see <http://www.gnu.org/licenses/>.
+# ##### END GPL LICENSE BLOCK #####
+
+"""End to end generation benchmarks, run in background Blender:
+
+    blender -b --factory-startup -P benchmarks/run_benchmarks.py -- [options]
+
+Options:
+    --output FILE       Where to write the results (default: benchmarks/results.json)
+    --baseline FILE     The results to compare to (default: benchmarks/baseline.json, skipped if missing)
+    --update-baseline   Write the results as the new baseline instead of comparing
+    --tolerance FLOAT   Allowed slowdown before a case counts as a regression (default: 0.25, i.e. 25%)
+    --repeat INT        Number of timed runs per case, the median is kept (default: 3)
+    --case NAME         Only run this case, can be given several times
+
+Every case starts from the default settings, applies a preset or a parameter set and grows a tree with a fixed
+seed, so two runs of the same version make the same trees. Blender exits with code 1 when a case is slower than
+the baseline by more than the tolerance, or when it no longer makes the same tree: the vertex count and a checksum
+of the vertex positions are compared, so a change in the geometry is caught even if the counts stay the same.
+The trees are made away from the origin, and a tree that doesn't end up where it was made stops the run.
+"""
+
+import os
+import sys
+import json
+import argparse
+import importlib
+import random
+from hashlib import md5
+import tracemalloc
+from statistics import median
+
+import bpy
+import addon_utils
+from mathutils import Vector
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+ADDON_DIR = os.path.dirname(BENCHMARK_DIR)
+ADDON_NAME = os.path.basename(ADDON_DIR)
+SEED = 1
+# away from the origin, so that a tree that doesn't end up where it was made is caught
+TREE_LOCATION = (3.0, -2.0, 0.0)
+
+PRESET_CASES = ["Oak.mtp", "Spruce.mtp"]
+
+# name -> properties applied on top of the defaults
+STRESS_CASES = {
+    "stress_dense": {"iteration": 30, "split_proba": 0.4},
+    "stress_deep": {"iteration": 45, "trunk_length": 15, "split_proba": 0.15},
+    "stress_roots": {"create_roots": True, "roots_iteration": 12},
+    "stress_full_pipeline": {"uv": True, "mat": True, "create_vertex_paint": True, "create_armature": True,
+                             "particle": True, "create_particle_emitter": True},
+}
+
+
+def parse_args():
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+    parser = argparse.ArgumentParser(prog="run_benchmarks.py")
+    parser.add_argument("--output", default=os.path.join(BENCHMARK_DIR, "results.json"))
+    parser.add_argument("--baseline", default=os.path.join(BENCHMARK_DIR, "baseline.json"))
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--case", action="append", default=[])
+    return parser.parse_args(argv)
+
+
+def load_addon():
+    """Enables the add-on from this checkout."""
+    sys.path.insert(0, os.path.dirname(ADDON_DIR))
+    addon_utils.enable(ADDON_NAME, default_set=True)
+
+
+def reset_settings(mtree_props):
+    for prop in mtree_props.bl_rna.properties:
+        if prop.identifier != "rna_type" and not prop.is_readonly:
+            mtree_props.property_unset(prop.identifier)
+    mtree_props.use_node_workflow = False
+    mtree_props.SeedProp = SEED
+
+
+def get_cases():
+    """Returns the (name, function applying its settings) of every case."""
+    presets = importlib.import_module(ADDON_NAME + ".presets")
+    cases = []
+    for filename in PRESET_CASES:
+        def apply(mtree_props, filename=filename):
+            presets.apply_preset(mtree_props, presets.preset_store.load(filename))
+            mtree_props.use_node_workflow = False
+            mtree_props.SeedProp = SEED
+        cases.append((filename[:-4].lower(), apply))
+
+    for name in sorted(STRESS_CASES):
+        def apply(mtree_props, props=STRESS_CASES[name]):
+            for key, value in props.items():
+                setattr(mtree_props, key, value)
+        cases.append((name, apply))
+    return cases
+
+
+def clear_scene(batch_tools):
+    scene = bpy.context.scene
+    for obj in list(scene.objects):
+        bpy.data.objects.remove(obj, do_unlink=True)
+    batch_tools.purge_orphan_data()
+
+
+def geometry_checksum(objects):
+    """Returns a hash of the vertex positions of the meshes of objects, rounded so that float noise is ignored."""
+    checksum = md5()
+    for obj in objects:
+        if obj.type == 'MESH':
+            checksum.update(obj.name.encode())
+            for vertex in obj.data.vertices:
+                checksum.update("{:.4f},{:.4f},{:.4f};".format(*vertex.co).encode())
+    return checksum.hexdigest()[:16]
+
+
+def check_location(obj, location):
+    """Raises an error if obj, or the armature it is parented to, isn't at location once the scene is evaluated."""
+    bpy.context.scene.update()
+    offset = (obj.matrix_world.translation - Vector(location)).length
+    if offset > 1e-4:
+        raise RuntimeError("The tree was made {:.3f} away from where it was asked for".format(offset))
+
+
+class BenchmarkOperator:
+    """Stands in for the operator alt_create_tree reports to."""
+    def report(self, level, message):
+        print("  [{}] {}".format(", ".join(level), message))
+
+
+def run_case(tree_creator, clock, batch_tools, memory_tools, apply, repeat):
+    """Grows the tree of a case repeat times plus one untimed run measuring the Python allocations.
+
+    Returns:
+        (dict) The measures of the case
+    """
+    scene = bpy.context.scene
+    profilers = []
+    verts = faces = objects = 0
+    geometry = None
+    rss_growth = 0
+    for run in range(repeat + 1):
+        clear_scene(batch_tools)
+        reset_settings(scene.mtree_props)
+        apply(scene.mtree_props)
+        random.seed(SEED)
+
+        trace = run == repeat
+        if trace:
+            tracemalloc.start()
+        start_rss = memory_tools.get_rss()
+        profiler = clock.Profiler("create_tree")
+        obj = tree_creator.alt_create_tree(BenchmarkOperator(), Vector(TREE_LOCATION), profiler)
+        if obj is None:
+            raise RuntimeError("The tree could not be created")
+        check_location(obj, TREE_LOCATION)
+        if trace:
+            peak_python = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        else:
+            profilers.append(profiler)
+            rss_growth = max(rss_growth, memory_tools.get_rss() - start_rss)
+            hierarchy = batch_tools.get_hierarchy(obj)
+            objects = len(hierarchy)
+            verts, faces = batch_tools.mesh_footprint(hierarchy)
+            geometry = geometry_checksum(hierarchy)
+
+    aggregate = clock.aggregate_profiles(profilers)
+    seconds = median(p.timings()["create_tree"] for p in profilers)
+    return {"seconds": seconds,
+            "verts": verts,
+            "faces": faces,
+            "objects": objects,
+            "geometry": geometry,
+            "verts_per_second": verts / seconds if seconds else 0,
+            "peak_python_bytes": peak_python,
+            "rss_growth_bytes": rss_growth,
+            "stages": {key: stats["mean"] for key, stats in aggregate.items()}}
+
+
+def compare(results, baseline, tolerance):
+    """Prints how each case compares to the baseline and returns the list of regressions."""
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            print("{:<24} no baseline".format(name))
+            continue
+        ratio = result["seconds"] / reference["seconds"] if reference["seconds"] else 1
+        print("{:<24} {:8.3f}s vs {:8.3f}s ({:+.0f}%)".format(name, result["seconds"], reference["seconds"],
+                                                            (ratio - 1) * 100))
+        if ratio > 1 + tolerance:
+            slow_stages = [key for key, duration in result["stages"].items()
+                           if duration > reference["stages"].get(key, duration) * (1 + tolerance) + 1e-3]
+            regressions.append("{} is {:.0f}% slower (stages: {})".format(name, (ratio - 1) * 100,
+                                                                         ", ".join(slow_stages) or "none in particular"))
+        if result["verts"] != reference["verts"]:
+            regressions.append("{} makes {} vertices instead of {}".format(name, result["verts"], reference["verts"]))
+        elif reference.get("geometry") is not None and result["geometry"] != reference["geometry"]:
+            regressions.append("{} makes a different tree with the same seed".format(name))
+    return regressions
+
+
+def main():
+    args = parse_args()
+    load_addon()
+    tree_creator = importlib.import_module(ADDON_NAME + ".tree_creator")
+    clock = importlib.import_module(ADDON_NAME + ".clock")
+    batch_tools = importlib.import_module(ADDON_NAME + ".batch_tools")
+    memory_tools = importlib.import_module(ADDON_NAME + ".memory_tools")
+
+    results = {}
+    for name, apply in get_cases():
+        if args.case and name not in args.case:
+            continue
+        print("\n=== {} ===".format(name))
+        results[name] = run_case(tree_creator, clock, batch_tools, memory_tools, apply, args.repeat)
+        print("{}: {:.3f}s, {} vertices, {:.0f} vertices/s".format(
+            name, results[name]["seconds"], results[name]["verts"], results[name]["verts_per_second"]))
+    clear_scene(batch_tools)
+
+    output = {"blender": bpy.app.version_string, "seed": SEED, "repeat": args.repeat, "cases": results}
+    target = args.baseline if args.update_baseline else args.output
+    with open(target, "w") as f:
+        json.dump(output, f, indent=1, sort_keys=True)
+    print("\nResults written to", target)
+
+    if args.update_baseline or not os.path.isfile(args.baseline):
+        return
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)["cases"]
+    print("\nComparison with", args.baseline)
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print("\nPERFORMANCE REGRESSION:")
+        for regression in regressions:
+            print("   ", regression)
+        sys.exit(1)
+
+
+main()
@@ -0,0 +1,342 @@
+# Copyright 2016 Maxime Herpin, Jake Dube
+#
+# ##### BEGIN GPL LICENSE BLOCK ######
+# This file is part of Modular Tree.
+#
+# Modular Tree is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Modular Tree is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Modular Tree.  If not, see <http://www.gnu.org/licenses/>.
+# ##### END GPL LICENSE BLOCK #####
+
+"""Microbenchmarks of the geometry hot paths, run in background Blender:
+
+    blender -b --factory-startup -P benchmarks/run_microbenchmarks.py -- [options]
+
+Options:
+    --kernel NAME               Only run this kernel, can be given several times
+    --sizes N [N ...]           The input sizes (default: 100 1000 10000)
+    --repeat INT                Number of runs per size, the fastest is kept (default: 5)
+    --output FILE               Also write the timings as JSON
+    --replace KERNEL=MOD:FUNC   Time FUNC of the importable module MOD next to the current implementation
+                                of KERNEL, and check that both give the same result on every input
+
+Each kernel runs over synthetic inputs of growing size. The scaling exponent printed between two sizes is the
+slope of log(time) against log(size): about 1 for linear work, 2 for quadratic work such as inserting sorted keys
+in the unbalanced pruning search tree.
+"""
+
+import os
+import sys
+import json
+import argparse
+import importlib
+from math import log, cos, sin
+from random import Random
+from time import perf_counter
+from collections import OrderedDict
+
+import bpy
+import addon_utils
+from mathutils import Vector
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+ADDON_DIR = os.path.dirname(BENCHMARK_DIR)
+ADDON_NAME = os.path.basename(ADDON_DIR)
+SEED = 1
+
+
+def parse_args():
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+    parser = argparse.ArgumentParser(prog="run_microbenchmarks.py")
+    parser.add_argument("--kernel", action="append", default=[])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output")
+    parser.add_argument("--replace", action="append", default=[])
+    return parser.parse_args(argv)
+
+
+def load_addon():
+    """Enables the add-on from this checkout."""
+    sys.path.insert(0, os.path.dirname(ADDON_DIR))
+    addon_utils.enable(ADDON_NAME, default_set=True)
+
+
+def addon_module(name):
+    return importlib.import_module(ADDON_NAME + "." + name)
+
+
+def random_vectors(rng, count):
+    return [Vector((rng.uniform(-1, 1), rng.uniform(-1, 1), rng.uniform(-1, 1))) for _ in range(count)]
+
+
+def ring(center, phase):
+    return [center + Vector((cos(phase + i * 0.785398), sin(phase + i * 0.785398), 0)) for i in range(8)]
+
+
+# Each kernel is (function path in the add-on, setup, run):
+#   setup(size, rng) builds the inputs, it isn't timed and runs again before every run as kernels modify them
+#   run(function, inputs) calls the function, or the replacement, and returns what is compared between the two
+
+def setup_joindre(size, rng):
+    verts = []
+    pairs = []
+    for k in range(size):
+        n = len(verts)
+        verts += ring(Vector((0, 0, k)), 0) + ring(Vector((0, 0, k + .5)), rng.uniform(0, 6.28))
+        pairs.append((list(range(n, n + 8)), list(range(n + 8, n + 16))))
+    return verts, [], pairs
+
+
+def run_joindre(function, inputs):
+    verts, faces, pairs = inputs
+    for v1_i, v2_i in pairs:
+        function(verts, faces, v1_i, v2_i)
+    return faces
+
+
+def setup_rot_scale(size, rng):
+    return random_vectors(rng, size), Vector((.2, .3, .9)).normalized()
+
+
+def run_rot_scale(function, inputs):
+    v_co, direction = inputs
+    return function(v_co, 1.3, direction, .7)
+
+
+def setup_interpolate(size, rng):
+    return [v.to_tuple() for v in random_vectors(rng, size)], [v.to_tuple() for v in random_vectors(rng, size)]
+
+
+def run_interpolate(function, inputs):
+    verts1, verts2 = inputs
+    return function(verts1, verts2, .3)
+
+
+def setup_join_branch(size, rng):
+    tree_creator = addon_module("tree_creator")
+    module_verts = [Vector(v) for v in tree_creator.branch.verts]
+    directions = [(Vector((0, 0, 1)) + v * .2).normalized() for v in random_vectors(rng, size)]
+    return module_verts, directions
+
+
+def run_join_branch(function, inputs):
+    module_verts, directions = inputs
+    verts = ring(Vector((0, 0, 0)), 0)
+    faces = []
+    uv_list = []
+    indexes = list(range(8))
+    for k, direction in enumerate(directions):
+        indexes = function(verts, faces, indexes, .9, Vector((0, 0, k)), module_verts, direction, uv_list, k, 1)
+    return verts, faces
+
+
+def setup_join(size, rng):
+    tree_creator = addon_module("tree_creator")
+    split = tree_creator.S2
+    split_verts = tree_creator.interpolate(split.verts1, split.verts2, .5)
+    rotations = [rng.uniform(0, 6.28) for _ in range(size)]
+    return split, split_verts, rotations
+
+
+def run_join(function, inputs):
+    split, split_verts, rotations = inputs
+    verts = ring(Vector((0, 0, 0)), 0)
+    faces = []
+    uv_list = []
+    indexes = list(range(8))
+    for k, rotation in enumerate(rotations):
+        indexes, _, _ = function(verts, faces, indexes, split_verts, split.faces, .9, split.sortie[0],
+                                 split.sortie[1], split.entree, Vector((0, 0, 1)), Vector((0, 0, 2 * k)), uv_list,
+                                 split.uv, rotation, k, 1)
+    return verts, faces
+
+
+def setup_search_tree_random(size, rng):
+    # voxel keys as the pruning makes them, several branches visiting the same voxels
+    keys = [(rng.randrange(size), rng.randrange(20), rng.randrange(20)) for _ in range(size)]
+    return keys
+
+
+def setup_search_tree_sorted(size, rng):
+    # a branch growing in a straight line gives increasing keys, the worst case of an unbalanced tree
+    return [(i, 0, 0) for i in range(size)]
+
+
+def run_search_tree(search_tree, keys):
+    tree = search_tree(keys[0], 1)
+    for key in keys[1:]:
+        tree.add(key, 1)
+    return [tree.get_value(key) for key in keys]
+
+
+def setup_update_curve_properties(size, rng):
+    nodes = addon_module("nodes")
+    tree_creator = addon_module("tree_creator")
+    node_tree = bpy.data.node_groups.get("microbenchmark")
+    if node_tree is None:
+        node_tree = bpy.data.node_groups.new("microbenchmark", 'ModularTreeNodeType')
+        nodes.setup_node_tree(node_tree)
+        branch_node = [node for node in node_tree.nodes if node.bl_label == 'Branches'][0]
+        for socket in branch_node.inputs[1:]:
+            curve = node_tree.nodes.new('CurveNode')
+            node_tree.links.new(curve.outputs[0], socket)
+    iteration_props = tree_creator.eval_inputs(node_tree)[1]
+    return node_tree, iteration_props, [i / size for i in range(size)]
+
+
+def run_update_curve_properties(function, inputs):
+    node_tree, props, factors = inputs
+    mtree_props = bpy.context.scene.mtree_props
+    values = []
+    for factor in factors:
+        function(node_tree, props, factor)
+        values.append(mtree_props.branch_length)
+    return values
+
+
+def setup_stroke(size, rng):
+    # a helix sampled every ~0.1
+    return [Vector((cos(i * .1), sin(i * .1), i * .02)) for i in range(size)]
+
+
+def run_rehash_set(function, points):
+    return function(points, .05)
+
+
+def run_smooth_stroke(function, points):
+    return function(2, .3, points)
+
+
+KERNELS = OrderedDict([
+    ("joindre", ("tree_creator.joindre", setup_joindre, run_joindre)),
+    ("rot_scale", ("tree_creator.rot_scale", setup_rot_scale, run_rot_scale)),
+    ("interpolate", ("tree_creator.interpolate", setup_interpolate, run_interpolate)),
+    ("join", ("tree_creator.join", setup_join, run_join)),
+    ("join_branch", ("tree_creator.join_branch", setup_join_branch, run_join_branch)),
+    ("search_tree_random", ("pruning.SearchTree", setup_search_tree_random, run_search_tree)),
+    ("search_tree_sorted", ("pruning.SearchTree", setup_search_tree_sorted, run_search_tree)),
+    ("update_curve_properties", ("tree_creator.update_curve_properties", setup_update_curve_properties,
+                                 run_update_curve_properties)),
+    ("rehash_set", ("tree_creator.rehash_set", setup_stroke, run_rehash_set)),
+    ("smooth_stroke", ("tree_creator.smooth_stroke", setup_stroke, run_smooth_stroke)),
+])
+
+
+def get_function(path):
+    """Returns the add-on function of a "module.function" path."""
+    module_name, name = path.rsplit(".", 1)
+    return getattr(addon_module(module_name), name)
+
+
+def get_replacement(path):
+    """Returns the function of a "module:function" path, the module being importable from the working directory."""
+    if os.getcwd() not in sys.path:
+        sys.path.insert(0, os.getcwd())
+    module_name, name = path.split(":")
+    return getattr(importlib.import_module(module_name), name)
+
+
+def time_kernel(function, setup, run, size, repeat):
+    """Returns the fastest time of repeat runs and the result of the last one, (None, reason) if it failed."""
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        inputs = setup(size, Random(SEED))
+        start = perf_counter()
+        try:
+            result = run(function, inputs)
+        except RecursionError:
+            return None, "recursion limit"
+        best = min(best, perf_counter() - start)
+    return best, result
+
+
+def same_result(a, b, tolerance=1e-5):
+    """Returns True if the two results are equal, vectors and floats being compared with a tolerance."""
+    if isinstance(a, Vector) or isinstance(b, Vector):
+        return len(a) == len(b) and (Vector(a) - Vector(b)).length <= tolerance
+    if isinstance(a, (list, tuple)) and isinstance(b, (list, tuple)):
+        return len(a) == len(b) and all(same_result(x, y, tolerance) for x, y in zip(a, b))
+    if isinstance(a, float) or isinstance(b, float):
+        return abs(a - b) <= tolerance * max(1, abs(a), abs(b))
+    return a == b
+
+
+def scaling_exponents(sizes, times):
+    """Returns the slope of log(time) against log(size) between consecutive sizes."""
+    exponents = []
+    for (s1, t1), (s2, t2) in zip(zip(sizes, times), zip(sizes[1:], times[1:])):
+        if t1 is None or t2 is None or t1 <= 0 or t2 <= 0:
+            exponents.append(None)
+        else:
+            exponents.append(log(t2 / t1) / log(s2 / s1))
+    return exponents
+
+
+def format_time(seconds):
+    return "{:>10}".format("failed") if seconds is None else "{:>8.2f}ms".format(seconds * 1000)
+
+
+def format_exponent(exponent):
+    return "   -" if exponent is None else "{:4.2f}".format(exponent)
+
+
+def main():
+    args = parse_args()
+    load_addon()
+    replacements = dict(r.split("=", 1) for r in args.replace)
+
+    print("{:<26}{}   scaling".format("kernel", "".join("{:>10}".format(size) for size in args.sizes)))
+    results = OrderedDict()
+    mismatches = []
+    for name, (path, setup, run) in KERNELS.items():
+        if args.kernel and name not in args.kernel:
+            continue
+        candidates = [(name, get_function(path))]
+        if name in replacements:
+            candidates.append((name + " (replacement)", get_replacement(replacements[name])))
+
+        outputs = []
+        for label, function in candidates:
+            times = []
+            kernel_outputs = []
+            for size in args.sizes:
+                seconds, output = time_kernel(function, setup, run, size, args.repeat)
+                times.append(seconds)
+                kernel_outputs.append(output)
+                if seconds is None:
+                    print("    {} failed at size {}: {}".format(label, size, output))
+            outputs.append(kernel_outputs)
+            exponents = scaling_exponents(args.sizes, times)
+            print("{:<26}{}   {}".format(label, "".join(format_time(t) for t in times),
+                                         " ".join(format_exponent(e) for e in exponents)))
+            results[label] = {"sizes": args.sizes, "seconds": times, "scaling": exponents}
+
+        if len(outputs) == 2:
+            for size, current, replacement in zip(args.sizes, *outputs):
+                if not same_result(current, replacement):
+                    mismatches.append("{} differs from the current implementation at size {}".format(name, size))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=1)
+        print("\nTimings written to", args.output)
+
+    if mismatches:
+        print("\nREPLACEMENT MISMATCH:")
+        for mismatch in mismatches:
+            print("   ", mismatch)
+        sys.exit(1)
+
+
+main()
@@ -17,7 +17,14 @@
 # along with Modular Tree.  If not, see <http://www.gnu.org/licenses/>.
 # ##### END GPL LICENSE BLOCK #####
 
-from time import time
+from time import time, perf_counter
+from math import ceil
+from contextlib import contextmanager
+from collections import OrderedDict
+import json
+import tracemalloc
+
+from .memory_tools import get_rss, format_size
 
 
 class Clock:
@@ -78,3 +85,222 @@ class Clock:
                 tm=info["finish"] - info["start"])
             print(string)
 
+
+class Profiler:
+    """Times nested stages of a job with perf_counter.
+
+    Memory can be measured at the stage boundaries as well, either with the resident size of the process ('RSS')
+    or with tracemalloc ('TRACEMALLOC'), which only sees Python allocations but names the lines that made them.
+
+    Methods:
+        __init__ - Starts timing the main job.
+        stage - Context manager timing a stage, stages opened inside it are its sub-stages.
+        stop - Stops the main job.
+        timings - Returns the total time of each stage.
+        memory_usage - Returns the memory delta, peak and biggest allocating lines of each stage.
+        count - Appends a value to a named series, such as a count per iteration.
+        display - Prints the stages as an indented tree.
+        summary - Returns a one line summary of the slowest top level stages.
+    """
+    def __init__(self, main_job, memory='NONE', top_lines=3):
+        """Starts timing the main job.
+
+        Args:
+            main_job - (string) The name of the job, root of every stage path
+            memory - (string) 'NONE', 'RSS' or 'TRACEMALLOC', how memory is measured at the stage boundaries
+            top_lines - (int) The number of biggest allocating lines kept per stage with 'TRACEMALLOC'
+        """
+        self.main_job = main_job
+        self.path = [main_job]
+        self.memory = memory
+        self.top_lines = top_lines
+        self.started_tracing = False
+        if memory == 'TRACEMALLOC' and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+        self.start_memory = self.get_memory()
+        self.peak = self.start_memory
+        self.start = perf_counter()
+        self.total = None
+        # "job/stage/sub_stage" -> [depth, accumulated seconds, number of calls], in the order stages are first entered
+        self.stages = OrderedDict()
+        # "job/stage/sub_stage" -> [accumulated delta, peak, biggest allocating lines, delta of the call they come from]
+        self.memory_stages = OrderedDict()
+        # name -> list of values
+        self.counters = OrderedDict()
+
+    def get_memory(self):
+        """Returns the current memory and the peak since the tracing started, in bytes."""
+        if self.memory == 'TRACEMALLOC':
+            return tracemalloc.get_traced_memory()
+        if self.memory == 'RSS':
+            rss = get_rss()
+            return rss, rss
+        return 0, 0
+
+    def take_snapshot(self):
+        snapshot = tracemalloc.take_snapshot()
+        return snapshot.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),
+                                       tracemalloc.Filter(False, __file__),
+                                       tracemalloc.Filter(False, "<frozen importlib._bootstrap>")))
+
+    @contextmanager
+    def stage(self, name):
+        """Times the code of the with block as a sub-stage of the stage currently running.
+
+        A stage entered several times at the same place, like a stage inside a loop, accumulates its time.
+
+        Args:
+            name - (string) The name of the stage
+        """
+        self.path.append(name)
+        key = "/".join(self.path)
+        record = self.stages.get(key)
+        if record is None:
+            record = self.stages[key] = [len(self.path) - 2, 0.0, 0]
+        if self.memory != 'NONE':
+            start_memory = self.get_memory()[0]
+            snapshot = self.take_snapshot() if self.memory == 'TRACEMALLOC' and self.top_lines > 0 else None
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            record[1] += perf_counter() - start
+            record[2] += 1
+            if self.memory != 'NONE':
+                self.record_memory(key, start_memory, snapshot)
+            self.path.pop()
+
+    def record_memory(self, key, start_memory, snapshot):
+        current, peak = self.get_memory()
+        self.peak = (max(self.peak[0], current), max(self.peak[1], peak))
+        memory_record = self.memory_stages.get(key)
+        if memory_record is None:
+            memory_record = self.memory_stages[key] = [0, 0, [], None]
+        delta = current - start_memory
+        memory_record[0] += delta
+        memory_record[1] = max(memory_record[1], peak)
+        if snapshot is not None and (memory_record[3] is None or delta > memory_record[3]):
+            # keeps the lines of the call of the stage that allocated the most
+            differences = self.take_snapshot().compare_to(snapshot, 'lineno')[:self.top_lines]
+            memory_record[2] = [(str(stat.traceback), stat.size_diff) for stat in differences]
+            memory_record[3] = delta
+
+    def count(self, name, value):
+        """Appends a value to the series name.
+
+        Args:
+            name - (string) The name of the series
+            value - (int, float) The value to append
+        """
+        self.counters.setdefault(name, []).append(value)
+
+    def stop(self):
+        """Stops the main job and returns its duration in seconds."""
+        if self.total is None:
+            self.total = perf_counter() - self.start
+            if self.memory != 'NONE':
+                current, peak = self.get_memory()
+                self.peak = (max(self.peak[0], current), max(self.peak[1], peak))
+            if self.started_tracing:
+                tracemalloc.stop()
+        return self.total
+
+    def memory_usage(self):
+        """Returns an OrderedDict of stage path -> {"delta", "peak", "top_lines"} in bytes, empty without memory
+        measures. "top_lines" is a list of (file:line, allocated bytes)."""
+        result = OrderedDict()
+        if self.memory == 'NONE':
+            return result
+        result[self.main_job] = {"delta": self.peak[0] - self.start_memory[0], "peak": self.peak[1], "top_lines": []}
+        for key, (delta, peak, top_lines, top_delta) in self.memory_stages.items():
+            result[key] = {"delta": delta, "peak": peak, "top_lines": top_lines}
+        return result
+
+    def timings(self):
+        """Returns an OrderedDict of stage path -> seconds, with the main job first."""
+        result = OrderedDict([(self.main_job, self.stop())])
+        for key, (depth, duration, calls) in self.stages.items():
+            result[key] = duration
+        return result
+
+    def display(self):
+        """Prints the stages as an indented tree, with their memory delta and peak when memory is measured."""
+        memory = self.memory_usage()
+
+        def memory_info(key):
+            if key not in memory:
+                return ""
+            return ", memory {}{} (peak {})".format("+" if memory[key]["delta"] >= 0 else "",
+                                                    format_size(memory[key]["delta"]), format_size(memory[key]["peak"]))
+
+        print("{} took {:.4f} seconds{}".format(self.main_job, self.stop(), memory_info(self.main_job)))
+        for key, (depth, duration, calls) in self.stages.items():
+            indent = "    " * (depth + 1)
+            print("{}{} took {:.4f} seconds{}{}".format(indent, key.rsplit("/", 1)[1], duration,
+                                                        " ({} calls)".format(calls) if calls > 1 else "",
+                                                        memory_info(key)))
+            for line, size in memory.get(key, {}).get("top_lines", []):
+                print("{}    {} {}".format(indent, format_size(size), line))
+
+    def summary(self, count=3):
+        """Returns a one line summary of the total time and of the slowest top level stages."""
+        top = sorted(((duration, key.rsplit("/", 1)[1]) for key, (depth, duration, calls) in self.stages.items()
+                      if depth == 0), reverse=True)[:count]
+        summary = "{:.2f}s ({})".format(self.stop(), ", ".join("{} {:.2f}s".format(name, duration)
+                                                               for duration, name in top))
+        if self.memory != 'NONE':
+            summary += ", memory peak {}".format(format_size(self.peak[1]))
+        return summary
+
+
+def percentile(sorted_values, fraction):
+    """Returns the nearest-rank percentile of already sorted values: the smallest value that is greater than or
+    equal to fraction of the values."""
+    index = max(0, min(len(sorted_values) - 1, int(ceil(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def aggregate_profiles(profilers):
+    """Aggregates the stage timings of several runs of the same job, typically the trees of a batch.
+
+    Args:
+        profilers - (list of Profiler) The runs to aggregate
+
+    Returns:
+        (OrderedDict) stage path -> {"runs", "min", "mean", "p95", "max"}, in seconds
+    """
+    samples = OrderedDict()
+    for profiler in profilers:
+        for key, duration in profiler.timings().items():
+            samples.setdefault(key, []).append(duration)
+
+    result = OrderedDict()
+    for key, values in samples.items():
+        values.sort()
+        result[key] = {"runs": len(values), "min": values[0], "mean": sum(values) / len(values),
+                       "p95": percentile(values, .95), "max": values[-1]}
+    return result
+
+
+def display_aggregate(aggregate):
+    """Prints the output of aggregate_profiles as a table."""
+    print("{:<48} {:>5} {:>9} {:>9} {:>9}".format("stage", "runs", "min", "mean", "p95"))
+    for key, stats in aggregate.items():
+        print("{:<48} {:>5} {:>9.4f} {:>9.4f} {:>9.4f}".format(key, stats["runs"], stats["min"], stats["mean"],
+                                                               stats["p95"]))
+
+
+def export_profiles(filepath, profilers):
+    """Writes the timings of each run and their aggregate to a JSON file.
+
+    Args:
+        filepath - (string) The file to write
+        profilers - (list of Profiler) The runs to export
+    """
+    data = {"runs": [profiler.timings() for profiler in profilers],
+            "aggregate": aggregate_profiles(profilers)}
+    if any(profiler.memory != 'NONE' for profiler in profilers):
+        data["memory"] = [profiler.memory_usage() for profiler in profilers]
+    with open(filepath, "w") as f:
+        json.dump(data, f, indent=1)
@@ -0,0 +1,258 @@
+# Copyright 2016 Maxime Herpin, Jake Dube
+#
+# ##### BEGIN GPL LICENSE BLOCK ######
+# This file is part of Modular Tree.
+#
+# Modular Tree is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Modular Tree is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Modular Tree.  If not, see <http://www.gnu.org/licenses/>.
+# ##### END GPL LICENSE BLOCK #####
+
+from math import exp, log
+from collections import namedtuple
+
+from mathutils import Vector
+
+from .tree_creator import root, R1, Joncts, Trunks, ADAPTIVE_MODULES, ring_resolution, generation_rate
+
+# the assumed speed of a generation until one was measured, in mesh vertices per second
+DEFAULT_VERTS_PER_SECOND = 20000
+# a generation expected to take longer than this asks for a confirmation
+LONG_RUN_SECONDS = 60
+# extremities whose radii are within 2% of each other are estimated together
+RADIUS_BUCKET = log(1.02)
+# the settings the estimate depends on
+ESTIMATE_PROPS = ["radius", "trunk_length", "trunk_radius_dec", "preserve_trunk", "preserve_end", "finish_trunk",
+                  "trunk_split_proba", "dont_break_trunk", "iteration", "split_proba", "radius_dec",
+                  "branch_min_radius", "break_chance", "roots_iteration", "roots_split_proba", "particle",
+                  "leaf_instancing", "create_particle_emitter", "number", "max_vertices", "max_extremities",
+                  "adaptive_rings", "adaptive_ring_radius"]
+
+CostEstimate = namedtuple("CostEstimate", ["verts", "faces", "leaves", "seconds", "peak_extremities", "truncated"])
+
+
+def exit_radius(verts, ring):
+    """Returns the radius of a ring of a template, measured like the growth does."""
+    return (Vector(verts[ring[0]]) - Vector(verts[ring[4]])).length / 2
+
+
+def split_costs(splits):
+    """Returns the mean vertex count, face count and exit radii of splits, at half way between their two forms."""
+    verts = sum(len(s.verts1) for s in splits) / len(splits)
+    faces = sum(len(s.faces) + len(s.entree) for s in splits) / len(splits)
+    radii = [sum(exit_radius(s.verts1, s.sortie[i]) + exit_radius(s.verts2, s.sortie[i]) for s in splits) /
+             (2 * len(splits)) for i in range(2)]
+    return verts, faces, radii
+
+
+# the growth picks among every trunk split but never the first branch split
+TRUNK_SPLIT_COSTS = split_costs(Trunks)
+BRANCH_SPLIT_COSTS = split_costs(Joncts[1:])
+# ring size -> (vertices, faces) of a growing extremity and of a capped one, the faces bridging the parent ring included
+MODULE_COSTS = {n: tuple((len(module.verts), len(module.faces) + len(module.entree)) for module in modules)
+                for n, modules in ADAPTIVE_MODULES.items()}
+
+
+class ExtremityPopulation:
+    """The expected number of extremities of a growth layer, grouped by radius.
+
+    Each group is [is_trunk, radius, real_radius, count], count being an expectation rather than a whole number.
+    """
+    def __init__(self):
+        self.groups = {}
+
+    def add(self, is_trunk, radius, real_radius, count):
+        if count <= 1e-6:
+            return
+        key = (is_trunk, int(log(max(radius, 1e-9)) / RADIUS_BUCKET))
+        group = self.groups.get(key)
+        if group is None:
+            self.groups[key] = [is_trunk, radius, real_radius, count]
+        else:
+            # the group keeps the mean radii of its extremities
+            total = group[3] + count
+            group[1] = (group[1] * group[3] + radius * count) / total
+            group[2] = (group[2] * group[3] + real_radius * count) / total
+            group[3] = total
+
+    def total(self):
+        return sum(group[3] for group in self.groups.values())
+
+    def keep_thickest(self, count):
+        """Removes the thinnest extremities so that count remain, returns how many were removed."""
+        removed = 0
+        kept = 0
+        for key, group in sorted(self.groups.items(), key=lambda item: -item[1][1]):
+            keep = min(group[3], max(0, count - kept))
+            removed += group[3] - keep
+            kept += keep
+            group[3] = keep
+        return removed
+
+
+def grow_population(mtree_props, population, layers, first_iteration, last_iteration, branch_type, costs):
+    """Grows a population of extremities for a number of layers following the rules of Tree.add_branch_layer,
+    with the expected outcome of every random choice.
+
+    Args:
+        mtree_props - (ModularTreePropertyGroup) The settings
+        population - (ExtremityPopulation) The extremities at the first layer
+        layers - (int) The number of layers to grow
+        first_iteration - (int) The iteration of the first layer
+        last_iteration - (int) The iteration at which every extremity is cut
+        branch_type - (string) "Branch" or "Roots"
+        costs - (list) [verts, faces, leaf positions, peak extremities, truncated], updated in place
+
+    Returns:
+        (ExtremityPopulation) The extremities left open after the last layer
+    """
+    for iteration in range(first_iteration, first_iteration + layers):
+        if 0 < mtree_props.max_extremities < population.total():
+            costs[4] |= population.keep_thickest(mtree_props.max_extremities) > 0
+        costs[3] = max(costs[3], population.total())
+        next_population = ExtremityPopulation()
+        for is_trunk, radius, real_radius, count in population.groups.values():
+            if iteration > mtree_props.preserve_end and branch_type == "Branch":
+                is_trunk = False
+            if real_radius < mtree_props.radius / 4 and branch_type == "Branch":
+                costs[2] += count
+            grow_costs, cap_costs = MODULE_COSTS[ring_resolution(mtree_props, real_radius)]
+
+            if branch_type == "Branch" and iteration <= mtree_props.trunk_length:
+                costs[0] += grow_costs[0] * count
+                costs[1] += grow_costs[1] * count
+                next_population.add(is_trunk, radius * mtree_props.trunk_radius_dec, 2 * radius, count)
+                continue
+
+            if iteration == last_iteration or real_radius < mtree_props.branch_min_radius:
+                cut = 1
+            elif is_trunk and mtree_props.dont_break_trunk:
+                cut = 0
+            else:
+                cut = min(1, mtree_props.break_chance * exp(-real_radius))
+            if branch_type == "Roots":
+                split_probability = mtree_props.roots_split_proba
+            else:
+                split_probability = mtree_props.trunk_split_proba if is_trunk else mtree_props.split_proba
+            if iteration == mtree_props.trunk_length + 1 and not mtree_props.preserve_trunk and branch_type == "Branch":
+                split_probability = 1
+            split = (1 - cut) * split_probability
+            grow = 1 - cut - split
+
+            costs[0] += (cap_costs[0] * cut + grow_costs[0] * grow) * count
+            costs[1] += (cap_costs[1] * cut + grow_costs[1] * grow) * count
+            rad_fact = mtree_props.trunk_radius_dec if is_trunk else mtree_props.radius_dec
+            next_population.add(is_trunk, radius * rad_fact, 2 * radius, count * grow)
+
+            split_verts, split_faces, exit_radii = TRUNK_SPLIT_COSTS if is_trunk else BRANCH_SPLIT_COSTS
+            costs[0] += split_verts * split * count
+            costs[1] += split_faces * split * count
+            if is_trunk:
+                rad_fact = 1 - (1 - mtree_props.trunk_radius_dec) * (1 + mtree_props.trunk_split_proba)
+            scale = radius * (1 + mtree_props.radius_dec) / 2
+            # the second exit of a finished trunk waits for the trunk, it is counted as growing right away
+            for i, r in enumerate(exit_radii):
+                next_population.add(is_trunk and i == 0, radius * rad_fact * r, 2 * r * scale, count * split)
+        population = next_population
+    return population
+
+
+def estimate_cost(mtree_props):
+    """Returns the expected size and duration of a generation with the current settings, without growing anything.
+
+    The growth is a branching process: every layer, each extremity is cut, splits in two or grows, with
+    probabilities depending on its radius. The estimate follows the expected number of extremities of each
+    radius instead of drawing the choices, so it ignores forces, obstacles, pruning and grease pencil strokes,
+    and LODs are not counted. Adaptive rings are counted with the ring size of each radius. The duration comes from the speed of the last generation of this session.
+
+    Args:
+        mtree_props - (ModularTreePropertyGroup) The settings
+
+    Returns:
+        (CostEstimate) The expected vertices, faces, leaves, seconds and peak extremities per layer, and whether
+        the budgets would cut the tree short
+    """
+    costs = [len(root.verts), len(root.faces), 0, 1, False]
+    population = ExtremityPopulation()
+    population.add(mtree_props.preserve_trunk, mtree_props.radius, 2 * mtree_props.radius, 1)
+    last_iteration = mtree_props.iteration + mtree_props.trunk_length - 1
+    population = grow_population(mtree_props, population, mtree_props.trunk_length, 0, last_iteration, "Branch",
+                                 costs)
+    grow_population(mtree_props, population, mtree_props.iteration, mtree_props.trunk_length, last_iteration,
+                    "Branch", costs)
+
+    if mtree_props.roots_iteration > 0:
+        costs[0] += len(R1.verts)
+        costs[1] += len(R1.faces)
+        population = ExtremityPopulation()
+        for r in R1.roots:
+            radius = exit_radius(R1.verts, r[1]) * mtree_props.radius
+            population.add(False, radius, 2 * radius, 1)
+        grow_population(mtree_props, population, mtree_props.roots_iteration, 0, mtree_props.roots_iteration - 1,
+                        "Roots", costs)
+
+    verts, faces, leaf_positions, peak_extremities, truncated = costs
+    if 0 < mtree_props.max_vertices < verts:
+        faces *= mtree_props.max_vertices / verts
+        verts = mtree_props.max_vertices
+        truncated = True
+
+    leaves = 0
+    if mtree_props.particle:
+        if mtree_props.leaf_instancing == 'FACES':
+            leaves = min(mtree_props.number, int(leaf_positions))
+        else:
+            leaves = mtree_props.number
+
+    rate = generation_rate[0] or DEFAULT_VERTS_PER_SECOND
+    return CostEstimate(int(verts), int(faces), leaves, verts / rate, int(peak_extremities), truncated)
+
+
+# (settings, rate, estimate) of the last estimate, as panels are drawn much more often than settings change
+last_estimate = [None, None, None]
+
+
+def get_cost_estimate(mtree_props):
+    """Returns the estimate of estimate_cost, computed again only when a setting it depends on changed."""
+    signature = tuple(getattr(mtree_props, name) for name in ESTIMATE_PROPS)
+    if last_estimate[0] != signature or last_estimate[1] != generation_rate[0]:
+        last_estimate[:] = signature, generation_rate[0], estimate_cost(mtree_props)
+    return last_estimate[2]
+
+
+def format_count(count):
+    if count >= 1000000:
+        return "{:.1f}M".format(count / 1000000)
+    if count >= 1000:
+        return "{:.0f}k".format(count / 1000)
+    return str(count)
+
+
+def format_duration(seconds):
+    if seconds >= 3600:
+        return "{:.0f}h {:.0f}min".format(seconds // 3600, seconds % 3600 // 60)
+    if seconds >= 60:
+        return "{:.0f}min {:.0f}s".format(seconds // 60, seconds % 60)
+    return "{:.1f}s".format(seconds)
+
+
+def draw_cost_estimate(layout, mtree_props):
+    """Draws the estimate of the next generation, with a warning if it could take minutes."""
+    estimate = get_cost_estimate(mtree_props)
+    col = layout.column(align=True)
+    col.label("Estimate: {} verts, {} faces".format(format_count(estimate.verts), format_count(estimate.faces)))
+    col.label("{} leaves, about {}{}".format(format_count(estimate.leaves), format_duration(estimate.seconds),
+                                             "" if generation_rate[0] else " (not measured yet)"))
+    if estimate.seconds > LONG_RUN_SECONDS:
+        col.label("This tree could take minutes to make", icon='ERROR')
+    if estimate.truncated:
+        col.label("The budgets will cut this tree short", icon='INFO')
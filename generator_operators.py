@@ -18,24 +18,144 @@
 # ##### END GPL LICENSE BLOCK #####
 
 from mathutils import Vector
-from random import random, seed, randint
-from math import sqrt
+from random import seed, Random
+from math import sqrt, pi
+from time import time
 
 import bpy
+from bpy.props import BoolProperty, FloatProperty
 from bpy.types import Operator
 
-from .tree_creator import alt_create_tree, create_twig
-from .prep_manager import save_everything
+from .tree_creator import alt_create_tree, create_twig, create_tree_preview, remove_tree_preview, get_growth, \
+    generate_tree, tree_preview_object_creation, streaming_tree
+from .prep_manager import save_everything, deferred_save
 from .logo import display_logo
 from .nodes import setup_node_tree
+from .batch_tools import batch_seed, grid_position, get_batch_group, link_to_group, purge_orphan_data, \
+    get_hierarchy, make_variant_group, add_group_instance, add_linked_instance, mesh_footprint
+from .memory_tools import get_rss, rss_is_current, format_size
+from .clock import Profiler, aggregate_profiles, display_aggregate, export_profiles
+from .addon_name import get_addon_name
+from .telemetry import log_generation
+from .background_tools import background_unsupported, start_growth, cancel_growth, current_growth
+from .cost_estimate import get_cost_estimate, format_duration, LONG_RUN_SECONDS
+
+# number of batch trees linked to the batch group at once
+BATCH_CHUNK_SIZE = 64
+
+
+def get_addon_prefs():
+    """Returns the addon preferences, None if the addon isn't enabled through the user preferences."""
+    addon = bpy.context.user_preferences.addons.get(get_addon_name())
+    return addon.preferences if addon is not None else None
+
+
+def new_profiler(main_job):
+    """Returns a profiler measuring memory as set in the addon preferences."""
+    addon_prefs = get_addon_prefs()
+    if addon_prefs is None:
+        return Profiler(main_job)
+    return Profiler(main_job, addon_prefs.memory_profiling, addon_prefs.memory_top_lines)
+
+
+def export_profiling(operator, profilers):
+    """Writes the stage timings to the profile file set in the addon preferences, if any."""
+    addon_prefs = get_addon_prefs()
+    if addon_prefs is None:
+        return
+    filepath = addon_prefs.profile_file
+    if not filepath or not profilers:
+        return
+    filepath = bpy.path.abspath(filepath)
+    try:
+        export_profiles(filepath, profilers)
+    except OSError as e:
+        operator.report({'WARNING'}, "Could not write the profile: {}".format(e))
+
+
+class BackgroundGrowth:
+    """Lets a tree operator grow its tree in a worker thread while Blender stays responsive, see background_tools.
+
+    The operator starts the growth from invoke with start_background, and meshes the tree on the main thread in
+    commit(context, tree) once it is grown. Starting another generation cancels this one.
+    """
+    _timer = None
+
+    def use_background(self, context):
+        """Returns whether the tree can be grown in the background, as enabled in the addon preferences."""
+        addon_prefs = get_addon_prefs()
+        if addon_prefs is None or not addon_prefs.background_generation:
+            return False
+        reason = background_unsupported(context.scene.mtree_props)
+        if reason is not None:
+            self.report({'INFO'}, "Growing the tree in the foreground: " + reason)
+            return False
+        return True
+
+    def start_background(self, context, position):
+        remove_tree_preview()
+        self.profiler = new_profiler("create_tree")
+        self.worker = start_growth(position, self.profiler, context.scene.mtree_props.SeedProp)
+        streaming_tree[0] = True
+
+        wm = context.window_manager
+        self._timer = wm.event_timer_add(0.1, context.window)
+        wm.modal_handler_add(self)
+        self.report({'INFO'}, "Growing the tree in the background, Esc to cancel")
+        return {'RUNNING_MODAL'}
+
+    def modal(self, context, event):
+        worker = self.worker
+        if event.type == 'ESC':
+            if current_growth[0] is worker:
+                cancel_growth()
+            self.end_background(context)
+            self.report({'WARNING'}, "Tree generation cancelled")
+            return {'CANCELLED'}
+
+        if event.type != 'TIMER' or worker.is_alive():
+            return {'PASS_THROUGH'}
+
+        self.end_background(context)
+        if worker.cancelled.is_set():
+            self.report({'INFO'}, "Tree generation replaced by a newer one")
+            return {'CANCELLED'}
+        current_growth[0] = None
+        if worker.error is not None:
+            print(worker.error)
+            self.report({'ERROR'}, "The tree could not be grown, see the console")
+            return {'CANCELLED'}
+        return self.commit(context, worker.tree)
+
+    def end_background(self, context):
+        # a newer growth may still be running
+        if current_growth[0] is None or current_growth[0] is self.worker:
+            streaming_tree[0] = False
+        context.window_manager.event_timer_remove(self._timer)
 
 
-class MakeTreeOperator(Operator):
+class MakeTreeOperator(BackgroundGrowth, Operator):
     """Make a tree"""
     bl_idname = "mod_tree.add_tree"
     bl_label = "Make Tree"
     bl_options = {"REGISTER", "UNDO"}
 
+    def invoke(self, context, event):
+        if not self.use_background(context):
+            estimate = get_cost_estimate(context.scene.mtree_props)
+            if estimate.seconds > LONG_RUN_SECONDS:
+                # Blender would freeze for minutes, let the user think twice
+                self.report({'WARNING'}, "This tree could take {} to make".format(format_duration(estimate.seconds)))
+                return context.window_manager.invoke_confirm(self, event)
+            return self.execute(context)
+        display_logo()
+        messages, message_lvls, status = save_everything()
+        for i, message in enumerate(messages):
+            self.report({message_lvls[i]}, message)
+            return {status}
+
+        return self.start_background(context, context.scene.cursor_location.copy())
+
     def execute(self, context):
         # this block saves everything and cancels operator if something goes wrong
         display_logo()
@@ -45,8 +165,151 @@ class MakeTreeOperator(Operator):
             return {status}
 
         scene = context.scene
+        cancel_growth()
+        seed(scene.mtree_props.SeedProp)
+        remove_tree_preview()
+        profiler = new_profiler("create_tree")
+        obj = alt_create_tree(self, scene.cursor_location, profiler)
+        self.tree_made(obj, profiler)
+
+        return {'FINISHED'}
+
+    def commit(self, context, tree):
+        obj = alt_create_tree(self, tree.position, self.profiler, tree)
+        self.tree_made(obj, self.profiler)
+        return {'FINISHED'}
+
+    def tree_made(self, obj, profiler):
+        if obj is not None:
+            self.report({'INFO'}, "Tree generated in " + profiler.summary())
+            export_profiling(self, [profiler])
+            log_generation(self, "make_tree", obj, profiler)
+        deferred_save(self)
+
+
+class StreamTreeOperator(Operator):
+    """Make a tree without freezing Blender, showing its skeleton as it grows. Press Esc to cancel"""
+    bl_idname = "mod_tree.stream_tree"
+    bl_label = "Make Tree Interactively"
+    bl_options = {"REGISTER", "UNDO"}
+
+    time_budget = FloatProperty(
+        name="Time Budget",
+        min=0.01,
+        max=1,
+        default=0.1,
+        subtype='TIME',
+        unit='TIME',
+        description="The time spent making the tree before the interface is redrawn")
+
+    progressive_display = BoolProperty(
+        name="Progressive Display",
+        default=True,
+        description="Show the skeleton of the tree while it grows")
+
+    _timer = None
+
+    def invoke(self, context, event):
+        display_logo()
+        messages, message_lvls, status = save_everything()
+        for i, message in enumerate(messages):
+            self.report({message_lvls[i]}, message)
+            return {status}
+
+        scene = context.scene
+        cancel_growth()
         seed(scene.mtree_props.SeedProp)
-        alt_create_tree(self, scene.cursor_location)
+        remove_tree_preview()
+        self.profiler = new_profiler("create_tree")
+        self.generator = generate_tree(self, scene.cursor_location.copy(), self.profiler)
+        self.last_step = None
+        streaming_tree[0] = True
+
+        wm = context.window_manager
+        wm.progress_begin(0, 100)
+        self._timer = wm.event_timer_add(0.01, context.window)
+        wm.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
+
+    def modal(self, context, event):
+        if event.type == 'ESC':
+            self.generator.close()
+            if self.last_step is not None and self.last_step.obj is not None:
+                for obj in get_hierarchy(self.last_step.obj):
+                    bpy.data.objects.remove(obj, do_unlink=True)
+                purge_orphan_data()
+            self.finish(context)
+            self.report({'WARNING'}, "Tree generation cancelled")
+            return {'CANCELLED'}
+
+        if event.type != 'TIMER':
+            return {'PASS_THROUGH'}
+
+        start = time()
+        grown = False
+        while time() - start < self.time_budget:
+            step = next(self.generator, None)
+            if step is None:
+                return self.done(context)
+            self.last_step = step
+            grown = step.obj is None
+
+        step = self.last_step
+        context.window_manager.progress_update(100 * step.done / step.total)
+        if context.area is not None:
+            context.area.header_text_set("Making tree: {} ({}/{}), Esc to cancel".format(step.stage, step.done,
+                                                                                       step.total))
+        if grown and self.progressive_display:
+            tree_preview_object_creation(step.tree)
+        elif not grown:
+            remove_tree_preview()
+        return {'RUNNING_MODAL'}
+
+    def done(self, context):
+        self.finish(context)
+        step = self.last_step
+        if step is None or step.stage != "done":
+            return {'CANCELLED'}
+        self.report({'INFO'}, "Tree generated in " + self.profiler.summary())
+        export_profiling(self, [self.profiler])
+        log_generation(self, "make_tree", step.obj, self.profiler)
+        deferred_save(self)
+        return {'FINISHED'}
+
+    def finish(self, context):
+        streaming_tree[0] = False
+        remove_tree_preview()
+        wm = context.window_manager
+        wm.event_timer_remove(self._timer)
+        wm.progress_end()
+        if context.area is not None:
+            context.area.header_text_set()
+
+
+class PreviewTreeOperator(Operator):
+    """Only grow the skeleton of the tree and show it as edges, much faster than a full build"""
+    bl_idname = "mod_tree.preview_tree"
+    bl_label = "Preview Skeleton"
+    bl_options = {"REGISTER", "UNDO"}
+
+    def execute(self, context):
+        mtree_props = context.scene.mtree_props
+        if mtree_props.use_node_workflow:
+            node_tree = bpy.data.node_groups.get(mtree_props.node_tree)
+            if node_tree is None:
+                self.report({'ERROR'}, "No node tree selected!")
+                return {'CANCELLED'}
+            # push the node values to the properties without going through a full tree update
+            for node in node_tree.nodes:
+                node.update()
+
+        start = time()
+        cancel_growth()
+        obj = create_tree_preview(self, context.scene.cursor_location)
+        if obj is None:
+            return {'CANCELLED'}
+        self.report({'INFO'}, "Skeleton preview: {} nodes in {:.0f} ms".format(
+            len(obj.data.vertices), (time() - start) * 1000))
 
         return {'FINISHED'}
 
@@ -65,28 +328,158 @@ class BatchTreeOperator(Operator):
             self.report({message_lvls[i]}, message)
             return {status}
 
+        cancel_growth()
+        if context.scene.mtree_props.batch_mode == 'INSTANCES':
+            result = self.batch_instances(context)
+        else:
+            result = self.batch_unique(context)
+        if result == {'FINISHED'}:
+            deferred_save(self)
+        return result
+
+    def generate_trees(self, context, tree_number, get_position, group=None):
+        """Creates tree_number trees one after the other, releasing each one once it is done.
+
+        Args:
+            tree_number - (int) The number of trees to create
+            get_position - (function) Gives the location of the i-th tree
+            group - (bpy.types.Group) The group the trees are linked to, None to skip linking
+
+        Returns:
+            (list of string) The names of the created trees
+            (bool) True if the batch was stopped before the end, which was reported
+        """
         mtree_props = context.scene.mtree_props
-        trees = []
+        budget = mtree_props.batch_memory_budget * 1024 * 1024
+        if budget and not rss_is_current():
+            # the peak memory never goes down, purging could never bring it back under the budget
+            self.report({'WARNING'}, "Memory budget ignored, only the peak memory can be measured on this platform")
+            budget = 0
+        base_seed = mtree_props.SeedProp
+
+        # only the names are kept, the objects and the generator data are released after each tree
+        tree_names = []
+        chunk = []
+        profilers = []
+        wm = context.window_manager
+        wm.progress_begin(0, tree_number)
+        stopped_by_budget = False
+        for i in range(tree_number):
+            tree_seed = batch_seed(base_seed, i)
+            seed(tree_seed)
+            profiler = new_profiler("create_tree")
+            new_tree = alt_create_tree(self, get_position(i), profiler)
+            if new_tree is None:
+                self.report({'WARNING'}, "Tree {} could not be made, stopped after {} of {} trees".format(
+                    i + 1, len(tree_names), tree_number))
+                break
+            profilers.append(profiler)
+            log_generation(self, "batch_tree", new_tree, profiler, tree_seed, batch_index=i, batch_size=tree_number)
+            # deselected so that the operators used by the next trees don't process every previous tree
+            new_tree.select = False
+            tree_names.append(new_tree.name)
+            chunk.append(new_tree)
+
+            wm.progress_update(i + 1)
+
+            if len(chunk) >= BATCH_CHUNK_SIZE:
+                link_to_group(group, chunk)
+                chunk = []
+
+            if budget and get_rss() > budget:
+                purge_orphan_data()
+                if get_rss() > budget:
+                    stopped_by_budget = True
+                    break
+        link_to_group(group, chunk)
+        wm.progress_end()
+
+        if profilers:
+            print("\nBatch stage timings (seconds):")
+            display_aggregate(aggregate_profiles(profilers))
+            export_profiling(self, profilers)
+
+        if stopped_by_budget:
+            self.report({'WARNING'}, "Memory budget of {} MB reached, stopped after {} of {} trees".format(
+                mtree_props.batch_memory_budget, len(tree_names), tree_number))
+        return tree_names, len(tree_names) < tree_number
+
+    def batch_unique(self, context):
+        mtree_props = context.scene.mtree_props
+        tree_number = mtree_props.tree_number
         space = mtree_props.batch_space
-        seeds = []
-        if mtree_props.batch_group_name != "":
-            if mtree_props.batch_group_name not in bpy.data.groups:
-                bpy.ops.group.create(name=mtree_props.batch_group_name)
-        for i in range(mtree_props.tree_number):
-            new_seed = randint(0, 1000)
-            while new_seed in seeds:
-                new_seed = randint(0, 1000)
-            seeds.append(new_seed)
-            pointer = int(sqrt(mtree_props.tree_number))
-            pos_x = i % pointer
-            pos_y = i // pointer
-            seed(new_seed)
-            new_tree = alt_create_tree(self, Vector((-space * pointer / 2, -space * pointer / 2, 0)) + Vector((pos_x, pos_y, 0)) * space)
-            trees.append(new_tree)
-            if mtree_props.batch_group_name != "":
-                bpy.ops.object.group_link(group=mtree_props.batch_group_name)
-        for tree in trees:
-            tree.select = True
+        group = get_batch_group(mtree_props.batch_group_name)
+
+        start = time()
+        tree_names, stopped = self.generate_trees(
+            context, tree_number, lambda i: grid_position(i, tree_number, space), group)
+
+        names = set(tree_names)
+        for obj in context.scene.objects:
+            obj.select = obj.name in names
+
+        if not stopped:
+            self.report({'INFO'}, "{} trees generated in {:.1f}s".format(len(tree_names), time() - start))
+
+        return {'FINISHED'}
+
+    def batch_instances(self, context):
+        scene = context.scene
+        mtree_props = scene.mtree_props
+        instance_number = mtree_props.tree_number
+        variant_number = min(mtree_props.batch_variants, instance_number)
+        space = mtree_props.batch_space
+        group = get_batch_group(mtree_props.batch_group_name)
+        use_groups = mtree_props.batch_instance_type == 'GROUP'
+        scale_randomness = mtree_props.batch_scale_randomness
+        start_rss = get_rss()
+        start = time()
+
+        # the variants are lined up in front of the instances grid
+        variants_y = -space * (sqrt(instance_number) / 2 + 2)
+        variant_names, stopped = self.generate_trees(
+            context, variant_number, lambda i: Vector(((i - variant_number / 2) * space, variants_y, 0)))
+        if not variant_names:
+            return {'CANCELLED'}
+
+        variants = []
+        variant_objects = []
+        for k, name in enumerate(variant_names):
+            objects = get_hierarchy(bpy.data.objects[name])
+            variant_objects += objects
+            if use_groups:
+                variants.append(make_variant_group("{}_variant_{}".format(mtree_props.batch_group_name or "tree", k), objects))
+            else:
+                variants.append(objects)
+
+        # placement uses its own generator so that it doesn't depend on how much randomness the variants consumed
+        rng = Random(batch_seed(mtree_props.SeedProp, variant_number))
+        instances = []
+        for i in range(instance_number):
+            variant = variants[rng.randrange(len(variants))]
+            location = grid_position(i, instance_number, space)
+            rotation = rng.random() * 2 * pi
+            scale = 1 + (rng.random() * 2 - 1) * scale_randomness
+            if use_groups:
+                new_objects = add_group_instance(scene, variant, location, rotation, scale)
+            else:
+                new_objects = add_linked_instance(scene, variant, location, rotation, scale)
+            instances.append(new_objects[0])
+            link_to_group(group, new_objects)
+
+        for obj in scene.objects:
+            obj.select = False
+        for obj in instances:
+            obj.select = True
+
+        # memory report
+        verts, faces = mesh_footprint(variant_objects)
+        unique_verts = verts * instance_number // len(variant_names)
+        unique_faces = faces * instance_number // len(variant_names)
+        self.report({'INFO'}, "{} instances of {} variants in {:.1f}s: {} vertices and {} faces stored instead of "
+                              "~{} and ~{} for unique trees ({:.0f}x less), memory +{}".format(
+            instance_number, len(variant_names), time() - start, verts, faces, unique_verts, unique_faces,
+            instance_number / len(variant_names), format_size(get_rss() - start_rss)))
 
         return {'FINISHED'}
 
@@ -108,19 +501,43 @@ class MakeTwigOperator(Operator):
             self.report({message_lvls[i]}, message)
             return {status}
 
+        cancel_growth()
         seed(mtree_props.TwigSeedProp)
-        twig = create_twig(scene.cursor_location)
+        profiler = new_profiler("create_twig")
+        twig = create_twig(scene.cursor_location, profiler)
+        export_profiling(self, [profiler])
+        log_generation(self, "create_twig", twig, profiler)
         twig.name = 'twig'
+        deferred_save(self)
 
         return {'FINISHED'}
 
 
-class UpdateTreeOperator(Operator):
+class UpdateTreeOperator(BackgroundGrowth, Operator):
     """Update a tree"""
     bl_idname = "mod_tree.update_tree"
     bl_label = "Update Selected Tree"
     bl_options = {"REGISTER", "UNDO"}
 
+    remesh = BoolProperty(
+        name="Re-mesh Only",
+        default=False,
+        description="Mesh the growth of the tree again with the current settings instead of growing a new tree. "
+                    "Only works for the last trees made in this session")
+
+    def invoke(self, context, event):
+        obj = context.active_object
+        if self.remesh or obj is None or not obj.get('is_tree') or not self.use_background(context):
+            return self.execute(context)
+        display_logo()
+        messages, message_lvls, status = save_everything()
+        for i, message in enumerate(messages):
+            self.report({message_lvls[i]}, message)
+            return {status}
+
+        self.tree_name = obj.name
+        return self.start_background(context, obj.location.copy())
+
     def execute(self, context):
         # this block saves everything and cancels operator if something goes wrong
         display_logo()
@@ -131,59 +548,100 @@ class UpdateTreeOperator(Operator):
 
         mtree_props = context.scene.mtree_props
 
+        cancel_growth()
         seed(mtree_props.SeedProp)
         obj = bpy.context.active_object
 
         try:
             is_tree_prop = obj.get('is_tree')
-            has_arm_prop = obj.get('has_armature')
-            has_emitter_prop = obj.get('has_emitter')
         except AttributeError:
             self.report({'ERROR'}, "No active tree object!")
             return {'CANCELLED'}
 
         if is_tree_prop:
-            pos = obj.location
-            name = obj.name
-            scale = obj.scale
-            rot = obj.rotation_euler
-            alt_create_tree(self, pos)
-            ob = context.active_object  # this is the new object that has been set active by 'create_tree'
-            ob.scale = scale
-            ob.name = name
-            ob.rotation_euler = rot
-            ob.select = False
-            obj.select = True
-
-            if has_arm_prop:
-                arm_pos = obj.parent.location
-                arm_scale = obj.parent.scale
-                arm_rot = obj.parent.rotation_euler
-                obj.parent.select = True
-
-                if mtree_props.create_armature:
-                    ob.parent.location = arm_pos
-                    ob.parent.scale = arm_scale
-                    ob.parent.rotation_euler = arm_rot
-                else:
-                    ob.location = arm_pos
-                    ob.scale = arm_scale
-                    ob.rotation_euler = arm_rot
-
-            if has_emitter_prop:
-                children = obj.children
-                emitter = [i for i in children if i.get("emitter")][0]
-                emitter.select = True
-
-            bpy.ops.object.delete(use_global=False)
-            ob.select = True
+            growth = None
+            if self.remesh:
+                growth = get_growth(obj)
+                if growth is None:
+                    self.report({'ERROR'}, "The growth of this tree isn't known anymore, use Update Selected Tree")
+                    return {'CANCELLED'}
+            self.replace_tree(context, obj, new_profiler("create_tree"), growth)
 
         else:
             self.report({'ERROR'}, "No active tree object!")
             return {'CANCELLED'}
 
+        deferred_save(self)
+        return {'FINISHED'}
+
+    def commit(self, context, tree):
+        # the selection may have changed while the tree was growing, and the selected objects are deleted
+        obj = bpy.data.objects.get(self.tree_name)
+        if obj is None or not obj.get('is_tree'):
+            self.report({'ERROR'}, "The tree to update doesn't exist anymore")
+            return {'CANCELLED'}
+        for selected in context.selected_objects:
+            selected.select = False
+        context.scene.objects.active = obj
+        obj.select = True
+        self.replace_tree(context, obj, self.profiler, tree)
+        deferred_save(self)
         return {'FINISHED'}
 
+    def replace_tree(self, context, obj, profiler, growth=None):
+        """Makes a new tree in place of obj, keeping its name and transform, and deletes obj.
+
+        Args:
+            context - (bpy.types.Context) The operator context
+            obj - (bpy.types.Object) The tree to replace, active
+            profiler - (Profiler) Receives the time of each stage
+            growth - (Tree) A tree grown earlier to mesh, see alt_create_tree
+        """
+        mtree_props = context.scene.mtree_props
+        has_arm_prop = obj.get('has_armature')
+        has_emitter_prop = obj.get('has_emitter')
+        pos = obj.location
+        name = obj.name
+        scale = obj.scale
+        rot = obj.rotation_euler
+        remove_tree_preview()
+        alt_create_tree(self, pos, profiler, growth)
+        ob = context.active_object  # this is the new object that has been set active by 'create_tree'
+        log_generation(self, "remesh_tree" if self.remesh else "update_tree", ob, profiler)
+        ob.scale = scale
+        ob.name = name
+        ob.rotation_euler = rot
+        ob.select = False
+        obj.select = True
+
+        if has_arm_prop:
+            arm_pos = obj.parent.location
+            arm_scale = obj.parent.scale
+            arm_rot = obj.parent.rotation_euler
+            obj.parent.select = True
+
+            if mtree_props.create_armature:
+                ob.parent.location = arm_pos
+                ob.parent.scale = arm_scale
+                ob.parent.rotation_euler = arm_rot
+            else:
+                ob.location = arm_pos
+                ob.scale = arm_scale
+                ob.rotation_euler = arm_rot
+
+        if has_emitter_prop:
+            for emitter in [i for i in obj.children if i.get("emitter")]:
+                emitter.select = True
+                for leaf in emitter.children:
+                    leaf.select = True
+
+        for lod in [i for i in obj.children if i.get("lod_level")]:
+            lod.hide = False
+            lod.select = True
+
+        bpy.ops.object.delete(use_global=False)
+        ob.select = True
+
 
 class UpdateTwigOperator(Operator):
     """Update a twig"""
@@ -201,6 +659,7 @@ class UpdateTwigOperator(Operator):
 
         mtree_props = context.scene.mtree_props
 
+        cancel_growth()
         seed(mtree_props.SeedProp)
         obj = bpy.context.active_object
 
@@ -230,6 +689,7 @@ class UpdateTwigOperator(Operator):
             self.report({'ERROR'}, "No active twig object!")
             return {'CANCELLED'}
 
+        deferred_save(self)
         return {'FINISHED'}
 
 
@@ -17,10 +17,19 @@
 # along with Modular Tree.  If not, see <http://www.gnu.org/licenses/>.
 # ##### END GPL LICENSE BLOCK #####
 
+from hashlib import md5
+
 from mathutils import Vector, Matrix
 
 import bpy
 
+# bump when a builder changes the graph in a way that isn't visible in its node and link tables
+MATERIAL_RECIPE_VERSION = 1
+RECIPE_PROPERTY = "mtree_recipe"
+
+# recipe hash -> name of the material built from it
+material_cache = {}
+
 # Material node_tree
 Bark_Nodes, Bark_Links = ([('NodeReroute', Vector((-580.0, 460.0)), 'Reroute', ''),
                           ('ShaderNodeSeparateXYZ', Vector((-560.0, 140.0)), 'Separate XYZ', ''),
@@ -145,4 +154,44 @@ def build_leaf_material(mat_name):
         to_node = mat.node_tree.nodes[t[0]]
         links.new(from_node.outputs[f[1]], to_node.inputs[t[1]])
 
-    return mat
\ No newline at end of file
+    return mat
+
+
+def recipe_hash(builder, nodes, links):
+    """Returns a hash identifying the graph a material builder makes.
+
+    Args:
+        builder - (function) The function building the material
+        nodes - (list) The node table used by the builder
+        links - (list) The link table used by the builder
+    """
+    recipe = repr((MATERIAL_RECIPE_VERSION, builder.__name__, nodes, links))
+    return md5(recipe.encode()).hexdigest()
+
+
+def get_cached_material(builder, mat_name, nodes, links):
+    """Returns the material built from a recipe, building it only if no material of the file was made from it.
+
+    The recipe hash is stored on the material, so trees of a batch and trees made in earlier sessions share the
+    same datablock. Per tree variation comes from the Object Info node of the graph.
+
+    Args:
+        builder - (function) The function building the material, takes the material name
+        mat_name - (string) The name given to the material when it has to be built
+        nodes - (list) The node table used by the builder
+        links - (list) The link table used by the builder
+    """
+    key = recipe_hash(builder, nodes, links)
+    mat = bpy.data.materials.get(material_cache.get(key, ""))
+    if mat is None or mat.get(RECIPE_PROPERTY) != key:
+        mat = next((m for m in bpy.data.materials if m.get(RECIPE_PROPERTY) == key), None)
+    if mat is None:
+        mat = builder(mat_name)
+        mat[RECIPE_PROPERTY] = key
+    material_cache[key] = mat.name
+    return mat
+
+
+def get_bark_material(mat_name):
+    """Returns the shared bark material, see get_cached_material."""
+    return get_cached_material(build_bark_material, mat_name, Bark_Nodes, Bark_Links)
@@ -281,6 +281,8 @@ class TreeOutput(Node, ModularTreeNodeTree):
     uv = bpy.props.BoolProperty(default=True)
     create_material = bpy.props.BoolProperty(default=False)
     material = bpy.props.StringProperty(default="")
+    lod_levels = bpy.props.IntProperty(default=0, min=0, max=3, name="LOD levels")
+    lod_min_radius = bpy.props.FloatProperty(default=.05, min=0, name="LOD min radius")
 
     def init(self, context):
 
@@ -298,11 +300,20 @@ class TreeOutput(Node, ModularTreeNodeTree):
                 row.operator("mod_tree.add_tree", icon_value=get_icon("TREE"))
         except:
             row.operator("mod_tree.add_tree", icon_value=get_icon("TREE"))
+        row = layout.row(align=True)
+        row.operator("mod_tree.preview_tree", icon="OUTLINER_OB_ARMATURE")
+        row.prop(context.scene.mtree_props, "live_preview", toggle=True, icon="RESTRICT_VIEW_OFF")
+        # imported here as cost_estimate imports tree_creator, which imports this module
+        from .cost_estimate import draw_cost_estimate
+        draw_cost_estimate(layout.box(), context.scene.mtree_props)
         layout.prop(self, "Seed")
         layout.prop(self, "uv")
         layout.prop(self, "create_material")
         if not self.create_material:
             layout.prop_search(self, "material", bpy.data, "materials", text="", icon="MATERIAL_DATA")
+        layout.prop(self, "lod_levels")
+        if self.lod_levels > 0:
+            layout.prop(self, "lod_min_radius")
 
     def update(self):
         scene = bpy.context.scene
@@ -312,6 +323,8 @@ class TreeOutput(Node, ModularTreeNodeTree):
         seed(self.Seed)
         mtree_props.mat = self.create_material
         mtree_props.bark_material = self.material
+        mtree_props.lod_levels = self.lod_levels
+        mtree_props.lod_min_radius = self.lod_min_radius
 
 
 class TwigNode(Node, ModularTreeNodeTree):
@@ -485,16 +498,30 @@ class ParticleNode(Node, ModularTreeNodeTree):
     leaf_object = bpy.props.StringProperty(default="")
     leaf_size = bpy.props.FloatProperty(default=1.0)
     emitter = bpy.props.BoolProperty(default=True, name='create particle emitter')
+    instancing = bpy.props.EnumProperty(
+        name="Leaves",
+        items=[('PARTICLES', "Particles", "Leaves are distributed by a particle system"),
+               ('FACES', "Precomputed", "Leaf transforms are computed once and instanced on faces")],
+        default='PARTICLES')
+    clump_size = bpy.props.FloatProperty(default=0, min=0, name="Clump Size")
+    clump_variants = bpy.props.IntProperty(default=4, min=1, max=16, name="Clump Variants")
 
     def init(self, context):
         self.inputs.new('NodeSocketShader', "Tree")
         self.outputs.new('NodeSocketShader', "Tree")
 
     def draw_buttons(self, context, layout):
-        layout.prop(self, 'emitter')
+        layout.prop(self, 'instancing', expand=True)
+        if self.instancing == 'PARTICLES':
+            layout.prop(self, 'emitter')
         layout.prop_search(self, "leaf_object", bpy.data, "objects", text="", icon="OBJECT_DATA")
         layout.prop(self, 'number')
-        layout.prop(self, 'viewport_number')
+        if self.instancing == 'PARTICLES':
+            layout.prop(self, 'viewport_number')
+        else:
+            layout.prop(self, 'clump_size')
+            if self.clump_size > 0:
+                layout.prop(self, 'clump_variants')
         layout.prop(self, 'leaf_size')
 
     def update(self):
@@ -504,6 +531,9 @@ class ParticleNode(Node, ModularTreeNodeTree):
         mtree_props.display = self.viewport_number
         mtree_props.twig_particle = self.leaf_object
         mtree_props.particle_size = self.leaf_size
+        mtree_props.leaf_instancing = self.instancing
+        mtree_props.leaf_clump_size = self.clump_size
+        mtree_props.leaf_clump_variants = self.clump_variants
 
 
 class PruningNode(Node, ModularTreeNodeTree):
@@ -531,9 +561,13 @@ class ArmatureNode(Node, ModularTreeNodeTree):
     ''' armature configuration Node '''
     bl_idname = 'ArmatureNode'
     bl_label = 'Armature'
-    bl_width_default = 120
+    bl_width_default = 160
 
     max_bones_iteration = bpy.props.IntProperty(default=5)
+    target_bones = bpy.props.IntProperty(default=0, min=0, name="Bone Budget")
+    merge_angle = bpy.props.FloatProperty(default=0, min=0, max=90, name="Merge Angle")
+    min_length = bpy.props.FloatProperty(default=0, min=0, name="Min Length")
+    min_radius = bpy.props.FloatProperty(default=0, min=0, name="Min Radius")
 
     def init(self, context):
         self.inputs.new('NodeSocketShader', "Tree")
@@ -541,6 +575,10 @@ class ArmatureNode(Node, ModularTreeNodeTree):
 
     def draw_buttons(self, context, layout):
         layout.prop(self, 'max_bones_iteration')
+        layout.prop(self, 'target_bones')
+        layout.prop(self, 'merge_angle')
+        layout.prop(self, 'min_length')
+        layout.prop(self, 'min_radius')
 
     def update(self):
         pass
@@ -17,6 +17,8 @@
 # along with Modular Tree.  If not, see <http://www.gnu.org/licenses/>.
 # ##### END GPL LICENSE BLOCK #####
 
+from time import time
+
 import bpy
 
 from .addon_name import get_addon_name
@@ -36,8 +38,16 @@ def save_text(text):
         d.write(str(text_as_string))
 
 
+def get_addon_prefs():
+    try:
+        return bpy.context.user_preferences.addons[get_addon_name()].preferences
+    except KeyError:
+        print("Could not find addon prefs! Files not saved!")
+        return None
+
+
 def always_save():
-    """Saves .blend file and referenced images/texts.
+    """Saves .blend file and referenced images/texts, skipping everything that has not changed since it was last saved.
 
     Does not save 'Render Result' or 'Viewer Node'
 
@@ -46,22 +56,24 @@ def always_save():
         "IMAGE_ERROR", image: IF image has not been saved
         "SUCCESS", None: IF saved all required types correctly
     """
-    try:
-        addon_prefs = bpy.context.user_preferences.addons[get_addon_name()].preferences
-    except KeyError:
-        print("Could not find addon prefs! Files not saved!")
+    addon_prefs = get_addon_prefs()
+    if addon_prefs is None:
         return "FAILED", None
 
-    print("\n")
+    start = time()
+    saved = []
 
     # save file
     if addon_prefs.always_save_prior:
-        if bpy.data.is_saved:
+        if not bpy.data.is_dirty:
+            print("Blend file unchanged since last save, skipped...")
+        elif bpy.data.is_saved:
             bpy.ops.wm.save_mainfile()
+            saved.append("blend file")
             print("Blend file saved...")
         else:
             bpy.ops.wm.save_as_mainfile(filepath=bpy.context.user_preferences.filepaths.temporary_directory + '\modular_tree', copy=True)
-
+            saved.append("blend file copy")
 
     # save all images
     if addon_prefs.save_all_images:
@@ -69,6 +81,7 @@ def always_save():
             if image.has_data and image.is_dirty and not image.packed_file:
                 if image.filepath:
                     image.save()
+                    saved.append("image " + image.name)
                     print("Image \"", image.name, "\" saved...", sep="")
                 elif image.name != 'Render Result' and image.name != 'Viewer Node':
                     return "IMAGE_ERROR", image
@@ -79,13 +92,31 @@ def always_save():
             if text.filepath and text.is_dirty:
                 # my function for saving texts
                 save_text(text)
+                saved.append("text " + text.name)
                 print("Text \"", text.name, "\" saved...", sep="")
 
-    print("\n")
+    print("Saving took {:.3f} seconds ({})".format(time() - start, ", ".join(saved) if saved else "nothing to save"))
 
     return "SUCCESS", None
 
 
+def deferred_save(operator):
+    """Runs the save that save_everything left for later when the save timing is 'AFTER', does nothing otherwise.
+
+    Operators call it once their work is done, right before returning {'FINISHED'}.
+
+    Args:
+        operator - (Operator) The operator to report a failed save to
+    """
+    addon_prefs = get_addon_prefs()
+    if addon_prefs is None or addon_prefs.save_timing != 'AFTER':
+        return
+    save_return, bad_file = always_save()
+    if save_return == "IMAGE_ERROR":
+        operator.report({'WARNING'}, "Image '" + bad_file.name + "' does not have a valid file path (for saving), "
+                                     "the save after the operation stopped")
+
+
 def save_everything(twig=False):
     messages = []
     message_lvls = []
@@ -99,6 +130,11 @@ def save_everything(twig=False):
     #         message_lvls += ['ERROR']
     #         return messages, message_lvls, 'CANCELLED'
 
+    addon_prefs = get_addon_prefs()
+    if addon_prefs is not None and addon_prefs.save_timing == 'AFTER':
+        # the operator saves with deferred_save once it is done
+        return [], [], ''
+
     # save files
     save_return, bad_file = always_save()
     if save_return == "IMAGE_ERROR":
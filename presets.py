@@ -18,6 +18,8 @@
 # ##### END GPL LICENSE BLOCK #####
 
 import os
+import json
+import shutil
 
 import bpy
 from bpy.props import StringProperty, BoolProperty, FloatProperty, IntProperty, EnumProperty
@@ -27,19 +29,147 @@ import pickle
 
 from .addon_name import get_addon_name
 
+PRESET_EXTENSION = ".mtp"  # mtp stands for modular tree preset
+PRESET_FORMAT = "mtp"
+PRESET_VERSION = 1
+PICKLE_PROTOCOL_MARK = b"\x80"
+
+
+def encode_values(props):
+    """Returns the (name, value) pairs of props with array values (IDPropertyArray) converted to lists
+    and nested groups to dictionaries."""
+    for name, value in props:
+        if hasattr(value, "to_list"):
+            value = value.to_list()
+        elif hasattr(value, "to_dict"):
+            value = value.to_dict()
+        yield name, value
+
+
+def encode_preset(props):
+    """Returns the versioned serialisation of a list of (name, value) properties."""
+    return json.dumps({"format": PRESET_FORMAT, "version": PRESET_VERSION, "props": dict(encode_values(props))},
+                      sort_keys=True, separators=(",", ":")).encode()
+
+
+def decode_preset(data):
+    """Returns the {name: value} properties of a preset file content.
+
+    Reads the versioned format as well as the pickled (name, value) lists of older presets.
+    Raises ValueError when the content is not a preset.
+    """
+    if data[:1] == PICKLE_PROTOCOL_MARK:
+        try:
+            return dict(pickle.loads(data))
+        except (pickle.UnpicklingError, EOFError, TypeError, AttributeError, ImportError) as e:
+            raise ValueError("Invalid legacy preset: {}".format(e))
+
+    try:
+        content = json.loads(data.decode())
+    except (UnicodeDecodeError, ValueError) as e:
+        raise ValueError("Invalid preset: {}".format(e))
+    if not isinstance(content, dict) or content.get("format") != PRESET_FORMAT:
+        raise ValueError("Not a modular tree preset")
+    if content.get("version", 0) > PRESET_VERSION:
+        raise ValueError("Preset made by a newer version of the addon (version {})".format(content["version"]))
+    return content["props"]
+
+
+class PresetStore:
+    """The presets of a directory, listed and loaded lazily.
+
+    The listing is cached and only read again when the modification time of the directory changes, which
+    happens whenever a preset is added, removed or renamed. Loaded presets are cached along with the
+    modification time of their file.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.mtime = None
+        self.names = []
+        self.contents = {}
+
+    def invalidate(self):
+        self.mtime = None
+
+    def list(self):
+        """Returns the sorted file names of the presets."""
+        try:
+            mtime = os.stat(self.directory).st_mtime
+        except OSError:
+            self.mtime = None
+            self.names = []
+            return self.names
+
+        if mtime != self.mtime:
+            self.mtime = mtime
+            self.names = sorted((f for f in os.listdir(self.directory) if f.endswith(PRESET_EXTENSION)),
+                                key=str.lower)
+            self.contents = {name: self.contents[name] for name in self.names if name in self.contents}
+        return self.names
+
+    def path(self, filename):
+        return os.path.join(self.directory, filename)
+
+    def load(self, filename):
+        """Returns the {name: value} properties of a preset. Raises OSError or ValueError."""
+        path = self.path(filename)
+        mtime = os.stat(path).st_mtime
+        cached = self.contents.get(filename)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        with open(path, 'rb') as p:
+            props = decode_preset(p.read())
+        self.contents[filename] = (mtime, props)
+        return props
+
+    def save(self, filename, props):
+        """Writes a list of (name, value) properties as a preset."""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.path(filename), 'wb') as p:
+            p.write(encode_preset(props))
+        self.contents.pop(filename, None)
+        self.invalidate()
+
+    def install(self, source):
+        """Copies a preset file to the store after checking it can be read."""
+        with open(source, 'rb') as p:
+            decode_preset(p.read())
+        os.makedirs(self.directory, exist_ok=True)
+        filename = os.path.basename(source)
+        shutil.copyfile(source, self.path(filename))
+        self.contents.pop(filename, None)
+        self.invalidate()
+
+    def remove(self, filename):
+        os.remove(self.path(filename))
+        self.contents.pop(filename, None)
+        self.invalidate()
+
+
+preset_store = PresetStore(os.path.join(os.path.dirname(__file__), "mod_tree_presets"))
+
+
+def apply_preset(mtree_props, props):
+    """Applies preset properties in one pass, only writing the ones that differ from the current values.
+
+    Returns:
+        (int) The number of changed properties
+    """
+    current = dict(encode_values(mtree_props.items()))
+    changed = {name: value for name, value in props.items() if current.get(name, None) != value}
+    for name, value in changed.items():
+        mtree_props[name] = value
+    return len(changed)
+
 
 class TreePresetLoadMenu(Menu):
     bl_idname = "mod_tree.preset_load_menu"
     bl_label = "Load Preset"
 
     def draw(self, context):
-        # get file names
-        presets = os.listdir(os.path.join(os.path.dirname(__file__), "mod_tree_presets"))
-        presets = [a for a in presets if a[-4:] == ".mtp"]  # limit to only file ending with .mtp
-
         layout = self.layout
-        for preset in presets:
-            # this adds a button to the menu for the preset
+        for preset in preset_store.list():
             # the preset display name has the .mtp sliced off
             # the full preset name is passed the the filename prop of the loader
             layout.operator("mod_tree.load_preset", text=preset[:-4]).filename = preset
@@ -50,15 +180,8 @@ class TreePresetRemoveMenu(Menu):
     bl_label = "Remove Preset"
 
     def draw(self, context):
-        # get file names
-        presets = os.listdir(os.path.join(os.path.dirname(__file__), "mod_tree_presets"))
-        presets = [a for a in presets if a[-4:] == ".mtp"]  # limit to only file ending with .mtp
-
         layout = self.layout
-        for preset in presets:
-            # this adds a button to the menu for the preset
-            # the preset display name has the .mtp sliced off
-            # the full preset name is passed the the filename prop of the loader
+        for preset in preset_store.list():
             layout.operator("mod_tree.remove_preset", text=preset[:-4]).filename = preset
 
 
@@ -75,14 +198,7 @@ class SaveTreePresetOperator(Operator):
         # doing it all by hand is tedious, with this we have something like "[(name1,value1), (name2,value2), ...]"
         props = mtree_props.items()
 
-
-        # write to file
-        prsets_directory = os.path.join(os.path.dirname(__file__), "mod_tree_presets")
-        prset = os.path.join(prsets_directory, mtree_props.preset_name + ".mtp")  # mtp stands for modular tree preset
-
-        os.makedirs(os.path.dirname(prset), exist_ok=True)
-        with open(prset, 'wb') as p:
-            pickle.dump(props, p)
+        preset_store.save(mtree_props.preset_name + PRESET_EXTENSION, props)
 
         return {'FINISHED'}
 
@@ -100,21 +216,15 @@ class InstallTreePresetOperator(Operator):
     def execute(self, context):
         addon_prefs = bpy.context.user_preferences.addons[get_addon_name()].preferences
 
-        if not os.path.isfile(addon_prefs.preset_file) or addon_prefs.preset_file[-4:] != ".mtp":
+        if not os.path.isfile(addon_prefs.preset_file) or addon_prefs.preset_file[-4:] != PRESET_EXTENSION:
             self.report({'ERROR'}, "Not a valid preset file!")
             return {'CANCELLED'}
 
-        with open(addon_prefs.preset_file, 'r') as p:
-            content = p.read()
-
-        # write to file
-        prsets_directory = os.path.join(os.path.dirname(__file__), "mod_tree_presets")
-        preset_name = os.path.basename(addon_prefs.preset_file)[:-4]
-        prset = os.path.join(prsets_directory, preset_name + ".mtp")  # mtp stands for modular tree preset
-
-        os.makedirs(os.path.dirname(prset), exist_ok=True)
-        with open(prset, 'w') as p:
-            print(content, file=p, flush=True)
+        try:
+            preset_store.install(addon_prefs.preset_file)
+        except (OSError, ValueError) as e:
+            self.report({'ERROR'}, "Could not install preset: {}".format(e))
+            return {'CANCELLED'}
 
         return {'FINISHED'}
 
@@ -132,9 +242,7 @@ class RemoveTreePresetOperator(Operator):
         return context.window_manager.invoke_confirm(self, event)
 
     def execute(self, context):
-        prsets_directory = os.path.join(os.path.dirname(__file__), "mod_tree_presets")
-        prset = os.path.join(prsets_directory, self.filename)  # mtp stands for modular tree preset
-        os.remove(prset)
+        preset_store.remove(self.filename)
 
         return {'FINISHED'}
 
@@ -151,15 +259,12 @@ class LoadTreePresetOperator(Operator):
     def execute(self, context):
         mtree_props = context.scene.mtree_props
 
-        prsets_directory = os.path.join(os.path.dirname(__file__), "mod_tree_presets")
-        prset = os.path.join(prsets_directory, self.filename)  # mtp stands for modular tree preset
-
-        "M"  # mtp stands for modular tree preset
-        with open(prset, 'rb') as p:
-            presets = pickle.load(p)
-
-        for (name, value) in presets:
-            mtree_props[name] = value
+        try:
+            props = preset_store.load(self.filename)
+        except (OSError, ValueError) as e:
+            self.report({'ERROR'}, "Could not load preset: {}".format(e))
+            return {'CANCELLED'}
 
+        apply_preset(mtree_props, props)
 
         return {'FINISHED'}
@@ -0,0 +1,426 @@
+# Copyright 2016 Maxime Herpin, Jake Dube
+#
+# ##### BEGIN GPL LICENSE BLOCK ######
+# This file is part of Modular Tree.
+#
+# Modular Tree is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Modular Tree is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Modular Tree.  If not, see <http://www.gnu.org/licenses/>.
+# ##### END GPL LICENSE BLOCK #####
+
+from math import pi, cos, sin, radians
+from heapq import heappush, heappop
+from array import array
+
+from mathutils import Vector
+
+# node types
+BRANCH = 0
+TRUNK = 1
+ROOTS = 2
+
+# piece kinds
+MODULE = 0  # a Module (branch ring or end cap) bridged to the ring of its parent node
+SPLIT = 1  # a Split bridged to the ring of its parent node, with two exit rings
+BASE = 2  # a static part of the tree added as is (the root module or the roots base)
+
+# growth decisions
+GROW = 0
+FORK = 1
+CUT = 2
+DECISION_NAMES = ("grow", "split", "cut")
+
+
+class Piece:
+    """A part of the tree mesh as decided by the growth: which template is placed where.
+
+    The meshing stage only has to transform the template vertices, everything random has already been drawn.
+    """
+    __slots__ = ('kind', 'template', 'parent', 'origin', 'direction', 'scale', 'rotation', 'inter_fact', 'height',
+                 'uv_scale', 'real_radius', 'leaf_weight')
+
+    def __init__(self, kind, template, parent=-1, origin=None, direction=None, scale=1.0, rotation=0.0,
+                 inter_fact=0.0, height=0.0, uv_scale=1.0, real_radius=0.0, leaf_weight=False):
+        """Initialises the variables
+
+        Args:
+            kind - (int) MODULE, SPLIT or BASE
+            template - (Module, Split or RootBase) The template to place
+            parent - (int) The node whose ring the piece is bridged to
+            origin - (Vector) Where the template origin is placed
+            direction - (Vector) The direction the template is pointing at
+            scale - (float) The scale of the template
+            rotation - (float) The rotation of the template around direction, in radians
+            inter_fact - (float) The interpolation factor between the two forms of a Split
+            height - (float) The uv height at the base of the piece
+            uv_scale - (float) The vertical uv scale of the bridge to the parent ring
+            real_radius - (float) The parent ring diameter, stored in the radius vertex color
+            leaf_weight - (bool) The last vertex of the piece is part of the leaf vertex group
+        """
+        self.kind = kind
+        self.template = template
+        self.parent = parent
+        # copied, the growth keeps changing the vectors of the extremities in place
+        self.origin = Vector(origin) if origin is not None else None
+        self.direction = Vector(direction) if direction is not None else None
+        self.scale = scale
+        self.rotation = rotation
+        self.inter_fact = inter_fact
+        self.height = height
+        self.uv_scale = uv_scale
+        self.real_radius = real_radius
+        self.leaf_weight = leaf_weight
+
+
+class TreeSkeleton:
+    """The growth graph of a tree, one node per ring of the tree mesh.
+
+    Each property is stored in its own list, node i being the i-th element of every list.
+    The pieces list holds the mesh parts in creation order, nodes refer to the piece and exit slot their ring comes from.
+    bones holds the name of the armature bone each ring follows, None until the growth decides it.
+    vertex_count is the number of vertices the pieces will make once meshed.
+
+    Methods:
+        __init__ - Initialises the variables
+        add_node - Adds a node to the skeleton
+        add_piece - Adds a mesh piece to the skeleton
+        piece_nodes - Returns the nodes of each piece
+        children - Returns the children of every node
+    """
+
+    def __init__(self):
+        self.positions = []
+        self.directions = []
+        self.radii = []
+        self.parents = []
+        self.iterations = []
+        self.types = []
+        self.node_pieces = []
+        self.slots = []
+        self.bones = []
+        self.pieces = []
+        self.vertex_count = 0
+
+    def __len__(self):
+        return len(self.positions)
+
+    def add_node(self, position, direction, radius, parent, iteration, node_type, piece=-1, slot=0):
+        """Adds a node to the skeleton
+
+        Args:
+            position - (Vector) The center of the ring
+            direction - (Vector) The growth direction at the ring
+            radius - (float) The radius of the ring
+            parent - (int) The index of the parent node, -1 for the base of the tree
+            iteration - (int) The iteration the node was created at
+            node_type - (int) BRANCH, TRUNK or ROOTS
+            piece - (int) The index of the piece the ring belongs to, -1 if the node has no ring
+            slot - (int) Which exit of the piece the ring is
+
+        Returns:
+            (int) The index of the new node
+        """
+        self.positions.append(Vector(position))
+        self.directions.append(Vector(direction).normalized())
+        self.radii.append(radius)
+        self.parents.append(parent)
+        self.iterations.append(iteration)
+        self.types.append(node_type)
+        self.node_pieces.append(piece)
+        self.slots.append(slot)
+        self.bones.append(None)
+        return len(self.positions) - 1
+
+    def add_piece(self, kind, template, vertex_count=None, **kwargs):
+        """Adds a mesh piece, see Piece for the arguments. vertex_count is the number of vertices the piece makes once
+        meshed, when it isn't the one of template. Returns (int) the index of the new piece"""
+        self.pieces.append(Piece(kind, template, **kwargs))
+        if vertex_count is None:
+            vertex_count = len(template.verts1 if kind == SPLIT else template.verts)
+        self.vertex_count += vertex_count
+        return len(self.pieces) - 1
+
+    def piece_nodes(self):
+        """Returns (list of list of int) the nodes of each piece, ordered by exit slot"""
+        nodes = [[] for i in range(len(self.pieces))]
+        for i, piece in enumerate(self.node_pieces):
+            if piece >= 0:
+                nodes[piece].append(i)
+        for piece_nodes in nodes:
+            piece_nodes.sort(key=lambda i: self.slots[i])
+        return nodes
+
+    def children(self):
+        """Returns (list of list of int) the indexes of the children of each node"""
+        children = [[] for i in range(len(self.positions))]
+        for i, parent in enumerate(self.parents):
+            if parent >= 0:
+                children[parent].append(i)
+        return children
+
+
+class GrowthLog:
+    """The decision taken for every extremity at every iteration of the growth, and what it was based on.
+
+    Each column is an array, row i being the i-th element of every array. The geometry that results from the
+    decisions is in the skeleton, so the log is only needed to understand why the tree grew the way it did.
+
+    Methods:
+        __init__ - Initialises the columns
+        add - Adds a decision
+        rows - Returns the decisions taken at a node
+        counts - Returns the number of each decision per iteration
+        display - Prints the counts
+    """
+
+    def __init__(self):
+        self.nodes = array('l')  # the node the extremity was at
+        self.iterations = array('l')
+        self.decisions = array('b')  # GROW, FORK or CUT
+        self.templates = array('b')  # the index of the split template, -1 when not splitting
+        self.split_probabilities = array('f')
+        self.break_chances = array('f')
+        self.rotations = array('f')  # the rotation of the next piece around the branch, in degrees
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def add(self, node, iteration, decision, template, split_probability, break_chance, rotation):
+        """Adds a decision
+
+        Args:
+            node - (int) The skeleton node the extremity was at
+            iteration - (int) The iteration of the decision
+            decision - (int) GROW, FORK or CUT
+            template - (int) The index of the split template used, -1 if not splitting
+            split_probability - (float) The split probability after pruning
+            break_chance - (float) The break chance after obstacles and pruning
+            rotation - (float) The rotation of the next piece around the branch, in degrees
+        """
+        self.nodes.append(node)
+        self.iterations.append(iteration)
+        self.decisions.append(decision)
+        self.templates.append(template)
+        self.split_probabilities.append(split_probability)
+        self.break_chances.append(break_chance)
+        self.rotations.append(rotation)
+
+    def rows(self, node):
+        """Returns (list of dict) the decisions taken at node, usually one"""
+        return [{"iteration": self.iterations[i], "decision": DECISION_NAMES[self.decisions[i]],
+                 "template": self.templates[i], "split_probability": self.split_probabilities[i],
+                 "break_chance": self.break_chances[i], "rotation": self.rotations[i]}
+                for i in range(len(self.nodes)) if self.nodes[i] == node]
+
+    def counts(self):
+        """Returns (dict) iteration -> [grow count, split count, cut count]"""
+        counts = {}
+        for iteration, decision in zip(self.iterations, self.decisions):
+            counts.setdefault(iteration, [0, 0, 0])[decision] += 1
+        return counts
+
+    def display(self):
+        counts = self.counts()
+        print("Growth decisions ({} in total):".format(len(self)))
+        for iteration in sorted(counts):
+            print("    iteration {}: {} grow, {} split, {} cut".format(iteration, *counts[iteration]))
+
+
+def simplify_bones(bones, bone_radii, target=None, min_length=0.0, min_radius=0.0, merge_angle=0.0):
+    """Reduces the number of bones of the armature.
+
+    First, a bone whose parent has no other child and points nearly the same way is merged into its parent.
+    Then bones thinner than min_radius or shorter than min_length are dropped. Finally, while there are more
+    bones than target, the thinnest bone without children is dropped.
+    The vertices of a merged or dropped bone follow the bone it was merged into or its closest kept ancestor.
+
+    Args:
+        bones - (list of (string, string, Vector, Vector)) The parent name, name, head and tail of each bone,
+            parents always before their children. The root bone "1" is not part of the list and is always kept
+        bone_radii - (dict of string: float) The branch radius at each bone
+        target - (int) The maximum number of bones besides the root bone, None for no limit
+        min_length - (float) The length under which a bone is dropped
+        min_radius - (float) The branch radius under which a bone is dropped
+        merge_angle - (float) The angle in degrees under which a bone is merged into its parent
+
+    Returns:
+        bones - (list of (string, string, Vector, Vector)) The kept bones, in the same format
+        remap - (dict of string: string) The bone every merged or dropped bone was replaced with
+    """
+    parents = {}
+    heads = {}
+    tails = {}
+    order = []
+    child_count = {"1": 0}
+    for (pname, name, head, tail) in bones:
+        pname, name = str(pname), str(name)
+        parents[name] = pname
+        heads[name] = Vector(head)
+        tails[name] = Vector(tail)
+        order.append(name)
+        child_count[name] = 0
+        child_count[pname] = child_count.get(pname, 0) + 1
+
+    remap = {}
+    rank = {name: i for i, name in enumerate(order)}
+
+    def resolve(name):
+        while name in remap:
+            name = remap[name]
+        return name
+
+    # merge nearly collinear chains, parents come first so a chain is merged into its first bone
+    max_angle = radians(merge_angle)
+    for name in order:
+        parent = resolve(parents[name])
+        parents[name] = parent
+        if parent == "1" or child_count[parent] != 1 or max_angle <= 0:
+            continue
+        parent_dir = tails[parent] - heads[parent]
+        direction = tails[name] - heads[name]
+        if parent_dir.length > 0 and direction.length > 0 and parent_dir.angle(direction) < max_angle:
+            tails[parent] = tails[name]
+            child_count[parent] = child_count[name]
+            remap[name] = parent
+
+    kept = [name for name in order if name not in remap]
+
+    # drop thin and short bones
+    for name in kept:
+        parent = resolve(parents[name])
+        parents[name] = parent
+        length = (tails[name] - heads[name]).length
+        if bone_radii.get(name, 0) < min_radius or length < min_length:
+            remap[name] = parent
+
+    kept = [name for name in kept if name not in remap]
+    for name in kept:
+        parents[name] = resolve(parents[name])
+
+    # drop the thinnest leaf bones until the budget is reached
+    if target is not None and target < len(kept):
+        children = {name: 0 for name in kept}
+        for name in kept:
+            if parents[name] != "1":
+                children[parents[name]] += 1
+        leaves = []
+        for name in kept:
+            if children[name] == 0:
+                heappush(leaves, (bone_radii.get(name, 0), rank[name], name))
+        count = len(kept)
+        while count > target and leaves:
+            name = heappop(leaves)[2]
+            parent = parents[name]
+            remap[name] = parent
+            count -= 1
+            if parent != "1":
+                children[parent] -= 1
+                if children[parent] == 0:
+                    heappush(leaves, (bone_radii.get(parent, 0), rank[parent], parent))
+        kept = [name for name in kept if name not in remap]
+
+    for name in list(remap):
+        remap[name] = resolve(name)
+    return [(parents[name], name, heads[name], tails[name]) for name in kept], remap
+
+
+def ring_frame(direction, previous_u):
+    """Returns two unit vectors spanning the plane orthogonal to direction.
+
+    The first one is previous_u projected on the plane, so that consecutive rings don't twist.
+    """
+    u = previous_u - direction * previous_u.dot(direction) if previous_u is not None else None
+    if u is None or u.length < 1e-4:
+        u = direction.orthogonal()
+    u.normalize()
+    return u, direction.cross(u)
+
+
+def build_tube_geometry(skeleton, ring_resolution, min_radius=0.0, cap='FAN'):
+    """Turns a skeleton into a tube mesh with ring_resolution vertices per ring.
+
+    Nodes thinner than min_radius are dropped along with everything growing from them, except trunk nodes
+    which are always kept so that the silhouette of the tree stays the same.
+
+    Args:
+        skeleton - (TreeSkeleton) The skeleton to mesh
+        ring_resolution - (int) The number of vertices of each ring, at least 3
+        min_radius - (float) The radius under which branches are dropped
+        cap - (string) 'FAN' closes branch ends with a cone, 'FLAT' with a single face
+
+    Returns:
+        verts - (list of Vector) The vertices
+        faces - (list of tuple of int) The faces
+        uvs - (list of list of (float, float)) The uvs of each face
+    """
+    ring_resolution = max(3, ring_resolution)
+    verts = []
+    faces = []
+    uvs = []
+    rings = [-1] * len(skeleton)  # index of the first vertex of the ring of each kept node
+    frames = [None] * len(skeleton)
+    heights = [0.0] * len(skeleton)
+    has_children = [False] * len(skeleton)
+    angles = [2 * pi * j / ring_resolution for j in range(ring_resolution)]
+
+    for i in range(len(skeleton)):
+        parent = skeleton.parents[i]
+        radius = skeleton.radii[i]
+        if parent >= 0 and rings[parent] < 0:
+            continue
+        if radius < min_radius and skeleton.types[i] != TRUNK:
+            continue
+
+        direction = skeleton.directions[i]
+        position = skeleton.positions[i]
+        u, v = ring_frame(direction, frames[parent][0] if parent >= 0 else None)
+        frames[i] = (u, v)
+        rings[i] = len(verts)
+        verts += [position + (u * cos(a) + v * sin(a)) * radius for a in angles]
+
+        if parent < 0:
+            faces.append(tuple(reversed(range(rings[i], rings[i] + ring_resolution))))
+            uvs.append([(.5 + cos(a) / 2, .5 + sin(a) / 2) for a in reversed(angles)])
+            continue
+
+        has_children[parent] = True
+        p_ring = rings[parent]
+        p_position = skeleton.positions[parent]
+        # the parent ring may be rotated relatively to this one, start from the vertex closest to u
+        offset = max(range(ring_resolution), key=lambda j: (verts[p_ring + j] - p_position).dot(u))
+        length = (position - p_position).length
+        heights[i] = heights[parent] + length / (2 * pi * max(radius, 1e-4))
+        h0, h1 = heights[parent], heights[i]
+        for j in range(ring_resolution):
+            k = (j + 1) % ring_resolution
+            faces.append((p_ring + (j + offset) % ring_resolution, p_ring + (k + offset) % ring_resolution,
+                          rings[i] + k, rings[i] + j))
+            u0, u1 = j / ring_resolution, (j + 1) / ring_resolution
+            uvs.append([(u0, h0), (u1, h0), (u1, h1), (u0, h1)])
+
+    for i in range(len(skeleton)):
+        if rings[i] < 0 or has_children[i] or skeleton.parents[i] < 0:
+            continue
+        ring = list(range(rings[i], rings[i] + ring_resolution))
+        if cap == 'FLAT':
+            faces.append(tuple(ring))
+            uvs.append([(.5 + cos(a) / 2, .5 + sin(a) / 2) for a in angles])
+        else:
+            tip = len(verts)
+            verts.append(skeleton.positions[i] + skeleton.directions[i] * skeleton.radii[i])
+            for j in range(ring_resolution):
+                k = (j + 1) % ring_resolution
+                faces.append((ring[j], ring[k], tip))
+                uvs.append([(j / ring_resolution, heights[i]), ((j + 1) / ring_resolution, heights[i]),
+                            ((j + .5) / ring_resolution, heights[i] + .5)])
+
+    return verts, faces, uvs
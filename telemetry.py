@@ -0,0 +1,186 @@
+# Copyright 2016 Maxime Herpin, Jake Dube
+#
+# ##### BEGIN GPL LICENSE BLOCK ######
+# This file is part of Modular Tree.
+#
+# Modular Tree is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Modular Tree is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Modular Tree.  If not, see <http://www.gnu.org/licenses/>.
+# ##### END GPL LICENSE BLOCK #####
+
+import os
+import json
+from hashlib import md5
+from time import strftime
+
+import bpy
+from bpy.types import Panel
+
+from .addon_name import get_addon_name
+from .memory_tools import get_rss, format_size
+from .presets import encode_values
+
+TELEMETRY_FILE_NAME = "generation_log.jsonl"
+# number of rotated logs kept: generation_log.jsonl.1 ... generation_log.jsonl.3
+TELEMETRY_BACKUPS = 3
+# settings that don't change the generated tree
+UNHASHED_PROPS = {"preset_name", "ui_mode", "live_preview", "tree_number", "batch_space", "batch_group_name",
+                  "batch_memory_budget"}
+
+# the last record written or read, shown by the panel
+last_record = None
+
+
+def get_log_path(addon_prefs):
+    """Returns the path of the log, in the Blender config directory unless set in the addon preferences."""
+    if addon_prefs.telemetry_file:
+        return bpy.path.abspath(addon_prefs.telemetry_file)
+    return os.path.join(bpy.utils.user_resource('CONFIG', "modular_tree", create=True), TELEMETRY_FILE_NAME)
+
+
+def params_hash(mtree_props):
+    """Returns a short hash of the settings that change the generated tree, the same settings give the same hash."""
+    values = {name: value for name, value in encode_values(mtree_props.items()) if name not in UNHASHED_PROPS}
+    return md5(json.dumps(values, sort_keys=True, default=str).encode()).hexdigest()[:12]
+
+
+def make_record(operator_name, obj, profiler, mtree_props, seed, **extra):
+    """Returns the telemetry record of a generation.
+
+    Args:
+        operator_name - (string) The operator that generated obj
+        obj - (bpy.types.Object) The generated object
+        profiler - (Profiler) The stopped profiler of the generation
+        mtree_props - (ModularTreePropertyGroup) The settings used
+        seed - (int) The seed used
+        extra - Any other value to store in the record
+    """
+    memory = profiler.memory_usage()
+    record = {"time": strftime("%Y-%m-%dT%H:%M:%S"),
+              "operator": operator_name,
+              "blender": bpy.app.version_string,
+              "params": params_hash(mtree_props),
+              "seed": seed,
+              "verts": len(obj.data.vertices),
+              "faces": len(obj.data.polygons),
+              "extremities": profiler.counters.get("extremities", []),
+              "stages": {key: round(duration, 5) for key, duration in profiler.timings().items()},
+              "peak_memory": memory[profiler.main_job]["peak"] if memory else get_rss(),
+              "truncation": obj.get("truncation")}
+    record.update(extra)
+    return record
+
+
+def rotate_log(path, backups=TELEMETRY_BACKUPS):
+    """Shifts path to path.1, path.1 to path.2 and so on, the oldest log being removed."""
+    for i in range(backups, 0, -1):
+        source = path if i == 1 else "{}.{}".format(path, i - 1)
+        if os.path.exists(source):
+            os.replace(source, "{}.{}".format(path, i))
+
+
+def append_record(path, record, max_size):
+    """Appends a record to the log, rotating it first if it is bigger than max_size bytes."""
+    global last_record
+    if max_size > 0 and os.path.isfile(path) and os.path.getsize(path) > max_size:
+        rotate_log(path)
+    with open(path, "a") as f:
+        f.write(json.dumps(record, separators=(",", ":")) + "\n")
+    last_record = record
+
+
+def read_last_record(path):
+    """Returns the last record of the log, None if there is none."""
+    try:
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(max(0, size - 65536))
+            lines = f.read().splitlines()
+    except OSError:
+        return None
+    for line in reversed(lines):
+        try:
+            return json.loads(line.decode())
+        except ValueError:
+            continue
+    return None
+
+
+def log_generation(operator, operator_name, obj, profiler, seed=None, **extra):
+    """Appends the record of a generation to the log if telemetry is enabled in the addon preferences.
+
+    Args:
+        operator - (Operator) The operator to report errors to
+        operator_name - (string) The name of the generation in the log
+        obj - (bpy.types.Object) The generated object, nothing is logged if None
+        profiler - (Profiler) The stopped profiler of the generation
+        seed - (int) The seed used, the seed of the settings if None
+        extra - Any other value to store in the record
+    """
+    addon = bpy.context.user_preferences.addons.get(get_addon_name())
+    if addon is None or not addon.preferences.telemetry or obj is None:
+        return
+    addon_prefs = addon.preferences
+    mtree_props = bpy.context.scene.mtree_props
+    if seed is None:
+        seed = mtree_props.TwigSeedProp if operator_name == "create_twig" else mtree_props.SeedProp
+    record = make_record(operator_name, obj, profiler, mtree_props, seed, **extra)
+    try:
+        append_record(get_log_path(addon_prefs), record, addon_prefs.telemetry_max_size * 1024 * 1024)
+    except OSError as e:
+        operator.report({'WARNING'}, "Could not write the generation log: {}".format(e))
+
+
+class GenerationLogPanel(Panel):
+    bl_label = "Generation Log"
+    bl_idname = "3D_VIEW_PT_layout_GenerationLog"
+    bl_space_type = 'VIEW_3D'
+    bl_region_type = 'TOOLS'
+    bl_context = "objectmode"
+    bl_category = 'Tree'
+    bl_options = {'DEFAULT_CLOSED'}
+
+    def draw(self, context):
+        global last_record
+        layout = self.layout
+        addon = context.user_preferences.addons.get(get_addon_name())
+        if addon is None or not addon.preferences.telemetry:
+            layout.label("Enable the log in the addon preferences")
+            return
+
+        if last_record is None:
+            last_record = read_last_record(get_log_path(addon.preferences)) or {}
+        if not last_record:
+            layout.label("No generation logged yet")
+            return
+
+        record = last_record
+        stages = record.get("stages", {})
+        main_job = next((key for key in stages if "/" not in key), None)
+        box = layout.box()
+        box.label("{} at {}".format(record.get("operator", "?"), record.get("time", "?")))
+        box.label("{} verts, {} faces, seed {}".format(record.get("verts", 0), record.get("faces", 0),
+                                                      record.get("seed", 0)))
+        if record.get("truncation"):
+            box.label("Cut short: " + record["truncation"], icon='ERROR')
+        if main_job is not None:
+            box.label("Total: {:.2f}s, peak memory {}".format(stages[main_job],
+                                                              format_size(record.get("peak_memory", 0))))
+            col = box.column(align=True)
+            top_level = [(duration, key.split("/")[1]) for key, duration in stages.items() if key.count("/") == 1]
+            for duration, name in sorted(top_level, reverse=True):
+                col.label("{}: {:.3f}s ({:.0f}%)".format(name, duration, 100 * duration / max(stages[main_job], 1e-9)))
+        extremities = record.get("extremities")
+        if extremities:
+            box.label("Extremities: max {} at iteration {}".format(max(extremities),
+                                                                  extremities.index(max(extremities))))
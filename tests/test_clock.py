@@ -0,0 +1,60 @@
+# Copyright 2016 Maxime Herpin, Jake Dube
+#
+# ##### BEGIN GPL LICENSE BLOCK ######
+# This file is part of Modular Tree.
+#
+# Modular Tree is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Modular Tree is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Modular Tree.  If not, see <http://www.gnu.org/licenses/>.
+# ##### END GPL LICENSE BLOCK #####
+
+"""Tests of the timing statistics, they don't need Blender:
+
+    python -m unittest discover tests
+"""
+
+import os
+import sys
+import types
+import importlib
+import unittest
+
+ADDON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_clock():
+    """Imports clock.py without the add-on __init__, which can only be imported inside Blender."""
+    package = types.ModuleType("modular_tree_standalone")
+    package.__path__ = [ADDON_DIR]
+    sys.modules.setdefault(package.__name__, package)
+    return importlib.import_module(package.__name__ + ".clock")
+
+
+clock = load_clock()
+
+
+class PercentileTest(unittest.TestCase):
+
+    def test_p95_is_the_nearest_rank(self):
+        for count, index in [(20, 18), (60, 56), (100, 94)]:
+            self.assertEqual(clock.percentile(list(range(count)), 0.95), index)
+
+    def test_bounds(self):
+        values = list(range(7))
+        self.assertEqual(clock.percentile(values, 0), 0)
+        self.assertEqual(clock.percentile(values, 0.5), 3)
+        self.assertEqual(clock.percentile(values, 1), 6)
+        self.assertEqual(clock.percentile([4.2], 0.95), 4.2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -19,18 +19,26 @@
 
 from mathutils import Vector, Matrix, Euler
 from random import random, randint, seed
-from math import pi, radians, exp, sqrt, atan
+from math import pi, radians, exp, sqrt, sin, cos
+from collections import OrderedDict, namedtuple
+from uuid import uuid4
+from time import perf_counter
+
+import numpy
 
 import bpy
 import bmesh
+from bpy.app.handlers import persistent
 
 
 from .nodes import get_node_group, curve_node_mapping
 from .pruning import *
-from .clock import Clock
+from .clock import Clock, Profiler
 
 from .particle_configurator import create_system
-from .material_tools import build_bark_material
+from .skeleton import TreeSkeleton, GrowthLog, build_tube_geometry, simplify_bones, BRANCH, TRUNK, ROOTS, MODULE, \
+    SPLIT, BASE, GROW, FORK, CUT
+from .material_tools import get_bark_material
 
 # scene = bpy.context.scene
 # mtree_props = scene.mtree_props
@@ -793,6 +801,107 @@ trunk5 = Split(
 Trunks = [trunk2, trunk3, trunk4, trunk5]
 Joncts = [S1, S2, S3, S4, trunk3, trunk2, trunk5]
 
+# the most vertices a growing extremity can add in one layer besides the end cap its second exit will need: a split
+SPLIT_VERTS = max([len(branch.verts)] + [len(split.verts1) for split in Joncts])
+
+# the ring sizes of adaptive rings, from the thickest branches to the thinnest, see ring_resolution
+ADAPTIVE_RING_RESOLUTIONS = [8, 6, 4, 3]
+
+
+def ring_module(n):
+    """Returns a Module made of a single ring of n vertices, like branch, which is returned for 8 vertices."""
+    if n == len(branch.verts):
+        return branch
+    # starts at +Y and turns the same way as branch
+    verts = [Vector((-sin(2 * pi * i / n), cos(2 * pi * i / n), 0.0)) for i in range(n)]
+    return Module(list(range(n)), (1, list(range(n))), verts, [], [], branch.uv_height)
+
+
+def cap_module(n):
+    """Returns an end cap closing a ring of n vertices with a cone, end_cap being returned for 8 vertices.
+
+    The cone is as high as end_cap and uses the same uv island, the ring on its border and the tip in its center.
+    """
+    if n == len(end_cap.entree):
+        return end_cap
+    ring = ring_module(n).verts
+    tip = Vector((0.0, 0.0, max(v[2] for v in end_cap.verts)))
+    island = [uv for face_uvs in end_cap.uv for uv in face_uvs]
+    u_min, u_max = min(uv[0] for uv in island), max(uv[0] for uv in island)
+    v_min, v_max = min(uv[1] for uv in island), max(uv[1] for uv in island)
+    center = ((u_min + u_max) / 2, (v_min + v_max) / 2)
+    size = min(u_max - u_min, v_max - v_min) / 2
+
+    def uv(vert):
+        return center[0] + vert.x * size, center[1] + vert.y * size
+
+    faces = [(j, (j + 1) % n, n) for j in range(n)]
+    uvs = [[uv(ring[j]), uv(ring[(j + 1) % n]), center] for j in range(n)]
+    return Module(list(range(n)), [], ring + [tip], faces, uvs)
+
+
+# ring size -> (ring Module, end cap Module)
+ADAPTIVE_MODULES = {n: (ring_module(n), cap_module(n)) for n in ADAPTIVE_RING_RESOLUTIONS}
+
+
+def ring_resolution(mtree_props, real_radius):
+    """Returns the number of vertices of the ring of a branch.
+
+    With adaptive rings, rings thinner than adaptive_ring_radius times the trunk radius lose vertices, one step of
+    ADAPTIVE_RING_RESOLUTIONS each time the radius halves. Otherwise every ring has the 8 vertices of the templates.
+
+    Args:
+        mtree_props - (ModularTreePropertyGroup) The settings
+        real_radius - (float) The diameter of the ring the branch grows from
+    """
+    if not mtree_props.adaptive_rings or mtree_props.adaptive_ring_radius <= 0:
+        return ADAPTIVE_RING_RESOLUTIONS[0]
+    ratio = real_radius / 2 / (mtree_props.radius * mtree_props.adaptive_ring_radius)
+    step = 0
+    while ratio < 1 and step < len(ADAPTIVE_RING_RESOLUTIONS) - 1:
+        ratio *= 2
+        step += 1
+    return ADAPTIVE_RING_RESOLUTIONS[step]
+
+
+def adaptive_module(mtree_props, module, real_radius):
+    """Returns the template that is meshed in place of module: the branch ring and the end cap of a thin branch are
+    replaced by lighter ones, see ring_resolution, any other template is kept.
+
+    Args:
+        mtree_props - (ModularTreePropertyGroup) The settings
+        module - (Module) The template chosen by the growth
+        real_radius - (float) The diameter of the ring the module grows from
+    """
+    if module is branch or module is end_cap:
+        ring, cap = ADAPTIVE_MODULES[ring_resolution(mtree_props, real_radius)]
+        return ring if module is branch else cap
+    return module
+
+
+# ring resolution and end caps of LOD1, LOD2 and LOD3
+LOD_RING_RESOLUTIONS = [6, 4, 3]
+LOD_CAPS = ['FAN', 'FAN', 'FLAT']
+
+# skeleton preview, see create_tree_preview and update_live_preview
+PREVIEW_NAME = "tree_preview"
+# properties that don't change the growth, or that the growth itself writes to
+PREVIEW_IGNORED_PROPS = {"is_tree_selected", "create_roots", "ui_mode", "live_preview"}
+
+# the steps of generate_tree after the growth
+MESHING_STAGES = ["mesh build", "skin weights", "vertex groups", "vertex paint", "particles", "uv", "material", "lod",
+                  "armature"]
+GenerationStep = namedtuple("GenerationStep", ["stage", "done", "total", "tree", "new_nodes", "obj"])
+
+# the number of grown trees kept to mesh them again, see cache_growth
+GROWTH_CACHE_SIZE = 4
+grown_trees = OrderedDict()
+last_growth_id = 0
+# growth ids are stored on the objects, this keeps an id from a previous session from matching a tree of this one
+GROWTH_SESSION = uuid4().hex[:8]
+# mesh vertices made per second by the last generation that grew its tree, see cost_estimate
+generation_rate = [None]
+
 
 class RootBase:
     """This is used to represent the base of a trunk with roots"""
@@ -1073,13 +1182,20 @@ R1 = RootBase(
 
 
 def joindre(verts, faces, v1_i, v2_i):
-    """ Takes two sets of eight vertices, a list of vertices, a list of faces, and adds new faces as the bridge edge loops operator would do.
+    """ Takes two rings of vertices, a list of vertices, a list of faces, and adds new faces as the bridge edge loops operator would do.
+
+    Rings of the same size are bridged with quads. When the sizes differ, as between a ring of 8 vertices and a
+    thinner ring of fewer vertices, the bridge walks along both rings, adding a quad where the two rings are at the
+    same fraction of their length and triangles in between.
 
     Args:
         verts - (list of (Vector, Vector, Vector)) The list of vertices
         faces - (list of (int, int, int, int)) The list of faces
-        v1_i - (int, int, int, int, int, int, int, int) The indexes of the first group of vertices
-        v2_i - (int, int, int, int, int, int, int, int) The indexes of the second group of vertices
+        v1_i - (list of int) The indexes of the first group of vertices
+        v2_i - (list of int) The indexes of the second group of vertices
+
+    Returns:
+        (list of list of (float, float)) The uvs of the added faces, in the order they were added
     """
     v1 = verts[v1_i[0]]
     n = len(v2_i)
@@ -1094,12 +1210,58 @@ def joindre(verts, faces, v1_i, v2_i):
     k = 1
     if (verts[v2_i[(decalage + 1) % n]] - v2).length > (verts[v2_i[(decalage - 1) % n]] - v2).length:
         k = -1
-    for i in range(n-1, -1, -1):
-        faces.append([v2_i[(decalage + i * k) % n], v1_i[i], v1_i[(i + 1) % n], v2_i[(decalage + (i + 1) * k) % n]])
+    if len(v1_i) == n:
+        for i in range(n-1, -1, -1):
+            faces.append([v2_i[(decalage + i * k) % n], v1_i[i], v1_i[(i + 1) % n], v2_i[(decalage + (i + 1) * k) % n]])
+        return branch.uv
+
+    m = len(v1_i)
+    h = branch.uv_height
+    uvs = []
+    a = b = 0
+    while a < m or b < n:
+        a_next = v1_i[(a + 1) % m]
+        b_vert, b_next = v2_i[(decalage + b * k) % n], v2_i[(decalage + (b + 1) * k) % n]
+        # compare the fractions (a + 1) / m and (b + 1) / n of the next vertex of each ring
+        if (a + 1) * n == (b + 1) * m:
+            faces.append([b_vert, v1_i[a % m], a_next, b_next])
+            uvs.append([(b / n, h), (a / m, 0), ((a + 1) / m, 0), ((b + 1) / n, h)])
+            a += 1
+            b += 1
+        elif (a + 1) * n < (b + 1) * m:
+            faces.append([b_vert, v1_i[a % m], a_next])
+            uvs.append([(b / n, h), (a / m, 0), ((a + 1) / m, 0)])
+            a += 1
+        else:
+            faces.append([b_vert, v1_i[a % m], b_next])
+            uvs.append([(b / n, h), (a / m, 0), ((b + 1) / n, h)])
+            b += 1
+    return uvs
+
 
+def perturb_direction(direction, random_angle):
+    """Randomly rotates a direction, as a branch never grows perfectly straight
 
-def join(verts, faces, indexes, object_verts, object_faces, scale, i1, i2, entree, directions, branch_length,
-         uv_list, jonc_uv, random_angle, branch_rotation, height, real_radius):
+    Args:
+        direction - (Vector) The direction to perturb
+        random_angle - (float) The amount of possible deviation between direction and the returned direction
+
+    Returns:
+        (Vector) The perturbed direction
+    """
+    random1 = random_angle * (random() - 0.5)
+    random2 = random_angle * (random() - 0.5)
+    random3 = random_angle * (random() - 0.5)
+
+    rand_x = Matrix.Rotation(random1, 4, 'X')
+    rand_y = Matrix.Rotation(random2, 4, 'Y')
+    rand_z = Matrix.Rotation(random3, 4, 'Z')
+
+    return ((direction * rand_x) * rand_y) * rand_z
+
+
+def join(verts, faces, indexes, object_verts, object_faces, scale, i1, i2, entree, directions, origin,
+         uv_list, jonc_uv, branch_rotation, height, uv_scale):
     """ The goal is to add a split to the tree. To do that, there is the list of existing vertices, the list of existing faces, the list of vertices to add and the list of faces to add.
         To know where to add the split, the indexes of eight vertices is given.
 
@@ -1113,49 +1275,21 @@ def join(verts, faces, indexes, object_verts, object_faces, scale, i1, i2, entre
         i1 - ((int, int, int, int, int, int, int, int))The indexes of the first end of the split
         i2 - ((int, int, int, int, int, int, int, int)) The indexes of the second end of the split
         entree - ((int, int, int, int, int, int, int, int)) the indexes of the base of the split
-        directions - (Vector) The direction the split will be pointing at
-        branch_length - (float) the distance between the branch end and the split base
-        s_index - (int) The index of the last vertex that is part of a seam
-        seams - (list of (int, int)) The seams of the tree
-        jonc_seams - (list of (int, int)) The seams of the split
-        random_angle - (float) The amount of possible deviation between directions and the actual split direction
-        branch_rotation - (float) The rotation of the split around directions
+        directions - (Vector) The direction the split is pointing at
+        origin - (Vector) Where the base of the split is placed
+        uv_list - (list of list of Vector) The uvs of the existing faces
+        jonc_uv - (list of list of (float, float)) The uvs of the faces to add
+        branch_rotation - (float) The rotation of the split around directions, in radians
+        height - (float) The uv height at the base of the split
+        uv_scale - (float) The vertical uv scale of the bridge between the branch end and the split
 
     Returns:
         i1 - ((int, int, int, int, int, int, int, int)) The indexes of the first end of the split
         i2 - ((int, int, int, int, int, int, int, int)) The indexes of the second end of the split
-        d1 - (Vector) The direction of the first end of the split
-        d2 - (Vector) The direction of the second end of the split
-        r1 - (float) The radius of the first end of the split
-        r2 - (float) The radius of the second end of the split
-        i1[0] - (int) The index of the last vertex that is part of a seam on the first end of the split
-        i2[0] - (int) The index of the last vertex that is part of a seam on the second end of the split
+        to_be_painted - (list of int) The indexes of the vertices around the bridge
     """
-    random1 = random_angle * (random() - 0.5)
-    random2 = random_angle * (random() - 0.5)
-    random3 = random_angle * (random() - 0.5)
-
-    rand_x = Matrix.Rotation(random1, 4, 'X')
-    rand_y = Matrix.Rotation(random2, 4, 'Y')
-    rand_z = Matrix.Rotation(random3, 4, 'Z')
-
-    directions = (((directions * rand_x) * rand_y) * rand_z)
-    barycentre = Vector((0, 0, 0))
-    for i in indexes:
-        barycentre += verts[i]
-    barycentre /= len(indexes)
-
-    directions.normalize()
-
-    uv_scale = 3*branch_length/real_radius
     m = Matrix([(1, 0), (0, uv_scale)])
-
-    barycentre += directions * branch_length
-    r1 = (object_verts[i1[0]] - object_verts[i1[4]]).length / 2
-    r2 = (object_verts[i2[0]] - object_verts[i2[4]]).length / 2
-    v = rot_scale(object_verts, scale, directions, radians(branch_rotation))
-    d2 = v[-1]
-    d1 = v[-2]
+    v = rot_scale(object_verts, scale, directions, branch_rotation)
 
     n = len(verts)
     to_be_painted = []
@@ -1164,17 +1298,16 @@ def join(verts, faces, indexes, object_verts, object_faces, scale, i1, i2, entre
     to_be_painted += indexes
     uv_list += [[Vector(uv)+Vector((0, height)) for uv in u] for u in jonc_uv]
     faces += [add_tuple(f, n) for f in object_faces]
-    verts += [barycentre + i for i in v]
-    joindre(verts, faces, indexes, nentree)
-    uv_list += [[m*Vector(uv) for uv in u] for u in branch.uv]
+    verts += [origin + i for i in v]
+    uv_list += [[m*Vector(uv) for uv in u] for u in joindre(verts, faces, indexes, nentree)]
 
     i1 = [n + i for i in i1]
     i2 = [n + i for i in i2]
-            
-    return i1, i2, d1, d2, r1, r2, to_be_painted  # no need to return i1[0] and i2[0]...just do that outside of the func
+
+    return i1, i2, to_be_painted
 
 
-def join_branch(verts, faces, indexes, scale, branch_length, branch_verts, direction, rand, uv_list, height, real_radius):
+def join_branch(verts, faces, indexes, scale, origin, branch_verts, direction, uv_list, height, uv_scale, ring_size=8):
     """ The goal is to add a Module to the tree. To do that, there is the list of existing vertices, the list of existing faces, the list of vertices to add and the list of faces to add.
         To know where to add the Module, the indexes of eight vertices is given.
 
@@ -1183,45 +1316,27 @@ def join_branch(verts, faces, indexes, scale, branch_length, branch_verts, direc
         faces - (list of (int, int, int, int)) The existing faces
         indexes - ((int, int, int, int, int, int, int, int)) the indexes of the end of the branch on which the Module will be added
         scale - (float) the scale of which the Module must be
-        branch_length - (float) the distance between the branch end and the Module base
+        origin - (Vector) Where the base of the Module is placed
         branch_verts - (list of (Vector, Vector, Vector)) The vertices to add
-        direction - (Vector) The direction the Module will be pointing at
-        rand - (float) The amount of possible deviation between direction and the actual Module direction
-        s_index - (int) The index of the last vertex that is part of a seam
-        seams - (list of (int, int)) The seams of the tree
+        direction - (Vector) The direction the Module is pointing at
+        uv_list - (list of list of Vector) The uvs of the existing faces
+        height - (float) The uv height at the base of the Module
+        uv_scale - (float) The vertical uv scale of the bridge between the branch end and the Module
+        ring_size - (int) The number of vertices of the entry ring of the Module, its first vertices
 
     Returns:
-        nentree - ((int, int, int, int, int, int, int, int)) The indexes of the end of the Module
-        direction - (Vector) The direction of the end of the Module
-        ns_index - (int) The index of the last vertex that is part of a seam on the end of the Module
+        nentree - (list of int) The indexes of the entry ring of the Module
     """
-    barycentre = Vector((0, 0, 0))
-    random1 = rand * (random() - 0.5)
-    random2 = rand * (random() - 0.5)
-    random3 = rand * (random() - 0.5)
-    for i in indexes:
-        barycentre += verts[i]
-    barycentre /= len(indexes)
-
-    direction.normalized()
-    rand_x = Matrix.Rotation(random1, 4, 'X')
-    rand_y = Matrix.Rotation(random2, 4, 'Y')
-    rand_z = Matrix.Rotation(random3, 4, 'Z')
-
-    direction = (((direction * rand_x) * rand_y) * rand_z)
-    barycentre += direction * branch_length
     n = len(verts)
     v = rot_scale(branch_verts, scale, direction, 0)
-    nentree = [n + i for i in range(8)]
-    verts += [ve + barycentre for ve in v]
-    joindre(verts, faces, indexes, nentree)
+    nentree = [n + i for i in range(ring_size)]
+    verts += [ve + origin for ve in v]
+    bridge_uv = joindre(verts, faces, indexes, nentree)
 
-    uv_scale = 3*branch_length / real_radius
     m = Matrix([(1, 0), (0, uv_scale)])
-    uv_list += [[m*Vector(uv) + Vector((0, height)) for uv in u] for u in branch.uv]
+    uv_list += [[m*Vector(uv) + Vector((0, height)) for uv in u] for u in bridge_uv]
 
-
-    return nentree, direction
+    return nentree
 
 
 def gravity(direction, gravity_strength):
@@ -1311,39 +1426,144 @@ def get_orthogonal_vect(v):
     return new_vect
 
 
-def add_twig_leaf(position, direction, scale, leaf, leaf_weight):
-    scene = bpy.context.scene
-    direction = Vector((0, 1, 0)) * leaf_weight + (1-leaf_weight) * direction
-    direction.normalize()
-
-    for select_ob in bpy.context.selected_objects:
-        select_ob.select = False
-    leaf_object = scene.objects[leaf]
-    scale *= (2+random())/3
-    new_leaf = leaf_object.copy()
-    new_leaf.data = leaf_object.data.copy()
-    bpy.context.scene.objects.link(new_leaf)
-    new_leaf.location = position
-    new_leaf.scale = Vector((scale, scale, scale))
-    new_leaf.rotation_euler = (pi/2 - min(leaf_weight/3 + direction.y/3, pi/2), atan(direction.x / max(.01,abs(direction.z))), 0)
-    return new_leaf
-
-
-def add_leaf(pos, direction, verts, faces):
-    angle = pi/3 * (random() - 1) * 2
-    rotation = Matrix.Rotation(angle, 4, 'Z')
-    direction = direction * rotation
-    direction.normalize()
-    direction = Vector((direction.x, direction.y, direction.z/(2 + direction.z**2)))
-    direction.normalize()
-
-    v1 = get_orthogonal_vect(direction)
-    v2 = direction.cross(v1)
-    new_verts = [pos + v1/10, pos + v2/10, pos - v1/10, pos - v2/10]
-    n = len(verts)
-    for vertex in new_verts:
-        verts.append(vertex)
-    faces.append([n-4, n-3, n-2, n-1])
+def twig_leaf_matrices(directions, scales, leaf_weight):
+    """Computes the orientation and scale of all the leaves of a twig at once
+
+    Args:
+        directions - (numpy array of shape (n, 3)) The direction of the branch each leaf grows on
+        scales - (numpy array of shape (n,)) The scale of each leaf
+        leaf_weight - (float) How much the leaves bend toward the Y axis
+
+    Returns:
+        (numpy array of shape (n, 3, 3)) The scaled rotation matrix of each leaf
+    """
+    directions = numpy.array([0, 1, 0]) * leaf_weight + (1 - leaf_weight) * directions
+    directions /= numpy.maximum(numpy.linalg.norm(directions, axis=1), 1e-6)[:, None]
+    dir_x, dir_y, dir_z = directions.T
+
+    # euler rotation (rot_x, rot_y, 0) in XYZ order
+    rot_x = pi/2 - numpy.minimum(leaf_weight/3 + dir_y/3, pi/2)
+    rot_y = numpy.arctan(dir_x / numpy.maximum(.01, numpy.abs(dir_z)))
+    cos_x, sin_x = numpy.cos(rot_x), numpy.sin(rot_x)
+    cos_y, sin_y = numpy.cos(rot_y), numpy.sin(rot_y)
+
+    matrices = numpy.empty((len(directions), 3, 3))
+    matrices[:, 0, 0] = cos_y
+    matrices[:, 0, 1] = sin_y * sin_x
+    matrices[:, 0, 2] = sin_y * cos_x
+    matrices[:, 1, 0] = 0
+    matrices[:, 1, 1] = cos_x
+    matrices[:, 1, 2] = -sin_x
+    matrices[:, 2, 0] = -sin_y
+    matrices[:, 2, 1] = cos_y * sin_x
+    matrices[:, 2, 2] = cos_y * cos_x
+    return matrices * scales[:, None, None]
+
+
+def add_mesh_instances(mesh, source, matrices, positions, material_offset=0):
+    """Appends transformed copies of a mesh to another mesh, working on whole vertex, loop and polygon arrays.
+
+    Args:
+        mesh - (bpy.types.Mesh) The mesh to add the copies to
+        source - (bpy.types.Mesh) The mesh to copy
+        matrices - (numpy array of shape (n, 3, 3)) The transformation of each copy
+        positions - (numpy array of shape (n, 3)) The location of each copy
+        material_offset - (int) Added to the material index of each copied face
+    """
+    n = len(matrices)
+    n_verts, n_loops, n_polys = len(source.vertices), len(source.loops), len(source.polygons)
+    if n == 0 or n_polys == 0:
+        return
+
+    source_co = numpy.empty(n_verts * 3, dtype=numpy.float32)
+    source.vertices.foreach_get("co", source_co)
+    loop_verts = numpy.empty(n_loops, dtype=numpy.int32)
+    source.loops.foreach_get("vertex_index", loop_verts)
+    loop_starts = numpy.empty(n_polys, dtype=numpy.int32)
+    source.polygons.foreach_get("loop_start", loop_starts)
+    loop_totals = numpy.empty(n_polys, dtype=numpy.int32)
+    source.polygons.foreach_get("loop_total", loop_totals)
+    material_indexes = numpy.empty(n_polys, dtype=numpy.int32)
+    source.polygons.foreach_get("material_index", material_indexes)
+    smooth = [p.use_smooth for p in source.polygons]
+
+    coords = numpy.einsum('nij,mj->nmi', matrices, source_co.reshape(-1, 3)) + positions[:, None, :]
+
+    first_vert, first_loop, first_poly = len(mesh.vertices), len(mesh.loops), len(mesh.polygons)
+    mesh.vertices.add(n * n_verts)
+    mesh.loops.add(n * n_loops)
+    mesh.polygons.add(n * n_polys)
+
+    all_co = numpy.empty(len(mesh.vertices) * 3, dtype=numpy.float32)
+    mesh.vertices.foreach_get("co", all_co)
+    all_co[first_vert * 3:] = coords.ravel()
+    mesh.vertices.foreach_set("co", all_co)
+
+    copies = numpy.arange(n, dtype=numpy.int32)[:, None]
+    all_loop_verts = numpy.empty(len(mesh.loops), dtype=numpy.int32)
+    mesh.loops.foreach_get("vertex_index", all_loop_verts)
+    all_loop_verts[first_loop:] = (loop_verts[None, :] + first_vert + copies * n_verts).ravel()
+    mesh.loops.foreach_set("vertex_index", all_loop_verts)
+
+    for attribute, values in (("loop_start", loop_starts[None, :] + first_loop + copies * n_loops),
+                              ("loop_total", numpy.tile(loop_totals, (n, 1))),
+                              ("material_index", numpy.tile(material_indexes + material_offset, (n, 1)))):
+        all_values = numpy.empty(len(mesh.polygons), dtype=numpy.int32)
+        mesh.polygons.foreach_get(attribute, all_values)
+        all_values[first_poly:] = values.ravel()
+        mesh.polygons.foreach_set(attribute, all_values)
+    for polygon, use_smooth in zip(mesh.polygons[first_poly:], smooth * n):
+        polygon.use_smooth = use_smooth
+
+    if source.uv_layers.active is not None:
+        if mesh.uv_layers.active is None:
+            mesh.uv_textures.new()
+        source_uv = numpy.empty(n_loops * 2, dtype=numpy.float32)
+        source.uv_layers.active.data.foreach_get("uv", source_uv)
+        all_uv = numpy.empty(len(mesh.loops) * 2, dtype=numpy.float32)
+        mesh.uv_layers.active.data.foreach_get("uv", all_uv)
+        all_uv[first_loop * 2:] = numpy.tile(source_uv, n)
+        mesh.uv_layers.active.data.foreach_set("uv", all_uv)
+
+    mesh.update(calc_edges=True)
+
+
+def orthogonal_vects(vects):
+    """Vectorized get_orthogonal_vect: returns (numpy array of shape (n, 3)) a vector orthogonal to each row of vects"""
+    x, y, z = vects.T
+    safe_z = numpy.where(z == 0, 1, z)
+    result = numpy.column_stack((numpy.ones(len(vects)), numpy.ones(len(vects)), -(x + y) / safe_z))
+    result /= numpy.linalg.norm(result, axis=1)[:, None]
+    # same priority as get_orthogonal_vect, the first null component wins
+    for axis, null in reversed(list(enumerate((x == 0, y == 0, z == 0)))):
+        result[null] = numpy.eye(3)[axis]
+    return result
+
+
+def leaf_quads(leafs):
+    """Builds one small quad per leaf position, turned randomly around the branch direction, all at once.
+
+    Args:
+        leafs - (list of (Vector, Vector)) The position and the branch direction of each leaf
+
+    Returns:
+        (numpy array of shape (n, 4, 3)) The four corners of each quad
+    """
+    positions = numpy.array([pos for pos, direction in leafs], dtype=numpy.float64).reshape(-1, 3)
+    directions = numpy.array([direction for pos, direction in leafs], dtype=numpy.float64).reshape(-1, 3)
+    angles = numpy.array([pi/3 * (random() - 1) * 2 for i in range(len(leafs))])
+
+    # direction * Matrix.Rotation(angle, 4, 'Z')
+    cos_a, sin_a = numpy.cos(angles), numpy.sin(angles)
+    x, y, z = directions.T
+    directions = numpy.column_stack((x * cos_a + y * sin_a, y * cos_a - x * sin_a, z))
+    directions /= numpy.linalg.norm(directions, axis=1)[:, None]
+    directions[:, 2] /= 2 + directions[:, 2] ** 2
+    directions /= numpy.linalg.norm(directions, axis=1)[:, None]
+
+    v1 = orthogonal_vects(directions) / 10
+    v2 = numpy.cross(directions, v1)
+    return numpy.stack((positions + v1, positions + v2, positions - v1, positions - v2), axis=1)
 
 
 def rehash_set(s, p_dist):
@@ -1371,11 +1591,7 @@ def smooth_stroke(iterations, smooth, points):
     return points
 
 
-def resolution(coord):
-    scene = bpy.context.scene
-    mtree_props = scene.mtree_props
-    res = mtree_props.pruning_resolution
-
+def resolution(coord, res):
     def f(scalar): return int(scalar/res)*res
 
     (x, y, z) = coord
@@ -1383,22 +1599,48 @@ def resolution(coord):
 
 
 def configure_obstacle():
+    """Returns a working copy of the obstacle, in world space and with its normals flipped if asked, None if there is
+    no mesh obstacle.
+
+    The copy is made through bpy.data rather than operators, so the selection and the active object are left as
+    they are, which matters when the live preview grows a tree after every change of a setting.
+    """
     scene = bpy.context.scene
     mtree_props = scene.mtree_props
-    if bpy.data.objects.get(mtree_props.obstacle) is not None:
-        obs = scene.objects[mtree_props.obstacle]
-        obs.select = True
-        scene.objects.active = obs
-        bpy.ops.object.duplicate()
-        obs = scene.objects.active
-        bpy.ops.object.transform_apply(location=True, rotation=True, scale=True)
-        if mtree_props.obstacle_flip_normals:
-            bpy.ops.object.mode_set(mode='EDIT')
-            bpy.ops.mesh.flip_normals()
-            bpy.ops.object.mode_set(mode='OBJECT')
-        obs.select = False
-        return obs
-    return None
+    source = bpy.data.objects.get(mtree_props.obstacle)
+    if source is None or source.type != 'MESH':
+        return None
+    mesh = source.data.copy()
+    mesh.transform(source.matrix_world)
+    if mtree_props.obstacle_flip_normals:
+        bm = bmesh.new()
+        bm.from_mesh(mesh)
+        bmesh.ops.reverse_faces(bm, faces=bm.faces)
+        bm.to_mesh(mesh)
+        bm.free()
+    obs = bpy.data.objects.new(source.name + "_obstacle", mesh)
+    scene.objects.link(obs)
+    # ray casts need the evaluated mesh of the copy
+    scene.update()
+    return obs
+
+
+class PropertySnapshot:
+    """A copy of the values of a property group, that can be read outside of the main thread.
+
+    Args:
+        property_group - (bpy.types.PropertyGroup) The properties to copy, pointer and collection properties are
+            left out
+    """
+    def __init__(self, property_group):
+        for prop in property_group.bl_rna.properties:
+            name = prop.identifier
+            if name == "rna_type" or prop.type in {'POINTER', 'COLLECTION'}:
+                continue
+            value = getattr(property_group, name)
+            if getattr(prop, "is_array", False):
+                value = tuple(value)
+            setattr(self, name, value)
 
 
 class Tree:
@@ -1406,6 +1648,8 @@ class Tree:
     def __init__(self, position=Vector((0, 0, 0))):
         scene = bpy.context.scene
         mtree_props = scene.mtree_props
+        # the settings read by the growth, a PropertySnapshot when the tree grows outside of the main thread
+        self.props = mtree_props
         self.verts = []
         self.edges = []
         self.faces = []
@@ -1416,12 +1660,12 @@ class Tree:
         self.leafs = []
         self.paint_indexes = []
         self.leafs_weight_indexes = []
+        self.vertex_bones = []
         self.bones = []
         self.uv_list = []
         self.curr_grease_point = 0
         self.obs = configure_obstacle()
         self.vcol_rad = []
-        self.entree = [0, 1, 2, 3, 4, 5, 6, 7]
         self.roots_to_create = False
         self.using_grease = False
         self.grease_strokes = []
@@ -1430,10 +1674,17 @@ class Tree:
         self.radius_curve_props = []
         self.height_curve_props = []
         self.last_iteration = 0
+        self.skeleton = TreeSkeleton()
+        self.growth_log = GrowthLog()
+        self.grown_bones = []
+        self.profiler = Profiler("tree")
+        # the growth budgets are measured from here, truncation says which one stopped the growth if any
+        self.start_time = perf_counter()
+        self.truncation = None
 
         if mtree_props.pruning:
             print("pruning")
-            self.pruning_tree = SearchTree(resolution(self.position), mtree_props.radius)
+            self.pruning_tree = SearchTree(resolution(self.position, mtree_props.pruning_resolution), mtree_props.radius)
 
         gp = bpy.context.scene.grease_pencil
         if mtree_props.use_grease_pencil and gp is not None and gp.layers.active is not None and gp.layers.active.active_frame is not None and len(
@@ -1446,30 +1697,32 @@ class Tree:
             self.position = self.grease_strokes[0][0] - Vector((0, 0, .5))
 
     def add_branch_layer(self, iteration, branch_type="Branch", is_twig=False):
-        scene = bpy.context.scene
-        mtree_props = scene.mtree_props
+        mtree_props = self.props
         node_tree = None
-        try:
-            node_tree = bpy.data.node_groups[mtree_props.node_tree]
-        except:
-            node_tree = None
+        if self.radius_curve_props or self.height_curve_props:
+            node_tree = bpy.data.node_groups.get(mtree_props.node_tree)
         next_extremities = []
+        skeleton = self.skeleton
+        self.enforce_budgets(iteration, branch_type)
 
         for E in self.extremities:
-            indexes, radius, direction, lb, is_trunk, curr_rotation, curr_height, stroke_index = E
+            node, radius, direction, lb, is_trunk, curr_rotation, curr_height, stroke_index = E
 
-            real_radius = (self.verts[indexes[0]] - self.verts[indexes[4]]).length
+            real_radius = skeleton.radii[node] * 2
             uv_scale = 3 * branch.uv_height / real_radius
 
             if iteration > mtree_props.preserve_end and branch_type == "Branch" and is_trunk:
                 is_trunk = False
                 next_extremities += self.late_extremities
 
-            pos = Vector((0, 0, 0))
+            if branch_type == "Roots":
+                node_type = ROOTS
+            elif is_trunk or iteration <= mtree_props.trunk_length:
+                node_type = TRUNK
+            else:
+                node_type = BRANCH
 
-            for k in indexes:
-                pos += self.verts[k]
-            pos /= len(indexes)
+            pos = Vector(skeleton.positions[node])
             direction.normalize()
 
             # updating properties...................................................
@@ -1545,7 +1798,8 @@ class Tree:
                     direction.normalize()
                     stroke.pop(0)
 
-            if real_radius < mtree_props.radius / 4 and branch_type == "Branch" and mtree_props.create_particle_emitter:
+            if real_radius < mtree_props.radius / 4 and branch_type == "Branch" \
+                    and (mtree_props.create_particle_emitter or mtree_props.leaf_instancing == 'FACES'):
                 self.leafs.append((pos, direction))
             # .......................................................................................................
 
@@ -1553,7 +1807,7 @@ class Tree:
                 self.twig_leafs.append((pos + direction * mtree_props.branch_length, direction))
 
             if mtree_props.pruning:
-                self.pruning_tree.add(resolution(pos), (2 + real_radius) / 3)
+                self.pruning_tree.add(resolution(pos, mtree_props.pruning_resolution), (2 + real_radius) / 3)
 
             split_probability = mtree_props.trunk_split_proba if is_trunk else mtree_props.split_proba
             if branch_type == "Roots":
@@ -1562,55 +1816,51 @@ class Tree:
             if mtree_props.pruning and iteration > mtree_props.trunk_length and not is_trunk and branch_type == "Branch":
                 split_probability /= max(1,
                                          mtree_props.pruning_intensity / mtree_props.pruning_resolution * self.pruning_tree.get_value(
-                                             resolution(pos)))
+                                             resolution(pos, mtree_props.pruning_resolution)))
                 break_chance += mtree_props.pruning_intensity / mtree_props.pruning_resolution * self.pruning_tree.get_value(
-                    resolution(pos)) / 100
+                    resolution(pos, mtree_props.pruning_resolution)) / 100
 
             if is_trunk and mtree_props.dont_break_trunk and self.obs is None:
                 break_chance = 0
             # Trunk................................................................................
 
             if iteration <= mtree_props.trunk_length and branch_type == "Branch":
-                branch_verts = [v for v in branch.verts]
-                self.vcol_rad += [real_radius] * 8
                 length = mtree_props.trunk_space if stroke_index == -1 else pencil_branch_length
-                ni, direction = join_branch(self.verts, self.faces, indexes, radius, length, branch_verts,
-                                            direction,
-                                            mtree_props.trunk_variation, self.uv_list, curr_height, real_radius)
+                direction = perturb_direction(direction, mtree_props.trunk_variation)
+                new_node = self.add_module(branch, node, pos, radius, length, direction, iteration, node_type,
+                                           curr_height, real_radius)
                 sortie = pos + direction * length
                 new_height = length
 
                 if iteration <= mtree_props.bones_iterations:
                     self.bones.append((lb[0], len(self.bones) + 2, lb[1], sortie))
+                    skeleton.bones[new_node] = str(len(self.bones) + 1)
+                else:
+                    skeleton.bones[new_node] = skeleton.bones[node]
 
                 nb = (len(self.bones) + 1, sortie)
                 new_height *= uv_scale
                 rot = (random() * 2 - 1) * mtree_props.branch_random_rotate
+                self.growth_log.add(node, iteration, GROW, -1, split_probability, break_chance, curr_rotation + rot)
 
                 next_extremities.append(
-                    (ni, radius * mtree_props.trunk_radius_dec, direction, nb, is_trunk, curr_rotation+rot, curr_height + new_height, stroke_index))
+                    (new_node, radius * mtree_props.trunk_radius_dec, direction, nb, is_trunk, curr_rotation+rot, curr_height + new_height, stroke_index))
             # cut................................................................................
             elif (iteration == mtree_props.iteration + mtree_props.trunk_length - 1 and branch_type == "Branch") \
                     or random() < break_chance * exp(-real_radius) \
                     or real_radius < mtree_props.branch_min_radius \
                     or (iteration == mtree_props.roots_iteration - 1 and branch_type == "Roots"):
 
-                end_verts = [Vector(v) for v in end_cap.verts]
-                end_faces = [f for f in end_cap.faces]
                 length = pencil_branch_length if stroke_index > -1 else mtree_props.trunk_space if is_trunk else mtree_props.branch_length
                 if branch_type == "Roots":
                     length = mtree_props.roots_length * sqrt(real_radius)
 
-                n = len(self.verts)
-
-                join_branch(self.verts, self.faces, indexes, radius, length, end_verts, direction,
-                            mtree_props.trunk_variation, self.uv_list, 0, real_radius)
-
-                self.faces += [add_tuple(f, n) for f in end_faces]
-                self.uv_list += [u for u in end_cap.uv]
-                self.vcol_rad += [real_radius] * len(end_verts)
-                if real_radius < mtree_props.radius / 4 and branch_type == "Branch" and not mtree_props.create_particle_emitter:
-                    self.leafs_weight_indexes.append(len(self.verts) - 1)
+                direction = perturb_direction(direction, mtree_props.trunk_variation)
+                leaf_weight = real_radius < mtree_props.radius / 4 and branch_type == "Branch" and not mtree_props.create_particle_emitter
+                end_node = self.add_module(end_cap, node, pos, radius, length, direction, iteration, node_type, 0,
+                                           real_radius, leaf_weight)
+                skeleton.bones[end_node] = skeleton.bones[node]
+                self.growth_log.add(node, iteration, CUT, -1, split_probability, break_chance, curr_rotation)
             # split.........................................................................................
             elif iteration < mtree_props.iteration + mtree_props.trunk_length - 1 \
                     and iteration == mtree_props.trunk_length + 1 \
@@ -1626,24 +1876,18 @@ class Tree:
                 rand_j = randint(1, len(Joncts)-1)
                 rand_t = randint(0, len(Trunks)-1)
                 big_j = Joncts[rand_j] if (not is_trunk) else Trunks[rand_t]
-                i1 = [iteration for iteration in big_j.sortie[0]]
-                i2 = [iteration for iteration in big_j.sortie[1]]
-                jonct_uv = [u for u in big_j.uv]
 
                 inter_fact = mtree_props.trunk_split_angle if is_trunk else mtree_props.split_angle
-                jonct_verts = interpolate(big_j.verts1, big_j.verts2, inter_fact)
                 length = pencil_branch_length if stroke_index > -1 else mtree_props.trunk_space if is_trunk else mtree_props.branch_length
 
                 if branch_type == "Roots":
                     length = mtree_props.roots_length * sqrt(real_radius)
                     variation = .25
-                ni1, ni2, dir1, dir2, r1, r2, to_be_painted = join(self.verts, self.faces, indexes, jonct_verts, big_j.faces,
-                                                                   radius * (1 + mtree_props.radius_dec) / 2, i1, i2,
-                                                                   self.entree,
-                                                                   direction, length, self.uv_list, jonct_uv,
-                                                                   variation, curr_rotation, curr_height, real_radius)
-                sortie1 = (self.verts[ni1[0]] + self.verts[ni1[4]]) / 2
-                sortie2 = (self.verts[ni2[0]] + self.verts[ni2[4]]) / 2
+                direction = perturb_direction(direction, variation)
+                direction.normalize()
+                node1, node2, sortie1, sortie2, dir1, dir2, r1, r2 = self.add_split(
+                    big_j, node, pos, radius * (1 + mtree_props.radius_dec) / 2, length, direction,
+                    radians(curr_rotation), inter_fact, iteration, node_type, curr_height, real_radius)
 
                 if stroke_index > -1:
                     dist = (sortie1 - pos).length
@@ -1652,12 +1896,14 @@ class Tree:
                         if not(not self.grease_strokes[stroke_index]):
                             self.grease_strokes[stroke_index].pop(0)
 
-                self.paint_indexes += to_be_painted
                 nb = len(self.bones)
-                self.vcol_rad += [real_radius] * len(jonct_verts)
                 if iteration <= mtree_props.bones_iterations and branch_type == "Branch":
                     self.bones.append((lb[0], nb + 2, lb[1], sortie1))
                     self.bones.append((lb[0], nb + 3, lb[1], sortie2))
+                    skeleton.bones[node1] = str(nb + 2)
+                    skeleton.bones[node2] = str(nb + 3)
+                else:
+                    skeleton.bones[node1] = skeleton.bones[node2] = skeleton.bones[node]
 
                 nb1 = (nb + 2, sortie1)
                 nb2 = (nb + 3, sortie2)
@@ -1669,30 +1915,33 @@ class Tree:
 
                 rad_fact = (1 - (1-mtree_props.trunk_radius_dec)*(1+mtree_props.trunk_split_proba)) if is_trunk else mtree_props.radius_dec
                 rot = mtree_props.branch_rotate + (random()*2-1) * mtree_props.branch_random_rotate
+                self.growth_log.add(node, iteration, FORK, rand_t if is_trunk else rand_j, split_probability,
+                                    break_chance, curr_rotation)
                 next_extremities.append(
-                    (ni1, radius * rad_fact * r1, dir1, nb1, is_trunk, curr_rotation + rot, new_height, stroke_index))
+                    (node1, radius * rad_fact * r1, dir1, nb1, is_trunk, curr_rotation + rot, new_height, stroke_index))
                 if not(is_trunk and mtree_props.finish_trunk):
                     next_extremities.append(
-                        (ni2, radius * rad_fact * r2, dir2, nb2, False, curr_rotation + rot, new_height, -1))
+                        (node2, radius * rad_fact * r2, dir2, nb2, False, curr_rotation + rot, new_height, -1))
                 else:
                     self.late_extremities.append(
-                        (ni2, radius * rad_fact * r2, dir2, nb2, False, curr_rotation + rot, new_height, -1))
+                        (node2, radius * rad_fact * r2, dir2, nb2, False, curr_rotation + rot, new_height, -1))
             # growth..........................................................................................
             else:
-                branch_verts = [v for v in branch.verts]
-
                 variation = mtree_props.trunk_variation if is_trunk else mtree_props.randomangle
                 length = pencil_branch_length if stroke_index > -1 else mtree_props.trunk_space if is_trunk else mtree_props.branch_length
                 if branch_type == "Roots":
                     length = mtree_props.roots_length * sqrt(real_radius)
-                ni, direction = join_branch(self.verts, self.faces, indexes, radius, length, branch_verts, direction,
-                                            variation, self.uv_list, curr_height, real_radius)
+                direction = perturb_direction(direction, variation)
+                new_node = self.add_module(branch, node, pos, radius, length, direction, iteration, node_type,
+                                           curr_height, real_radius)
 
                 sortie = pos + direction * mtree_props.branch_length
-                self.vcol_rad += [real_radius] * 8
 
                 if iteration <= mtree_props.bones_iterations and branch_type == "Branch":
                     self.bones.append((lb[0], len(self.bones) + 2, lb[1], sortie))
+                    skeleton.bones[new_node] = str(len(self.bones) + 1)
+                else:
+                    skeleton.bones[new_node] = skeleton.bones[node]
 
                 nb = (len(self.bones) + 1, sortie)
                 # if mtree_props.gravity_start <= iteration <= mtree_props.gravity_end and branch_type == "Branch":
@@ -1700,12 +1949,169 @@ class Tree:
                 new_height = length * uv_scale
                 rad_fact = mtree_props.trunk_radius_dec if is_trunk else mtree_props.radius_dec
                 rot = (random()*2-1) * mtree_props.branch_random_rotate
+                self.growth_log.add(node, iteration, GROW, -1, split_probability, break_chance, curr_rotation + rot)
                 next_extremities.append(
-                    (ni, radius * rad_fact, direction, nb, is_trunk, curr_rotation + rot,
+                    (new_node, radius * rad_fact, direction, nb, is_trunk, curr_rotation + rot,
                      curr_height + new_height, stroke_index))
         # return next_extremities
         self.extremities = next_extremities
 
+    def enforce_budgets(self, iteration, branch_type):
+        """Caps extremities with end caps when the growth is about to go over a budget of the settings.
+
+        The thickest extremities are the last ones capped, so the tree loses its twigs before its main branches.
+        The extremities left in self.extremities can grow one more layer within the budgets.
+
+        Args:
+            iteration - (int) The current iteration
+            branch_type - (string) "Branch" or "Roots"
+        """
+        mtree_props = self.props
+        extremities = self.extremities
+        if not extremities:
+            return
+
+        keep = len(extremities)
+        reason = None
+        if mtree_props.max_growth_time > 0 and perf_counter() - self.start_time > mtree_props.max_growth_time:
+            keep = 0
+            reason = "the growth took more than {:.0f}s".format(mtree_props.max_growth_time)
+        if 0 < mtree_props.max_extremities < keep:
+            keep = mtree_props.max_extremities
+            reason = "a layer had more than {} branch ends".format(mtree_props.max_extremities)
+        radii = self.skeleton.radii
+        ranked = sorted(range(len(extremities)), key=lambda i: -radii[extremities[i][0]])
+        if mtree_props.max_vertices > 0:
+            # enough vertices are kept aside to cap every extremity, then the thickest extremities grow with what is
+            # left, each one keeping aside the cap of its second exit, which is no thicker than itself
+            caps = [len(adaptive_module(mtree_props, end_cap, radii[e[0]] * 2).verts) for e in extremities]
+            spare = mtree_props.max_vertices - self.skeleton.vertex_count - sum(caps) - sum(
+                len(adaptive_module(mtree_props, end_cap, radii[e[0]] * 2).verts) for e in self.late_extremities)
+            growing = 0
+            for i in ranked[:keep]:
+                spare -= SPLIT_VERTS + caps[i]
+                if spare < 0:
+                    break
+                growing += 1
+            if growing < keep:
+                keep = growing
+                reason = "the mesh would get over {} vertices".format(mtree_props.max_vertices)
+        if keep >= len(extremities):
+            return
+
+        kept = set(ranked[:keep])
+        self.cap_extremities([e for i, e in enumerate(extremities) if i not in kept], iteration, branch_type)
+        self.extremities = [e for i, e in enumerate(extremities) if i in kept]
+        # the late extremities are released by the trunk, they would stay open without it
+        if self.late_extremities and not any(e[4] for e in self.extremities):
+            self.cap_extremities(self.late_extremities, iteration, branch_type)
+            self.late_extremities = []
+        if self.truncation is None:
+            self.truncation = "{} at iteration {}".format(reason, iteration)
+            print("Growth truncated: " + self.truncation)
+
+    def cap_extremities(self, extremities, iteration, branch_type):
+        """Ends each extremity with an end cap, like a cut branch but without drawing any random number.
+
+        Args:
+            extremities - (list of tuple) The extremities to cap, see self.extremities
+            iteration - (int) The current iteration
+            branch_type - (string) "Branch" or "Roots"
+        """
+        mtree_props = self.props
+        skeleton = self.skeleton
+        for node, radius, direction, lb, is_trunk, curr_rotation, curr_height, stroke_index in extremities:
+            real_radius = skeleton.radii[node] * 2
+            if branch_type == "Roots":
+                node_type = ROOTS
+                length = mtree_props.roots_length * sqrt(real_radius)
+            else:
+                node_type = TRUNK if is_trunk or iteration <= mtree_props.trunk_length else BRANCH
+                length = mtree_props.trunk_space if is_trunk else mtree_props.branch_length
+            leaf_weight = real_radius < mtree_props.radius / 4 and branch_type == "Branch" and not mtree_props.create_particle_emitter
+            end_node = self.add_module(end_cap, node, Vector(skeleton.positions[node]), radius, length,
+                                       direction.normalized(), iteration, node_type, 0, real_radius, leaf_weight)
+            skeleton.bones[end_node] = skeleton.bones[node]
+            self.growth_log.add(node, iteration, CUT, -1, 0, 1, curr_rotation)
+
+    def add_module(self, module, node, pos, scale, length, direction, iteration, node_type, height, real_radius,
+                   leaf_weight=False):
+        """Places a Module (branch ring or end cap) at the end of a node.
+
+        Args:
+            module - (Module) The module to place
+            node - (int) The skeleton node the module grows from
+            pos - (Vector) The center of the ring of node
+            scale - (float) The scale of the module
+            length - (float) The distance between pos and the module base
+            direction - (Vector) The direction the module is pointing at
+            iteration - (int) The current iteration
+            node_type - (int) BRANCH, TRUNK or ROOTS
+            height - (float) The uv height at the base of the module
+            real_radius - (float) The diameter of the ring of node
+            leaf_weight - (bool) The tip of the module belongs to the leaf vertex group
+
+        Returns:
+            (int) The node of the entry ring of the module
+        """
+        origin = pos + direction * length
+        vertex_count = len(adaptive_module(self.props, module, real_radius).verts)
+        piece = self.skeleton.add_piece(MODULE, module, vertex_count, parent=node, origin=origin, direction=direction,
+                                        scale=scale, height=height, uv_scale=3 * length / real_radius,
+                                        real_radius=real_radius, leaf_weight=leaf_weight)
+        ring = [Vector(module.verts[i]) for i in module.entree]
+        center, side = rot_scale([sum(ring, Vector((0, 0, 0))) / len(ring), ring[0] - ring[4]], scale, direction, 0)
+        return self.skeleton.add_node(origin + center, direction, side.length / 2, node, iteration, node_type, piece)
+
+    def add_split(self, split, node, pos, scale, length, direction, rotation, inter_fact, iteration, node_type,
+                  height, real_radius):
+        """Places a Split at the end of a node.
+
+        Args:
+            split - (Split) The split to place
+            node - (int) The skeleton node the split grows from
+            pos - (Vector) The center of the ring of node
+            scale - (float) The scale of the split
+            length - (float) The distance between pos and the split base
+            direction - (Vector) The direction the split is pointing at
+            rotation - (float) The rotation of the split around direction, in radians
+            inter_fact - (float) The interpolation factor between the two forms of the split
+            iteration - (int) The current iteration
+            node_type - (int) BRANCH, TRUNK or ROOTS, the second exit of a trunk split is a BRANCH
+            height - (float) The uv height at the base of the split
+            real_radius - (float) The diameter of the ring of node
+
+        Returns:
+            node1, node2 - (int) The nodes of the two exits
+            sortie1, sortie2 - (Vector) The middle of the first and fifth vertices of each exit
+            d1, d2 - (Vector) The directions of the exits
+            r1, r2 - (float) The radii of the exits, relatively to scale
+        """
+        origin = pos + direction * length
+        piece = self.skeleton.add_piece(SPLIT, split, parent=node, origin=origin, direction=direction, scale=scale,
+                                        rotation=rotation, inter_fact=inter_fact, height=height,
+                                        uv_scale=3 * length / real_radius, real_radius=real_radius)
+
+        # only the vertices needed by the growth are interpolated, the rest is left to the meshing stage
+        def vert(i):
+            return Vector(split.verts1[i]) * (1 - inter_fact) + Vector(split.verts2[i]) * inter_fact
+
+        to_transform = []
+        radii = []
+        for sortie in split.sortie:
+            ring = [vert(i) for i in sortie]
+            to_transform += [sum(ring, Vector((0, 0, 0))) / len(ring), (ring[0] + ring[4]) / 2]
+            radii.append((ring[0] - ring[4]).length / 2)
+        n = len(split.verts1)
+        to_transform += [vert(n - 2), vert(n - 1)]
+        center1, sortie1, center2, sortie2, d1, d2 = rot_scale(to_transform, scale, direction, rotation)
+        r1, r2 = radii
+
+        node1 = self.skeleton.add_node(origin + center1, d1, r1 * scale, node, iteration, node_type, piece, 0)
+        node2 = self.skeleton.add_node(origin + center2, d2, r2 * scale, node, iteration,
+                                       BRANCH if node_type == TRUNK else node_type, piece, 1)
+        return node1, node2, origin + sortie1, origin + sortie2, d1, d2, r1, r2
+
 
 # dictionary to link the inputs of the nodes to their corresponding property. {node_name : {input_name : property_name}
 names_table = {'Roots': {'Length': 'roots_length', 'split_proba': 'roots_split_proba', 'ground_height': 'roots_groung_height'},
@@ -1775,6 +2181,8 @@ def update_static_properties(node_tree, static_props):
             # seed(node.seed)
             mtree_props.mat = node.create_material
             mtree_props.bark_material = node.material
+            mtree_props.lod_levels = node.lod_levels
+            mtree_props.lod_min_radius = node.lod_min_radius
 
         if node.bl_label == 'Twig':
             mtree_props.leaf_size = node.leaf_size
@@ -1809,6 +2217,9 @@ def update_static_properties(node_tree, static_props):
             mtree_props.display = node.viewport_number
             mtree_props.twig_particle = node.leaf_object
             mtree_props.particle_size = node.leaf_size
+            mtree_props.leaf_instancing = node.instancing
+            mtree_props.leaf_clump_size = node.clump_size
+            mtree_props.leaf_clump_variants = node.clump_variants
 
         if node.bl_label == 'Pruning':
             mtree_props.pruning = True
@@ -1817,6 +2228,10 @@ def update_static_properties(node_tree, static_props):
         if node.bl_label == 'Armature':
             mtree_props.create_armature = True
             mtree_props.bones_iterations = node.max_bones_iteration
+            mtree_props.bones_target = node.target_bones
+            mtree_props.bones_merge_angle = node.merge_angle
+            mtree_props.bones_min_length = node.min_length
+            mtree_props.bones_min_radius = node.min_radius
 
     for name in static_props:
         node_name, input_name = name
@@ -1899,7 +2314,10 @@ def update_twig_properties():
 
 def invalid_node_tree(operator, node_tree, message=""):
     message = "The Node tree is incorect ! " + message
-    operator.report({'ERROR'}, message)
+    if operator is not None:
+        operator.report({'ERROR'}, message)
+    else:
+        print(message)
     node_tree.done = True
 
 
@@ -1919,11 +2337,50 @@ def eval_tree_validity(operator, node_tree):
         invalid_node_tree(operator,node_tree, message)
 
 
-def alt_create_tree(operator, position=Vector((0,0,0))):
+def get_growth(obj):
+    """Returns the grown Tree obj was meshed from, None if it isn't in the growth cache anymore."""
+    growth_id = obj.get("growth_id") if obj is not None else None
+    tree = grown_trees.get(growth_id)
+    if tree is not None:
+        grown_trees.move_to_end(growth_id)
+    return tree
+
+
+def cache_growth(tree, obj):
+    """Keeps the grown tree of obj so that it can be meshed again, only the last GROWTH_CACHE_SIZE are kept."""
+    global last_growth_id
+    last_growth_id += 1
+    growth_id = "{}-{}".format(GROWTH_SESSION, last_growth_id)
+    grown_trees[growth_id] = tree
+    obj["growth_id"] = growth_id
+    while len(grown_trees) > GROWTH_CACHE_SIZE:
+        grown_trees.popitem(last=False)
+
+
+def generate_tree(operator, position=Vector((0, 0, 0)), profiler=None, growth=None):
+    """Creates a tree with the current settings, one step at a time: the tree grows one layer per step, then
+    each meshing stage is one step.
+
+    The profiler stages only measure the work done inside a step, not the time spent between two steps. The
+    growth draws from the global random generator, so the same seed only gives the same tree if nothing else
+    draws from it between two steps.
+
+    Args:
+        operator - (Operator) The operator to report to
+        position - (Vector) The location of the tree
+        profiler - (Profiler) Receives the time of each stage, a new one is used if None
+        growth - (Tree) A tree grown earlier, see alt_create_tree
+
+    Yields:
+        (GenerationStep) The stage that was just done, how many steps are done out of the total, the nodes
+        added to tree.skeleton by the step, and the tree object once it exists. Nothing more is yielded if
+        the node tree is invalid, and the last step is "done" otherwise
+    """
     scene = bpy.context.scene
     mtree_props = scene.mtree_props
 
-    clock = Clock("create_tree")
+    if profiler is None:
+        profiler = Profiler("create_tree")
 
     if mtree_props.use_node_workflow:
         node_tree = bpy.data.node_groups[mtree_props.node_tree]
@@ -1938,55 +2395,321 @@ def alt_create_tree(operator, position=Vector((0,0,0))):
         except IndexError:
             pass
         if node_tree.done:
-            return None
+            return
     else:
         node_tree = None
 
-    tree = Tree(position)
+    tree = Tree(position) if growth is None else growth
+    tree.profiler = profiler
 
     if mtree_props.use_node_workflow:
         tree.static_props, tree.iteration_curve_props, tree.radius_curve_props, tree.height_curve_props = eval_inputs(node_tree)
         update_static_properties(node_tree, tree.static_props)
 
     is_twig = False
-
-    roots(node_tree, tree)
-    trunk(node_tree, tree, is_twig)
-    branches(node_tree, tree, is_twig)
-    if tree.roots_to_create:
-        late_roots(node_tree, tree)
-
-    mesh, obj = tree_object_creation(tree)
+    # the number of layers can't be known before the roots are grown, as they can enable the late roots
+    total = len(MESHING_STAGES)
+    done = 0
+    obj = None
+
+    def step(stage, first_node=None):
+        nonlocal done
+        done += 1
+        new_nodes = range(first_node, len(tree.skeleton)) if first_node is not None else range(0)
+        return GenerationStep(stage, done, total, tree, new_nodes, obj)
+
+    # the working copy of the obstacle is only needed by the growth, it has to go even if the growth fails or if
+    # the generator is closed before the tree is done, as when a tree made step by step is cancelled
+    try:
+        if growth is None:
+            with profiler.stage("roots"):
+                roots(node_tree, tree)
+            total += mtree_props.trunk_length + mtree_props.iteration + 1
+            if tree.roots_to_create:
+                total += mtree_props.roots_iteration
+            yield step("roots", 0)
+
+            layers = [("trunk", trunk_layers(node_tree, tree, is_twig)),
+                      ("branches", branches_layers(node_tree, tree, is_twig))]
+            if tree.roots_to_create:
+                layers.append(("late roots", late_roots_layers(node_tree, tree)))
+            for stage, generator in layers:
+                while True:
+                    first_node = len(tree.skeleton)
+                    with profiler.stage(stage):
+                        iteration = next(generator, None)
+                    if iteration is None:
+                        break
+                    yield step(stage, first_node)
+            tree.grown_bones = list(tree.bones)
+            tree.growth_log.display()
+        else:
+            print("Meshing a tree grown earlier, {} nodes".format(len(tree.skeleton)))
+            if not tree.using_grease:
+                # a tree following a grease pencil stroke starts where the stroke starts
+                tree.position = position.copy()
+            tree.bones = list(tree.grown_bones)
+    finally:
+        remove_obstacle(tree)
+    if tree.truncation is not None and operator is not None:
+        operator.report({'WARNING'}, "The tree was cut short, {}. See the budgets in the advanced settings".format(
+            tree.truncation))
+
+    with profiler.stage("mesh build"):
+        tree_geometry_creation(tree)
+        mesh, obj = tree_object_creation(tree)
     obj["is_tree"] = True
-    vgroups = tree_vertex_groups_creation(tree, mesh, obj)
-    tree_vertex_paint_creation(tree, mesh)
-    if not mtree_props.create_particle_emitter:
-        tree_particle_creations(operator, vgroups, obj, node_tree)
-    elif mtree_props.particle and not(not tree.leafs):
-        create_leafs_emitter(tree.position, tree.leafs, obj)
-        obj["has_emitter"] = True
-    tree_uv_creation(tree, mesh)
-    tree_material_creation(obj)
-    tree_armature_creation(tree, obj)
+    if tree.truncation is not None:
+        obj["truncation"] = tree.truncation
+    cache_growth(tree, obj)
+    yield step("mesh build")
+    with profiler.stage("skin weights"):
+        tree_bones_simplification(tree)
+        tree_bone_groups_creation(tree, obj)
+    yield step("skin weights")
+    with profiler.stage("vertex groups"):
+        vgroups = tree_vertex_groups_creation(tree, mesh, obj)
+    yield step("vertex groups")
+    with profiler.stage("vertex paint"):
+        tree_vertex_paint_creation(tree, mesh)
+    yield step("vertex paint")
+    with profiler.stage("particles"):
+        if mtree_props.particle and mtree_props.leaf_instancing == 'FACES':
+            if tree.leafs:
+                instancers, leaf_count, instance_count = create_leafs_instancer(tree.position, tree.leafs, obj)
+                if instancers:
+                    obj["has_emitter"] = True
+                if mtree_props.leaf_clump_size > 0 and leaf_count > 0 and operator is not None:
+                    operator.report({'INFO'}, "Leaf clumps: {} leaves drawn with {} instances ({:.0f}% fewer)".format(
+                        leaf_count, instance_count, 100 * (1 - instance_count / leaf_count)))
+        elif not mtree_props.create_particle_emitter:
+            tree_particle_creations(operator, vgroups, obj, node_tree)
+        elif mtree_props.particle and not(not tree.leafs):
+            create_leafs_emitter(tree.position, tree.leafs, obj)
+            obj["has_emitter"] = True
+    yield step("particles")
+    with profiler.stage("uv"):
+        tree_uv_creation(tree, mesh)
+    yield step("uv")
+    with profiler.stage("material"):
+        tree_material_creation(obj)
+    yield step("material")
+    with profiler.stage("lod"):
+        tree_lod_creation(tree, obj)
+    yield step("lod")
+    with profiler.stage("armature"):
+        tree_armature_creation(tree, obj)
     if node_tree and node_tree.done:
-        return None
+        return
 
     obj.select = True
     bpy.context.scene.objects.active = obj
     obj["has_armature"] = True if mtree_props.create_armature else False
 
-    clock.stop("create_tree")
+    # the cached growth only needs the skeleton, the mesh lists are made again when meshing it again
+    tree.verts, tree.faces, tree.uv_list, tree.vcol_rad, tree.vertex_bones = [], [], [], [], []
+
+    profiler.stop()
     print("\nDeveloper Info:")
+    profiler.display()
+    timings = profiler.timings()
+    if "{}/branches".format(profiler.main_job) in timings:
+        # the top level stages leave out the time spent between the steps of a generation made step by step
+        seconds = sum(duration for key, duration in timings.items() if key.count("/") == 1)
+        if seconds > 0:
+            generation_rate[0] = len(mesh.vertices) / seconds
+
+    yield step("done")
+
+
+def alt_create_tree(operator, position=Vector((0,0,0)), profiler=None, growth=None):
+    """Creates a tree with the current settings.
+
+    Args:
+        operator - (Operator) The operator to report to
+        position - (Vector) The location of the tree
+        profiler - (Profiler) Receives the time of each stage, a new one is used if None
+        growth - (Tree) A tree grown earlier, see get_growth. Its skeleton is meshed again with the current
+            settings without growing anything, so forces, obstacles, curves and pruning are not evaluated again
+
+    Returns:
+        (bpy.types.Object) The tree object, None if the node tree is invalid
+    """
+    last_step = None
+    for last_step in generate_tree(operator, position, profiler, growth):
+        pass
+    if last_step is None or last_step.stage != "done":
+        return None
+    return last_step.obj
+
+
+def create_tree_preview(operator, position=Vector((0, 0, 0))):
+    """Grows the tree skeleton only and shows it as an edge mesh, without any of the meshing, normals, uvs,
+    vertex groups, particles or armature of a full build.
+
+    Args:
+        operator - (Operator) The operator to report errors to, None when called from the live preview
+        position - (Vector) Where to put the preview if there is none yet, the current preview stays where it is
+
+    Returns:
+        (bpy.types.Object) The preview object, None if the node tree is invalid
+    """
+    scene = bpy.context.scene
+    mtree_props = scene.mtree_props
+
+    clock = Clock("create_preview")
+
+    node_tree = None
+    if mtree_props.use_node_workflow:
+        node_tree = bpy.data.node_groups.get(mtree_props.node_tree)
+        if node_tree is None:
+            return None
+        node_tree.done = False
+        eval_tree_validity(operator, node_tree)
+        if node_tree.done:
+            return None
+
+    preview = bpy.data.objects.get(PREVIEW_NAME)
+    if preview is not None:
+        position = preview.location.copy()
+
+    tree = Tree(position)
+
+    if node_tree:
+        tree.static_props, tree.iteration_curve_props, tree.radius_curve_props, tree.height_curve_props = eval_inputs(node_tree)
+        update_static_properties(node_tree, tree.static_props)
+    seed(mtree_props.SeedProp)
+
+    roots(node_tree, tree)
+    trunk(node_tree, tree)
+    branches(node_tree, tree)
+    if tree.roots_to_create:
+        late_roots(node_tree, tree)
+    remove_obstacle(tree)
+    if tree.truncation is not None and operator is not None:
+        operator.report({'WARNING'}, "The tree was cut short, {}".format(tree.truncation))
+
+    obj = tree_preview_object_creation(tree)
+
+    clock.stop("create_preview")
     clock.display()
 
     return obj
 
 
-def create_twig(position=Vector((0, 0, 0))):
+def tree_preview_object_creation(tree):
+    """Shows the skeleton of a tree as an edge mesh, one vertex per node.
+
+    The radius of each node is stored in the "radius" vertex group, relatively to the trunk radius like the
+    radius vertex colors of a full build. The mesh of an existing preview object is replaced.
+    """
+    scene = bpy.context.scene
+    mtree_props = scene.mtree_props
+    skeleton = tree.skeleton
+
+    mesh = bpy.data.meshes.new(PREVIEW_NAME)
+    mesh.vertices.add(len(skeleton))
+    mesh.vertices.foreach_set("co", [c for position in skeleton.positions for c in position])
+    edges = [(parent, i) for i, parent in enumerate(skeleton.parents) if parent >= 0]
+    mesh.edges.add(len(edges))
+    mesh.edges.foreach_set("vertices", [i for edge in edges for i in edge])
+    mesh.update()
+
+    obj = bpy.data.objects.get(PREVIEW_NAME)
+    if obj is None or obj.type != 'MESH':
+        obj = bpy.data.objects.new(PREVIEW_NAME, mesh)
+        obj["is_tree_preview"] = True
+        obj.location = tree.position
+    else:
+        old_mesh = obj.data
+        obj.data = mesh
+        if old_mesh.users == 0:
+            bpy.data.meshes.remove(old_mesh)
+        obj.vertex_groups.clear()
+    if obj.name not in scene.objects:
+        scene.objects.link(obj)
+
+    group = obj.vertex_groups.new("radius")
+    for i, radius in enumerate(skeleton.radii):
+        group.add([i], radius / mtree_props.radius, 'REPLACE')
+
+    return obj
+
+
+def remove_tree_preview():
+    """Deletes the preview object and its mesh, if any"""
+    obj = bpy.data.objects.get(PREVIEW_NAME)
+    if obj is None:
+        return
+    mesh = obj.data
+    bpy.data.objects.remove(obj, do_unlink=True)
+    if mesh is not None and mesh.users == 0:
+        bpy.data.meshes.remove(mesh)
+
+
+def to_hashable(value):
+    """Converts an ID property or a bpy array to something that can be compared and hashed"""
+    if hasattr(value, "to_dict"):
+        return repr(sorted(value.to_dict().items()))
+    if hasattr(value, "to_list"):
+        return tuple(value.to_list())
+    if hasattr(value, "__len__") and not isinstance(value, str):
+        return tuple(value)
+    return value
+
+
+def preview_signature():
+    """Returns a summary of everything the growth depends on, to know when the live preview is outdated."""
+    scene = bpy.context.scene
+    mtree_props = scene.mtree_props
+    if not mtree_props.use_node_workflow:
+        return tuple((key, to_hashable(mtree_props[key])) for key in sorted(mtree_props.keys())
+                     if key not in PREVIEW_IGNORED_PROPS)
+
+    node_tree = bpy.data.node_groups.get(mtree_props.node_tree)
+    if node_tree is None:
+        return None
+    signature = [mtree_props.node_tree, mtree_props.obstacle]
+    for node in node_tree.nodes:
+        signature.append(node.name)
+        signature += [(key, to_hashable(node[key])) for key in sorted(node.keys())]
+        signature += [to_hashable(getattr(socket, "default_value", None)) for socket in node.inputs]
+        if node.bl_label == 'Curve_Mapping':
+            try:
+                signature += [tuple(point.location) for point in node.curve.points]
+            except KeyError:
+                pass
+    signature += [(link.from_node.name, link.to_node.name, link.to_socket.name) for link in node_tree.links]
+    return tuple(signature)
+
+
+last_preview_signature = [None]
+# True while a tree is made step by step, the live preview would draw random numbers in the middle of its growth
+streaming_tree = [False]
+
+
+@persistent
+def update_live_preview(scene):
+    """Rebuilds the skeleton preview when a setting of the tree changed, while live preview is enabled"""
+    mtree_props = scene.mtree_props
+    if not mtree_props.live_preview:
+        last_preview_signature[0] = None
+        return
+    if streaming_tree[0]:
+        return
+    signature = preview_signature()
+    if signature is None or signature == last_preview_signature[0]:
+        return
+    last_preview_signature[0] = signature
+    create_tree_preview(None, scene.cursor_location)
+
+
+def create_twig(position=Vector((0, 0, 0)), profiler=None):
     scene = bpy.context.scene
     mtree_props = scene.mtree_props
 
-    clock = Clock("create_twig")
+    if profiler is None:
+        profiler = Profiler("create_twig")
 
     save_properties = [i for i in mtree_props.items()]
     update_twig_properties()
@@ -2010,16 +2733,23 @@ def create_twig(position=Vector((0, 0, 0))):
         node_tree = None
 
     tree = Tree(position)
+    tree.profiler = profiler
 
     is_twig = True
 
-    roots(node_tree, tree)
-    trunk(node_tree, tree, is_twig)
-    branches(node_tree, tree, is_twig)
+    with profiler.stage("roots"):
+        roots(node_tree, tree)
+    with profiler.stage("trunk"):
+        trunk(node_tree, tree, is_twig)
+    with profiler.stage("branches"):
+        branches(node_tree, tree, is_twig)
 
-    mesh, obj = tree_object_creation(tree)
+    with profiler.stage("mesh build"):
+        tree_geometry_creation(tree)
+        mesh, obj = tree_object_creation(tree)
     obj["is_tree"] = True
-    tree_uv_creation(tree, mesh)
+    with profiler.stage("uv"):
+        tree_uv_creation(tree, mesh)
     try:
         obj.active_material = bpy.data.materials.get(mtree_props.twig_bark_material)
     except: pass
@@ -2028,25 +2758,32 @@ def create_twig(position=Vector((0, 0, 0))):
     bpy.context.scene.objects.active = obj
     obj["has_armature"] = False
 
-    leafs = []
-    twig_leafs = tree.twig_leafs
-    if bpy.context.scene.objects.get(mtree_props.leaf_object) is not None:
-        for (position, direction) in twig_leafs:
-            if random() < mtree_props.leaf_chance:
+    with profiler.stage("leaves"):
+        leaf_object = bpy.context.scene.objects.get(mtree_props.leaf_object)
+        if leaf_object is not None and leaf_object.type == 'MESH':
+            positions = []
+            directions = []
+            scales = []
+            for (position, direction) in tree.twig_leafs:
                 if random() < mtree_props.leaf_chance:
-                    new_leaf = add_twig_leaf(position, direction, mtree_props.leaf_size, mtree_props.leaf_object, mtree_props.leaf_weight)
-                    leafs.append(new_leaf)
-                    if not bpy.context.active_object.data.materials.items():
-                        mat = bpy.data.materials.get("leaf_mat")
-                        if mat is None:
-                            mat = bpy.data.materials.new(name="leaf_mat")
-                        new_leaf.active_material = mat
-                    obj.select = True
-                    scene.objects.active = obj
-        for i in leafs:
-            i.select = True
-        if not (not leafs):
-            bpy.ops.object.join()
+                    if random() < mtree_props.leaf_chance:
+                        positions.append(position)
+                        directions.append(direction)
+                        scales.append(mtree_props.leaf_size * (2 + random()) / 3)
+
+            if positions:
+                leaf_materials = [slot.material for slot in leaf_object.material_slots]
+                if not mesh.materials:
+                    mat = bpy.data.materials.get("leaf_mat")
+                    if mat is None:
+                        mat = bpy.data.materials.new(name="leaf_mat")
+                    leaf_materials[:1] = [mat]
+                material_offset = len(mesh.materials) if leaf_materials else 0
+                for mat in leaf_materials:
+                    mesh.materials.append(mat)
+
+                matrices = twig_leaf_matrices(numpy.array(directions), numpy.array(scales), mtree_props.leaf_weight)
+                add_mesh_instances(mesh, leaf_object.data, matrices, numpy.array(positions), material_offset)
 
     obj.rotation_euler = (- pi/2, 0, 0)
     obj.scale = Vector((0.25, 0.25, 0.25))
@@ -2054,17 +2791,99 @@ def create_twig(position=Vector((0, 0, 0))):
 
     for (name, value) in save_properties:
         mtree_props[name] = value
-    clock.stop("create_twig")
+    profiler.stop()
     print("\nDeveloper Info:")
-    clock.display()
+    profiler.display()
 
     return obj
 
 
+def remove_obstacle(tree):
+    """Deletes the working copy of the obstacle made by configure_obstacle, and its mesh"""
+    if tree.obs is not None:
+        mesh = tree.obs.data
+        bpy.data.objects.remove(tree.obs, do_unlink=True)
+        bpy.data.meshes.remove(mesh)
+        tree.obs = None
+
+
+# Mesh the skeleton decided by the growth.....................................................
+def tree_geometry_creation(tree):
+    """Places every piece of the skeleton and bridges it to the ring of its parent node.
+
+    Nothing random happens here, so the same skeleton always gives the same mesh. With adaptive rings, the branch
+    rings and end caps of thin branches are replaced by lighter ones, see ring_resolution; splits keep their
+    8 vertex ends.
+    """
+    mtree_props = bpy.context.scene.mtree_props
+    skeleton = tree.skeleton
+    verts = []
+    faces = []
+    uv_list = []
+    vcol_rad = []
+    paint_indexes = []
+    leafs_weight_indexes = []
+    vertex_bones = []  # the bone each vertex follows
+    piece_rings = []  # for each piece, the vertex indexes of each of its exit rings
+    piece_nodes = skeleton.piece_nodes()
+
+    for p, piece in enumerate(skeleton.pieces):
+        template = piece.template
+        n = len(verts)
+        parent_ring = None
+        if piece.parent >= 0:
+            parent_ring = piece_rings[skeleton.node_pieces[piece.parent]][skeleton.slots[piece.parent]]
+
+        if piece.kind == MODULE:
+            template = adaptive_module(mtree_props, template, piece.real_radius)
+            module_verts = [Vector(v) for v in template.verts]
+            ring = join_branch(verts, faces, parent_ring, piece.scale, piece.origin, module_verts, piece.direction,
+                               uv_list, piece.height, piece.uv_scale, len(template.entree))
+            if template.faces:
+                faces += [add_tuple(f, n) for f in template.faces]
+                uv_list += [u for u in template.uv]
+            vcol_rad += [piece.real_radius] * len(module_verts)
+            if piece.leaf_weight:
+                leafs_weight_indexes.append(len(verts) - 1)
+            piece_rings.append([ring])
+            vertex_bones += [skeleton.bones[piece_nodes[p][0]]] * len(module_verts)
+
+        elif piece.kind == SPLIT:
+            jonct_verts = interpolate(template.verts1, template.verts2, piece.inter_fact)
+            i1, i2, to_be_painted = join(verts, faces, parent_ring, jonct_verts, template.faces, piece.scale,
+                                         template.sortie[0], template.sortie[1], template.entree, piece.direction,
+                                         piece.origin, uv_list, template.uv, piece.rotation, piece.height,
+                                         piece.uv_scale)
+            paint_indexes += to_be_painted
+            vcol_rad += [piece.real_radius] * len(jonct_verts)
+            piece_rings.append([i1, i2])
+            # the body of the split follows the bone it grows from, each exit follows its own bone
+            bones = [skeleton.bones[piece.parent]] * len(jonct_verts)
+            for ring, node in zip((i1, i2), piece_nodes[p]):
+                for i in ring:
+                    bones[i - n] = skeleton.bones[node]
+            vertex_bones += bones
+
+        else:
+            exits = [r[1] for r in template.roots] if isinstance(template, RootBase) else [template.sortie[1]]
+            verts += [Vector(v) * piece.scale for v in template.verts]
+            faces += [add_tuple(f, n) for f in template.faces]
+            uv_list += [u for u in template.uv]
+            vcol_rad += [piece.real_radius] * len(template.verts)
+            piece_rings.append([[n + i for i in ring] for ring in exits])
+            vertex_bones += [skeleton.bones[piece_nodes[p][0]]] * len(template.verts)
+
+    tree.verts = verts
+    tree.faces = faces
+    tree.uv_list = uv_list
+    tree.vcol_rad = vcol_rad
+    tree.paint_indexes = paint_indexes
+    tree.leafs_weight_indexes = leafs_weight_indexes
+    tree.vertex_bones = vertex_bones
+
+
 # Transform the tree python object into a blender object......................................
 def tree_object_creation(tree):
-    scene = bpy.context.scene
-    mtree_props = scene.mtree_props
     print("Building Object...")
 
     mesh = bpy.data.meshes.new("tree")
@@ -2086,15 +2905,13 @@ def tree_object_creation(tree):
     bpy.ops.object.shade_smooth()
     #bpy.ops.object.mode_set(mode='EDIT')
     obj.select = False
-    if bpy.data.objects.get(mtree_props.obstacle) is not None:
-        obs = tree.obs
-        bpy.context.scene.objects.unlink(obs)
-        bpy.data.objects.remove(obs)
+    remove_obstacle(tree)
 
     print("Setting Normals...")
-    fix_normals(inside=False)
-    if obj.data.polygons[0].normal.x < 0:
-        fix_normals(inside=True)
+    with tree.profiler.stage("normals"):
+        fix_normals(inside=False)
+        if obj.data.polygons[0].normal.x < 0:
+            fix_normals(inside=True)
 
     return mesh, obj
 
@@ -2192,40 +3009,120 @@ def tree_material_creation(obj):
     scene = bpy.context.scene
     mtree_props = scene.mtree_props
     if mtree_props.mat:
-        obj.active_material = build_bark_material("bark")
+        obj.active_material = get_bark_material("bark")
 
     elif bpy.data.materials.get(mtree_props.bark_material) is not None:
         obj.active_material = bpy.data.materials.get(mtree_props.bark_material)
 
 
+def tree_lod_creation(tree, obj):
+    scene = bpy.context.scene
+    mtree_props = scene.mtree_props
+    obj["lod_count"] = mtree_props.lod_levels
+    for level in range(1, mtree_props.lod_levels + 1):
+        print("Building LOD{}...".format(level))
+        min_radius = mtree_props.lod_min_radius * mtree_props.radius * 2 ** (level - 1)
+        verts, faces, uvs = build_tube_geometry(tree.skeleton, LOD_RING_RESOLUTIONS[level - 1], min_radius,
+                                                LOD_CAPS[level - 1])
+        mesh = bpy.data.meshes.new("{}_LOD{}".format(obj.name, level))
+        mesh.from_pydata(verts, [], faces)
+        mesh.polygons.foreach_set("use_smooth", [True] * len(faces))
+        if mtree_props.uv:
+            mesh.uv_textures.new()
+            mesh.uv_layers.active.data.foreach_set("uv", [c for face_uvs in uvs for uv in face_uvs for c in uv])
+        mesh.update()
+
+        lod = bpy.data.objects.new(mesh.name, mesh)
+        scene.objects.link(lod)
+        lod.parent = obj
+        lod.active_material = obj.active_material
+        lod.hide = True
+        lod["lod_level"] = level
+
+
+def tree_bones_simplification(tree):
+    """Brings the armature down to the bone budget, see simplify_bones. The skin mapping is updated accordingly."""
+    scene = bpy.context.scene
+    mtree_props = scene.mtree_props
+    if mtree_props.create_armature and (mtree_props.bones_target > 0 or mtree_props.bones_min_length > 0
+                                        or mtree_props.bones_min_radius > 0 or mtree_props.bones_merge_angle > 0):
+        bone_radii = {}
+        for bone_name, radius in zip(tree.skeleton.bones, tree.skeleton.radii):
+            if bone_name is not None:
+                bone_radii[bone_name] = max(bone_radii.get(bone_name, 0), radius)
+
+        bone_count = len(tree.bones) + 1
+        target = mtree_props.bones_target - 1 if mtree_props.bones_target > 0 else None
+        tree.bones, remap = simplify_bones(tree.bones, bone_radii, target,
+                                           mtree_props.bones_min_length, mtree_props.bones_min_radius,
+                                           mtree_props.bones_merge_angle)
+        tree.vertex_bones = [remap.get(bone_name, bone_name) for bone_name in tree.vertex_bones]
+        print("Simplifying Armature: {} bones -> {} bones".format(bone_count, len(tree.bones) + 1))
+
+
+def tree_bone_groups_creation(tree, obj):
+    """Writes the skin weights of the armature: one vertex group per bone, holding the vertices of the rings
+    that follow it. The growth already knows this mapping, it is kept in tree.vertex_bones.
+
+    This has to run before anything merges vertices, as long as the vertex indexes are the ones of tree.verts.
+    """
+    scene = bpy.context.scene
+    mtree_props = scene.mtree_props
+    if mtree_props.create_armature:
+        print("Skinning...")
+        groups = {}
+        for i, bone_name in enumerate(tree.vertex_bones):
+            groups.setdefault(bone_name, []).append(i)
+        for bone_name, indexes in groups.items():
+            if bone_name is not None:
+                obj.vertex_groups.new(bone_name).add(indexes, 1.0, 'REPLACE')
+
+
 def tree_armature_creation(tree, obj):
+    """Creates the armature of the tree and skins the tree to it.
+
+    The vertex groups are already written by tree_bone_groups_creation, Blender's automatic (heat) weights
+    are not needed.
+    """
     scene = bpy.context.scene
     mtree_props = scene.mtree_props
     if mtree_props.create_armature:
         print("Building Armature...")
-        bpy.ops.object.add(type='ARMATURE', enter_editmode=True, location=Vector((0, 0, 0)))
-        arm = bpy.context.object
+        amt = bpy.data.armatures.new("Armature")
+        amt.draw_type = 'STICK'
+        arm = bpy.data.objects.new("Armature", amt)
+        arm.location = obj.location
         arm.show_x_ray = True
-        amt = arm.data
-        arm.data.draw_type = 'STICK'
+        scene.objects.link(arm)
+
+        # all the bones are created in a single edit mode session
+        scene.objects.active = arm
+        bpy.ops.object.mode_set(mode='EDIT')
+        edit_bones = {}
         bone = amt.edit_bones.new('1')
         bone.head = Vector((0, 0, 0))
         bone.tail = Vector((0, 0, 1))
-
+        edit_bones['1'] = bone
         for (pname, name, h, t) in tree.bones:
             bone = amt.edit_bones.new(str(name))
-            bone.parent = arm.data.edit_bones[str(pname)]
-            bone.use_connect = True
+            bone.parent = edit_bones[str(pname)]
             bone.head = h
             bone.tail = t
+            # a bone whose parent was dropped by the simplification doesn't start at its new parent tail
+            bone.use_connect = (bone.parent.tail - bone.head).length < 1e-5
+            edit_bones[str(name)] = bone
+        bpy.ops.object.mode_set(mode='OBJECT')
 
-        bpy.ops.object.editmode_toggle()
-        bpy.ops.object.select_all(action='DESELECT')
-        obj.select = True
-        arm.select = True
-        bpy.context.scene.objects.active = arm
-        bpy.ops.object.parent_set(type='ARMATURE_AUTO')
-        bpy.ops.object.select_all(action='DESELECT')
+        modifier = obj.modifiers.new("Armature", 'ARMATURE')
+        modifier.object = arm
+        modifier.use_vertex_groups = True
+        obj.parent = arm
+        # arm.matrix_world isn't evaluated until the next scene update, the armature is only translated
+        obj.matrix_parent_inverse = Matrix.Translation(arm.location).inverted()
+
+        arm.select = False
+        obj.select = False
+        scene.objects.active = obj
 # .............................................................................................
 
 
@@ -2239,87 +3136,110 @@ def roots(node_tree, tree):
     print("generating Roots")
     if node_tree:
         update_curve_properties(node_tree, tree.iteration_curve_props, 0)
-    tree.verts = [Vector(v) * mtree_props.radius for v in root.verts ]
-    tree.faces = [f for f in root.faces]
-    extr = [i for i in root.sortie[1]]
-    tree.uv_list = [u for u in root.uv]
-    tree.vcol_rad = [mtree_props.radius] * len(tree.verts)
     height = root.uv_height
     last_bone = (1, Vector((0, 0, 1)))
-    tree.extremities = [(extr, mtree_props.radius, Vector((0, 0, 1)), last_bone, mtree_props.preserve_trunk, 0, height, tree.using_grease-1)]
+    # the base node is the center of the lowest ring of the root module
+    base_vert = root.verts[24]
+    base = tree.skeleton.add_node(Vector((0, 0, base_vert.z)) * mtree_props.radius, Vector((0, 0, 1)),
+                                  base_vert.y * mtree_props.radius, -1, 0, TRUNK)
+    piece = tree.skeleton.add_piece(BASE, root, scale=mtree_props.radius, real_radius=mtree_props.radius)
+    extr = [Vector(root.verts[i]) * mtree_props.radius for i in root.sortie[1]]
+    node = tree.skeleton.add_node(sum(extr, Vector((0, 0, 0))) / len(extr), Vector((0, 0, 1)),
+                                  (extr[0] - extr[4]).length / 2, base, 0, TRUNK, piece)
+    tree.skeleton.bones[base] = tree.skeleton.bones[node] = "1"
+    tree.extremities = [(node, mtree_props.radius, Vector((0, 0, 1)), last_bone, mtree_props.preserve_trunk, 0, height, tree.using_grease-1)]
 
     if mtree_props.roots_iteration > 0:
         mtree_props.create_roots = True
         tree.roots_to_create = True
 
 
-def late_roots(node_tree, tree):
-    scene = bpy.context.scene
-    mtree_props = scene.mtree_props
+def late_roots_layers(node_tree, tree):
+    """Grows the roots one layer at a time, yielding the iteration after each layer."""
+    mtree_props = tree.props
     print("generating late roots")
     tree.last_iteration = mtree_props.roots_iteration
-    n = len(tree.verts)
-    tree.verts += [Vector(v) * mtree_props.radius for v in R1.verts]
-    tree.vcol_rad += [mtree_props.radius] * len(R1.verts)
-    tree.faces += [add_tuple(f, n) for f in R1.faces]
-    tree.uv_list += R1.uv
+    piece = tree.skeleton.add_piece(BASE, R1, scale=mtree_props.radius, real_radius=mtree_props.radius)
     tree.extremities = []
-    for r in R1.roots:
-        extr = [n + i for i in r[1]]
-        rad = (tree.verts[extr[0]] - tree.verts[extr[4]]).length / 2
+    for k, r in enumerate(R1.roots):
+        extr = [Vector(R1.verts[i]) * mtree_props.radius for i in r[1]]
+        rad = (extr[0] - extr[4]).length / 2
         direction = Vector(r[0])
-        tree.extremities.append((extr, rad, direction, None, False, 0, 0, -1))
+        node = tree.skeleton.add_node(sum(extr, Vector((0, 0, 0))) / len(extr), direction, rad, 0, 0, ROOTS,
+                                      piece, k)
+        tree.skeleton.bones[node] = "1"
+        tree.extremities.append((node, rad, direction, None, False, 0, 0, -1))
 
     for iteration in range(mtree_props.roots_iteration):
-        if node_tree:
-            update_curve_properties(node_tree, tree.iteration_curve_props, iteration/tree.last_iteration)
-        tree.add_branch_layer(iteration, branch_type='Roots')
+        with tree.profiler.stage("layer {}".format(iteration)):
+            if node_tree:
+                update_curve_properties(node_tree, tree.iteration_curve_props, iteration/tree.last_iteration)
+            tree.add_branch_layer(iteration, branch_type='Roots')
+        yield iteration
 
 
-def trunk(node_tree, tree, is_twig=False):
-    scene = bpy.context.scene
-    mtree_props = scene.mtree_props
+def late_roots(node_tree, tree):
+    for _ in late_roots_layers(node_tree, tree):
+        pass
+
+
+def trunk_layers(node_tree, tree, is_twig=False):
+    """Grows the trunk one layer at a time, yielding the iteration after each layer."""
+    mtree_props = tree.props
     print("generating trunk")
     tree.last_iteration = mtree_props.preserve_end if mtree_props.preserve_trunk else mtree_props.trunk_length
     for iteration in range(mtree_props.trunk_length):
-        if node_tree:
-            update_curve_properties(node_tree, tree.iteration_curve_props, iteration / tree.last_iteration)
-        tree.add_branch_layer(iteration, branch_type="Branch", is_twig=is_twig)
+        with tree.profiler.stage("layer {}".format(iteration)):
+            if node_tree:
+                update_curve_properties(node_tree, tree.iteration_curve_props, iteration / tree.last_iteration)
+            tree.add_branch_layer(iteration, branch_type="Branch", is_twig=is_twig)
+        tree.profiler.count("extremities", len(tree.extremities))
+        yield iteration
 
 
-def branches(node_tree, tree, is_twig=False):
-    scene = bpy.context.scene
-    mtree_props = scene.mtree_props
+def trunk(node_tree, tree, is_twig=False):
+    for _ in trunk_layers(node_tree, tree, is_twig):
+        pass
+
+
+def branches_layers(node_tree, tree, is_twig=False):
+    """Grows the branches one layer at a time, yielding the iteration after each layer."""
+    mtree_props = tree.props
     print("generating branches")
     tree.last_iteration = mtree_props.iteration
     for iteration in range(mtree_props.trunk_length, mtree_props.iteration + mtree_props.trunk_length):
-        if node_tree:
-            update_curve_properties(node_tree, tree.iteration_curve_props, iteration / tree.last_iteration)
-        tree.add_branch_layer(iteration, branch_type="Branch", is_twig=is_twig)
+        with tree.profiler.stage("layer {}".format(iteration)):
+            if node_tree:
+                update_curve_properties(node_tree, tree.iteration_curve_props, iteration / tree.last_iteration)
+            tree.add_branch_layer(iteration, branch_type="Branch", is_twig=is_twig)
+        tree.profiler.count("extremities", len(tree.extremities))
+        yield iteration
+
+
+def branches(node_tree, tree, is_twig=False):
+    for _ in branches_layers(node_tree, tree, is_twig):
+        pass
 
 
 def create_leafs_emitter(pos, leafs, parent):
     scene = bpy.context.scene
     mtree_props = scene.mtree_props
     if mtree_props.particle:
-        verts = []
-        faces = []
-        for (position, direction) in leafs:
-            add_leaf(position, direction, verts, faces)
+        quads = leaf_quads(leafs)
+        n = len(quads)
 
         print("Building leafs emitter...")
 
         mesh = bpy.data.meshes.new("leafs_emitter")
-        bm = bmesh.new()
-        bm.from_mesh(mesh)
-        for v in verts:
-            bm.verts.new(v)
-        bm.verts.ensure_lookup_table()
-        for f in faces:
-            bm.faces.new([bm.verts[i] for i in f])
+        mesh.vertices.add(n * 4)
+        mesh.loops.add(n * 4)
+        mesh.polygons.add(n)
+        mesh.vertices.foreach_set("co", quads.astype(numpy.float32).ravel())
+        mesh.loops.foreach_set("vertex_index", numpy.arange(n * 4, dtype=numpy.int32))
+        mesh.polygons.foreach_set("loop_start", numpy.arange(0, n * 4, 4, dtype=numpy.int32))
+        mesh.polygons.foreach_set("loop_total", numpy.full(n, 4, dtype=numpy.int32))
+        mesh.update(calc_edges=True)
 
-        bm.to_mesh(mesh)
-        bm.free()
         obj = bpy.data.objects.new("leafs_emitter", mesh)
         obj.location = pos
         bpy.context.scene.objects.link(obj)
@@ -2328,7 +3248,191 @@ def create_leafs_emitter(pos, leafs, parent):
 
         print("Configuring Particle System...")
         create_system(obj, mtree_props.number, mtree_props.display, None, mtree_props.twig_particle,
-                      mtree_props.particle_size, emitter=True, max_number=len(faces))
+                      mtree_props.particle_size, emitter=True, max_number=n)
+
+
+def leaf_transforms(leafs, number, size):
+    """Computes the final position, orientation and scale of the leaves once, instead of letting a particle
+    system distribute them on every update.
+
+    One leaf at most is put on each leaf position, somewhere on the quad the emitter would have, turned
+    randomly around the quad normal.
+
+    Args:
+        leafs - (list of (Vector, Vector)) The position and the branch direction of each leaf
+        number - (int) The maximum number of leaves
+        size - (float) The leaf size, as the particle size
+
+    Returns:
+        positions - (numpy array of shape (n, 3)) The location of each leaf
+        matrices - (numpy array of shape (n, 3, 3)) The rotation of each leaf, its Z axis being the leaf normal
+        scales - (numpy array of shape (n,)) The scale of each leaf
+    """
+    quads = leaf_quads(leafs)
+    count = min(number, len(quads))
+    # a single draw from the tree random sequence seeds everything else, so the leaves still follow the tree seed
+    generator = numpy.random.RandomState(int(random() * 2 ** 31))
+    quads = quads[numpy.sort(generator.choice(len(quads), count, replace=False))]
+
+    centers = quads.mean(axis=1)
+    v1 = quads[:, 0] - centers
+    v2 = quads[:, 1] - centers
+    normals = numpy.cross(v1, v2)
+    normals /= numpy.linalg.norm(normals, axis=1)[:, None]
+    tangents = v1 / numpy.linalg.norm(v1, axis=1)[:, None]
+    bitangents = numpy.cross(normals, tangents)
+
+    jitter = generator.uniform(-1, 1, (count, 2))
+    positions = centers + v1 * jitter[:, :1] + v2 * jitter[:, 1:]
+
+    angles = generator.uniform(-.3 * pi, .3 * pi, count)[:, None]
+    x_axis = tangents * numpy.cos(angles) + bitangents * numpy.sin(angles)
+    y_axis = numpy.cross(normals, x_axis)
+    matrices = numpy.stack((x_axis, y_axis, normals), axis=2)
+
+    # same size distribution as the particle system: size_random of .25
+    scales = .1 * size * (1 - .25 * generator.random_sample(count))
+    return positions, matrices, scales
+
+
+def leaf_clumps(positions, cell_size, variants):
+    """Groups the leaves lying in the same cell of a grid into clumps.
+
+    Cells are ranked by number of leaves and split in as many bins as there are variants. The median cell of
+    each bin is the template the clump mesh of that variant is built from, and every cell of the bin is an
+    instance of it.
+
+    Args:
+        positions - (numpy array of shape (n, 3)) The location of each leaf
+        cell_size - (float) The size of the grid cells
+        variants - (int) The number of different clump meshes
+
+    Returns:
+        (list of (numpy array, numpy array, numpy array)) For each variant, the indexes of the leaves of the
+            template clump, the center of the template clump and the centers of all the instances
+    """
+    cells = numpy.floor(positions / cell_size).astype(numpy.int64)
+    cells -= cells.min(axis=0)
+    dims = cells.max(axis=0) + 1
+    keys = (cells[:, 0] * dims[1] + cells[:, 1]) * dims[2] + cells[:, 2]
+    unique_keys, cell_of_leaf, counts = numpy.unique(keys, return_inverse=True, return_counts=True)
+    n_cells = len(unique_keys)
+    centers = numpy.column_stack([numpy.bincount(cell_of_leaf, weights=positions[:, i]) / counts for i in range(3)])
+
+    ranked = numpy.argsort(counts, kind='mergesort')
+    variants = max(1, min(variants, n_cells))
+    clumps = []
+    for bin_cells in numpy.array_split(ranked, variants):
+        template = bin_cells[len(bin_cells) // 2]
+        clumps.append((numpy.nonzero(cell_of_leaf == template)[0], centers[template], centers[bin_cells]))
+    return clumps
+
+
+def face_instancer(name, positions, matrices, scales, instanced, parent, location):
+    """Instances an object on the faces of a new mesh, one face per instance.
+
+    The face center is the instance location, its normal and first edge give the instance orientation
+    and its size gives the instance scale, as Blender does for dupli faces.
+
+    Args:
+        name - (string) The name of the instancer object
+        positions - (numpy array of shape (n, 3)) The location of each instance
+        matrices - (numpy array of shape (n, 3, 3)) The rotation of each instance
+        scales - (numpy array of shape (n,)) The scale of each instance
+        instanced - (bpy.types.Object) The object to instance, it is parented to the instancer
+        parent - (bpy.types.Object) The parent of the instancer
+        location - (Vector) The location of the instancer
+
+    Returns:
+        (bpy.types.Object) The instancer object
+    """
+    scene = bpy.context.scene
+    n = len(positions)
+    corners = numpy.array([(-1, -1, 0), (1, -1, 0), (1, 1, 0), (-1, 1, 0)]) / 2
+    quads = numpy.einsum('nij,kj->nki', matrices, corners) * scales[:, None, None] + positions[:, None, :]
+
+    mesh = bpy.data.meshes.new(name)
+    mesh.vertices.add(n * 4)
+    mesh.loops.add(n * 4)
+    mesh.polygons.add(n)
+    mesh.vertices.foreach_set("co", quads.astype(numpy.float32).ravel())
+    mesh.loops.foreach_set("vertex_index", numpy.arange(n * 4, dtype=numpy.int32))
+    mesh.polygons.foreach_set("loop_start", numpy.arange(0, n * 4, 4, dtype=numpy.int32))
+    mesh.polygons.foreach_set("loop_total", numpy.full(n, 4, dtype=numpy.int32))
+    mesh.update(calc_edges=True)
+
+    obj = bpy.data.objects.new(name, mesh)
+    obj.location = location
+    scene.objects.link(obj)
+    obj["emitter"] = True
+    obj.parent = parent
+    obj.dupli_type = 'FACES'
+    obj.use_dupli_faces_scale = True
+    obj.dupli_faces_scale = 1
+
+    instanced.parent = obj
+    instanced.location = (0, 0, 0)
+    instanced.rotation_euler = (0, 0, 0)
+    instanced.scale = (1, 1, 1)
+    if instanced.name not in scene.objects:
+        scene.objects.link(instanced)
+    return obj
+
+
+def create_leafs_instancer(pos, leafs, parent):
+    """Instances the leaf object on precomputed leaf transforms, without any particle system.
+
+    When leaf_clump_size is set, nearby leaves are grouped into a few pre-built clump meshes which are
+    instanced instead of the single leaves.
+
+    Args:
+        pos - (Vector) The location of the tree
+        leafs - (list of (Vector, Vector)) The position and the branch direction of each leaf
+        parent - (bpy.types.Object) The tree object
+
+    Returns:
+        instancers - (list of bpy.types.Object) The instancer objects, empty if there is no leaf object
+        leaf_count - (int) The number of leaves
+        instance_count - (int) The number of instances
+    """
+    scene = bpy.context.scene
+    mtree_props = scene.mtree_props
+    leaf_object = bpy.data.objects.get(mtree_props.twig_particle)
+    if leaf_object is None:
+        return [], 0, 0
+
+    print("Computing leaf transforms...")
+    positions, matrices, scales = leaf_transforms(leafs, mtree_props.number, mtree_props.particle_size)
+    if mtree_props.leaf_clump_size <= 0 or leaf_object.type != 'MESH' or len(positions) == 0:
+        # the instanced object is a linked copy of the leaf, so the leaf object itself stays where it is
+        instancer = face_instancer("leafs_instancer", positions, matrices, scales, leaf_object.copy(), parent, pos)
+        return [instancer], len(positions), len(positions)
+
+    print("Building leaf clumps...")
+    leaf_materials = [slot.material for slot in leaf_object.material_slots]
+    generator = numpy.random.RandomState(int(random() * 2 ** 31))
+    instancers = []
+    instance_count = 0
+    for variant, (template, center, instances) in enumerate(leaf_clumps(positions, mtree_props.leaf_clump_size,
+                                                                        mtree_props.leaf_clump_variants)):
+        clump_mesh = bpy.data.meshes.new("leaf_clump")
+        for mat in leaf_materials:
+            clump_mesh.materials.append(mat)
+        add_mesh_instances(clump_mesh, leaf_object.data, matrices[template] * scales[template, None, None],
+                           positions[template] - center)
+        clump = bpy.data.objects.new("leaf_clump_{}".format(variant), clump_mesh)
+
+        # every instance of a clump is turned randomly around Z so that repetitions don't show
+        angles = generator.uniform(0, 2 * pi, len(instances))
+        rotations = numpy.zeros((len(instances), 3, 3))
+        rotations[:, 0, 0] = rotations[:, 1, 1] = numpy.cos(angles)
+        rotations[:, 1, 0] = numpy.sin(angles)
+        rotations[:, 0, 1] = -rotations[:, 1, 0]
+        rotations[:, 2, 2] = 1
+        instancers.append(face_instancer("leaf_clumps_{}".format(variant), instances, rotations,
+                                         numpy.ones(len(instances)), clump, parent, pos))
+        instance_count += len(instances)
+    return instancers, len(positions), instance_count
 
 
 
@@ -21,7 +21,7 @@ import bpy
 from bpy.types import Operator, Panel, Scene, Menu, AddonPreferences
 import mathutils
 
-from .prep_manager import save_everything
+from .prep_manager import save_everything, deferred_save
 from .logo import display_logo
 
 
@@ -107,6 +107,7 @@ class WindOperator(Operator):
             displace.texture = bpy.data.textures[wind_texture.name]
             displace.vertex_group = wind_group.name
 
+        deferred_save(self)
         return {'FINISHED'}
 
 